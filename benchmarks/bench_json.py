@@ -0,0 +1,117 @@
+"""Compare the ways of loading the sounds and commands files
+
+Writes sounds.json and commands.json files of about each --size megabytes in
+total, then loads both: by parsing them with json.load and validating the
+objects with model_validate, as the bot used to; and by reading their bytes with
+JsonFiles and validating them with model_validate_json, as SoundsDir does. The
+peak memory of each is measured in a separate run with tracemalloc.
+
+Usage: python benchmarks/bench_json.py [--size MB ...] [--repeat R] [--depth D]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from synthetic import LibrarySpec, _commands, _sound
+
+from wowbot.model.command import CommandsJson
+from wowbot.model.jsonfile import JsonFiles
+from wowbot.model.sound import SoundsJson
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE
+
+
+def write_files(folder: Path, megabytes: float, depth: int) -> LibrarySpec:
+    """Write the two files, with enough sounds to make about megabytes"""
+    sample = LibrarySpec(sounds=1000, depth=depth)
+    per_sound = (
+        len(json.dumps([_sound(i, sample) for i in range(sample.sounds)], indent=1))
+        + len(json.dumps(_commands(sample), indent=1))
+    ) / sample.sounds
+    spec = LibrarySpec(sounds=max(1, int(megabytes * 1e6 / per_sound)), depth=depth)
+
+    sounds = {"version": 1, "sounds": [_sound(i, spec) for i in range(spec.sounds)]}
+    with open(folder / SOUNDS_FILE, "w") as f:
+        json.dump(sounds, f, indent=1)
+    with open(folder / COMMANDS_FILE, "w") as f:
+        json.dump({"version": 1, "commands": _commands(spec)}, f, indent=1)
+    return spec
+
+
+def load_parsed(folder: Path) -> None:
+    with open(folder / SOUNDS_FILE) as f:
+        SoundsJson.model_validate(json.load(f))
+    with open(folder / COMMANDS_FILE) as f:
+        CommandsJson.model_validate(json.load(f))
+
+
+def load_bytes(folder: Path) -> None:
+    files = JsonFiles(Path.read_bytes, [folder / SOUNDS_FILE, folder / COMMANDS_FILE])
+    files.validate(SoundsJson, folder / SOUNDS_FILE)
+    files.validate(CommandsJson, folder / COMMANDS_FILE)
+
+
+PATHS: Dict[str, Callable[[Path], None]] = {
+    "parsed": load_parsed,
+    "bytes": load_bytes,
+}
+
+
+def time_path(load: Callable[[Path], None], folder: Path, repeat: int) -> List[float]:
+    times: List[float] = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        load(folder)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(load: Callable[[Path], None], folder: Path) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        load(folder)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=float, nargs="+", default=[1.0, 4.0, 16.0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=1)
+    options = parser.parse_args()
+
+    print(f"{'size':>8}{'sounds':>9}{'path':>8}{'median':>12}{'MB/s':>8}{'peak':>11}")
+    for megabytes in options.size:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            spec = write_files(folder, megabytes, options.depth)
+            paths = [folder / SOUNDS_FILE, folder / COMMANDS_FILE]
+            size = sum(path.stat().st_size for path in paths) / 1e6
+
+            medians: Dict[str, float] = {}
+            for name, load in PATHS.items():
+                median = medians[name] = statistics.median(
+                    time_path(load, folder, options.repeat)
+                )
+                peak = peak_memory(load, folder) / 1e6
+                print(
+                    f"{size:>5.1f} MB{spec.sounds:>9}{name:>8}"
+                    f"{median * 1000:>9.1f} ms{size / median:>8.1f}{peak:>8.1f} MB"
+                )
+            print(f"{'':>17}speedup {medians['parsed'] / medians['bytes']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
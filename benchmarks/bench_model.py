@@ -0,0 +1,217 @@
+"""Time the model layer on a synthetic sounds folder
+
+Generates a folder with synthetic.py, then times each stage of loading it:
+parsing and validating the JSON files, indexing and resolving the sound files,
+checking the commands, sampling sounds, building the slash command cog, and
+writing and reading a snapshot. Each stage is run --repeat times.
+
+Results can be saved with --json, and compared with a saved run with --compare;
+the exit status is 1 if any stage is slower than the saved run by more than
+--threshold.
+
+Usage: python benchmarks/bench_model.py [--sounds N] [--files-per-glob F]
+           [--depth D] [--repeat R] [--jobs J] [--json OUT] [--compare OLD]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from synthetic import LibrarySpec, make_library
+
+from wowbot.discord.slash import make_cog_type
+from wowbot.discord.sound import SoundPlayer
+from wowbot.model.command import CommandsJson
+from wowbot.model.index import DirectoryIndex
+from wowbot.model.snapshot import SNAPSHOT_FILE
+from wowbot.model.sound import SoundsJson
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE, SoundsDir
+
+RESULTS_VERSION = 1
+
+
+class Bench:
+    def __init__(self, folder: Path, jobs: int, samples: int) -> None:
+        self.folder = folder
+        self.jobs = jobs
+        self.samples = samples
+        self.sounds_path = folder / SOUNDS_FILE
+        self.commands_path = folder / COMMANDS_FILE
+
+        # Each stage starts from the previous stages' results
+        self.sounds_data = json.loads(self.sounds_path.read_text())
+        self.commands_data = json.loads(self.commands_path.read_text())
+        self.sounds = SoundsJson.model_validate(self.sounds_data)
+        self.commands = CommandsJson.model_validate(self.commands_data)
+        self.index = DirectoryIndex(folder, jobs=jobs)
+        self.collection = self.sounds.resolve_files(folder, self.index, jobs=jobs)
+        self.snapshot = SoundsDir.from_folder(folder, use_snapshot=False).to_snapshot()
+
+    def parse(self) -> None:
+        json.loads(self.sounds_path.read_text())
+        json.loads(self.commands_path.read_text())
+
+    def validate_sounds(self) -> None:
+        SoundsJson.model_validate(self.sounds_data)
+
+    def validate_commands(self) -> None:
+        CommandsJson.model_validate(self.commands_data)
+
+    def index_folder(self) -> None:
+        DirectoryIndex(self.folder, jobs=self.jobs)
+
+    def resolve(self) -> None:
+        self.sounds.resolve_files(self.folder, self.index, jobs=self.jobs)
+
+    def check_sounds(self) -> None:
+        self.commands.check_sounds(self.collection)
+
+    def sample(self) -> None:
+        sounds = list(self.collection.values())
+        for sound in random.choices(sounds, k=self.samples):
+            sound.random()
+
+    def cog(self) -> None:
+        cog_type = make_cog_type(self.commands, self.collection)
+        cog_type(self.commands, self.collection, SoundPlayer())
+
+    def load(self) -> None:
+        SoundsDir.from_folder(self.folder, jobs=self.jobs, use_snapshot=False)
+
+    def write_snapshot(self) -> None:
+        self.snapshot.write(
+            self.folder / SNAPSHOT_FILE,
+            self.sounds_path,
+            self.folder,
+            self.commands_path,
+        )
+
+    def load_snapshot(self) -> None:
+        SoundsDir.from_folder(self.folder, jobs=self.jobs, use_snapshot=True)
+
+    def stages(self) -> Dict[str, Callable[[], None]]:
+        return {
+            "parse": self.parse,
+            "validate_sounds": self.validate_sounds,
+            "validate_commands": self.validate_commands,
+            "index": self.index_folder,
+            "resolve": self.resolve,
+            "check_sounds": self.check_sounds,
+            "sample": self.sample,
+            "cog": self.cog,
+            "load": self.load,
+            "write_snapshot": self.write_snapshot,
+            "load_snapshot": self.load_snapshot,
+        }
+
+
+def time_stage(stage: Callable[[], None], repeat: int) -> List[float]:
+    times: List[float] = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float):
+    """Print how each stage's median changed, returning the slower stages"""
+    if baseline.get("spec") != results["spec"]:
+        print("warning: the baseline used a different library", file=sys.stderr)
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    print(f"{'stage':<20}{'before':>14}{'after':>14}{'change':>10}")
+    slower: List[str] = []
+    for name, stage in results["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if old is None:
+            continue
+        change = stage["median"] / old["median"] - 1
+        flag = ""
+        if change > threshold:
+            slower.append(name)
+            flag = "  slower"
+        print(
+            f"{name:<20}{old['median'] * 1000:>11.2f} ms"
+            f"{stage['median'] * 1000:>11.2f} ms{change:>+10.1%}{flag}"
+        )
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    LibrarySpec.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument("--json", type=Path, help="Save the results to this file")
+    parser.add_argument("--compare", type=Path, help="Compare with saved results")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    options = parser.parse_args()
+
+    spec = LibrarySpec.from_options(options)
+    results: Dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "spec": asdict(spec),
+        "jobs": options.jobs,
+        "samples": options.samples,
+        "stages": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "sounds"
+        make_library(folder, spec)
+        print(f"{spec.sounds} sounds, {spec.files()} files, depth {spec.depth}")
+        bench = Bench(folder, options.jobs, options.samples)
+
+        print(f"{'stage':<20}{'median':>14}{'min':>14}")
+        for name, stage in bench.stages().items():
+            times = time_stage(stage, options.repeat)
+            median = statistics.median(times)
+            results["stages"][name] = {
+                "median": median,
+                "min": min(times),
+                "times": times,
+            }
+            print(f"{name:<20}{median * 1000:>11.2f} ms{min(times) * 1000:>11.2f} ms")
+
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare OggOpusAudio with FFmpegOpusAudio.from_probe
+
+Generates an Ogg Opus file with ffmpeg, then plays it through each source,
+reading every packet as fast as possible. Reports the time to the first packet,
+and the CPU time per stream, including the CPU time of ffmpeg and ffprobe.
+
+Usage: python benchmarks/bench_oggopus.py [--streams N] [--seconds S]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List, Tuple
+
+from discord import AudioSource, FFmpegOpusAudio
+
+from wowbot.discord.sound import OggOpusAudio, is_native_opus
+from wowbot.model.transcode import opus_transcode_args
+
+
+def make_sound(path: Path, seconds: float) -> None:
+    args = opus_transcode_args(f"sine=frequency=440:duration={seconds}", str(path))
+    args[args.index("-i") : args.index("-i")] = ["-f", "lavfi"]
+    subprocess.run(args, check=True)
+
+
+def cpu_time() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+async def measure(
+    make_source: Callable[[], Awaitable[AudioSource]],
+) -> Tuple[float, float, int]:
+    cpu = cpu_time()
+    start = time.perf_counter()
+    source = await make_source()
+    packets = 1 if source.read() else 0
+    first = time.perf_counter() - start
+    while source.read():
+        packets += 1
+    source.cleanup()
+    return first, cpu_time() - cpu, packets
+
+
+async def bench(path: Path, streams: int) -> None:
+    async def native() -> AudioSource:
+        return OggOpusAudio(path) if is_native_opus(path) else await probe()
+
+    async def probe() -> AudioSource:
+        return await FFmpegOpusAudio.from_probe(str(path))
+
+    print(f"{'source':<12}{'first packet':>16}{'cpu/stream':>16}{'packets':>10}")
+    for name, make_source in [("native", native), ("from_probe", probe)]:
+        results: List[Tuple[float, float, int]] = []
+        for _ in range(streams):
+            results.append(await measure(make_source))
+        first = statistics.median(r[0] for r in results) * 1000
+        cpu = statistics.median(r[1] for r in results) * 1000
+        print(f"{name:<12}{first:>13.2f} ms{cpu:>13.2f} ms{results[0][2]:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sine.opus"
+        make_sound(path, options.seconds)
+        asyncio.run(bench(path, options.streams))
+
+
+if __name__ == "__main__":
+    main()
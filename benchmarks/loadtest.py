@@ -0,0 +1,281 @@
+"""Load-test the sounds cog offline, across many simulated guilds
+
+Builds the cog with make_cog for a synthetic sounds folder (or --folder), then
+fires --invocations slash command invocations at random commands in --guilds
+guilds, --rate a second (or all at once if it is 0). Each guild has a member in
+a voice channel, whose voice client reads the sources it is given a packet
+every 20ms and counts them, like Discord's audio player without a connection.
+
+Reports the throughput of the invocations, how late the event loop ran, the
+most ffmpeg processes running at once, and the time from each played sound's
+invocation to its first packet, with the time spent in each phase of playing
+it as traced by wowbot.discord.trace. The synthetic files are Ogg Opus by default,
+so are played without ffmpeg; --opus-frames 0 makes empty files which need it.
+
+Usage: python benchmarks/loadtest.py [--guilds G] [--invocations N] [--rate R]
+           [--folder FOLDER] [--pool P] [--frame-cache-mb M] [--json OUT]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from discord import SlashCommandGroup
+from synthetic import LibrarySpec, make_library
+
+from wowbot.discord.ffmpegpool import FFmpegWorkerPool
+from wowbot.discord.framecache import OpusFrameCache
+from wowbot.discord.metrics import count_children
+from wowbot.discord.slash import BaseSoundsCog, ChoiceSlashCommand, make_cog
+from wowbot.discord.sound import SoundPlayer
+from wowbot.discord.trace import PHASES, RingBufferSink, Tracer
+from wowbot.discord.voice import VoiceManager
+from wowbot.model.main import BENCH_PERCENTILES, percentile
+from wowbot.model.soundsdir import SoundsDir
+
+# The fake Discord objects are shared with the tests
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tests.fakes import (  # noqa: E402
+    FakeChannel,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    RecordingVoiceClient,
+)
+
+LAG_INTERVAL = 0.01
+PROCESS_INTERVAL = 0.05
+
+
+def leaf_commands(cog: BaseSoundsCog) -> List[Tuple[Any, List[str]]]:
+    """Get the cog's commands which play sounds, and their choices' values"""
+    leaves: List[Tuple[Any, List[str]]] = []
+    for command in cog.walk_commands():
+        if isinstance(command, SlashCommandGroup):
+            continue
+        choices: List[str] = []
+        if isinstance(command, ChoiceSlashCommand):
+            choices = [str(choice.value) for choice in command.options[0].choices]
+        leaves.append((command, choices))
+    return leaves
+
+
+@dataclass
+class Monitor:
+    lags: List[float] = field(default_factory=list)
+    processes: List[int] = field(default_factory=list)
+    _stopped: threading.Event = field(default_factory=threading.Event)
+
+    async def watch_loop(self) -> None:
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+    def watch_processes(self) -> None:
+        # In a thread, so reading /proc doesn't add to the loop's lag
+        while not self._stopped.wait(PROCESS_INTERVAL):
+            running = count_children("ffmpeg")
+            if running is None:
+                return
+            self.processes.append(running)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def summarise(times: List[float]) -> Dict[str, float] | None:
+    if not times:
+        return None
+    summary = {f"p{p}": percentile(times, p) for p in BENCH_PERCENTILES}
+    summary["max"] = max(times)
+    return summary
+
+
+async def run(
+    soundsdir: SoundsDir, options: argparse.Namespace, pool: FFmpegWorkerPool | None
+) -> Dict[str, Any]:
+    frame_cache = None
+    if options.frame_cache_mb:
+        frame_cache = OpusFrameCache(options.frame_cache_mb * 1024 * 1024)
+    # Every trace is kept, and the time to first packet is the total phase
+    traces = RingBufferSink(options.invocations)
+    player = SoundPlayer(
+        transcode_cache=soundsdir.transcode_cache,
+        probe_cache=soundsdir.probe_cache,
+        frame_cache=frame_cache,
+        ffmpeg_pool=pool,
+        archive=soundsdir.archive,
+        voice=VoiceManager(idle_timeout=0),
+        tracer=Tracer([traces]),
+    )
+    cog = make_cog(soundsdir, player)
+    leaves = leaf_commands(cog)
+
+    def make_client(channel: FakeChannel) -> RecordingVoiceClient:
+        return RecordingVoiceClient(channel, paced=not options.unpaced)
+
+    members: List[FakeMember] = []
+    for index in range(options.guilds):
+        guild = FakeGuild(index)
+        channel = FakeChannel(index, guild, options.connect_delay, make_client)
+        members.append(FakeMember(index, guild, channel))
+
+    rng = random.Random(options.seed)
+    contexts: List[FakeContext] = []
+
+    async def invoke() -> None:
+        command, choices = rng.choice(leaves)
+        ctx = FakeContext(command.name, rng.choice(members))
+        contexts.append(ctx)
+        if choices:
+            await command.callback(cog, ctx, rng.choice(choices))
+        else:
+            await command.callback(cog, ctx)
+
+    monitor = Monitor()
+    lag_task = asyncio.get_running_loop().create_task(monitor.watch_loop())
+    process_thread = threading.Thread(target=monitor.watch_processes, daemon=True)
+    process_thread.start()
+
+    start = time.perf_counter()
+    tasks: List[asyncio.Task[None]] = []
+    for index in range(options.invocations):
+        if options.rate:
+            delay = start + index / options.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.get_running_loop().create_task(invoke()))
+    await asyncio.gather(*tasks)
+    invoked = time.perf_counter() - start
+
+    while any(queue.task is not None for queue in player._queues.values()):
+        await asyncio.sleep(0.001)
+    drained = time.perf_counter() - start
+    # Let the last sources reach their first packet
+    await asyncio.sleep(options.hold)
+
+    monitor.stop()
+    await lag_task
+    process_thread.join()
+    clients = [member.guild.voice_client for member in members]
+    for member in members:
+        await player.voice.disconnect(member.guild)  # type: ignore
+
+    stats = player.stats().values()
+    totals = {
+        key: sum(guild[key] for guild in stats)
+        for key in ("requests", "played", "coalesced", "cancelled", "failed")
+    }
+    return {
+        "guilds": options.guilds,
+        "invocations": options.invocations,
+        "responses": sum(len(ctx.responses) for ctx in contexts),
+        "invoke_seconds": invoked,
+        "drain_seconds": drained,
+        "throughput": options.invocations / invoked,
+        "queues": totals,
+        "packets": sum(
+            client.packets
+            for client in clients
+            if isinstance(client, RecordingVoiceClient)
+        ),
+        "loop_lag": summarise(monitor.lags),
+        "ffmpeg_processes": max(monitor.processes, default=None),
+        "ffmpeg_pool": None if pool is None else pool.stats(),
+        "phases": {
+            phase: summarise(
+                [
+                    trace.phases[phase]
+                    for trace in traces.traces
+                    if phase in trace.phases
+                ]
+            )
+            for phase in PHASES
+        },
+    }
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    def ms(summary: Dict[str, float] | None) -> str:
+        if summary is None:
+            return "-"
+        return "  ".join(f"{k} {v * 1000:.2f} ms" for k, v in summary.items())
+
+    queues = results["queues"]
+    print(
+        f"{results['invocations']} invocations across {results['guilds']} guilds"
+        f" in {results['invoke_seconds']:.2f}s"
+        f" ({results['throughput']:.0f}/s), drained in"
+        f" {results['drain_seconds']:.2f}s"
+    )
+    print(
+        f"played {queues['played']}, coalesced {queues['coalesced']},"
+        f" cancelled {queues['cancelled']}, failed {queues['failed']};"
+        f" {results['packets']} packets"
+    )
+    print(f"loop lag:             {ms(results['loop_lag'])}")
+    print(f"time to first packet: {ms(results['phases']['total'])}")
+    for phase, summary in results["phases"].items():
+        if phase != "total" and summary is not None:
+            print(f"  {phase + ':':<19} {ms(summary)}")
+    processes = results["ffmpeg_processes"]
+    print(f"ffmpeg processes:     {'-' if processes is None else processes} at most")
+    if results["ffmpeg_pool"] is not None:
+        print(f"ffmpeg pool:          {results['ffmpeg_pool']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    LibrarySpec.add_arguments(parser)
+    parser.set_defaults(sounds=200, files_per_glob=2, folders=10, opus_frames=50)
+    parser.add_argument("--folder", type=Path, help="Use this sounds folder")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--invocations", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0.0)
+    parser.add_argument("--connect-delay", type=float, default=0.0)
+    parser.add_argument("--unpaced", action="store_true")
+    parser.add_argument("--hold", type=float, default=0.5)
+    parser.add_argument("--pool", type=int, default=0)
+    parser.add_argument("--frame-cache-mb", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Save the results to this file")
+    options = parser.parse_args()
+
+    pool = FFmpegWorkerPool(options.pool) if options.pool else None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = options.folder
+            spec = None
+            if folder is None:
+                spec = LibrarySpec.from_options(options)
+                folder = Path(tmp) / "sounds"
+                make_library(folder, spec)
+            soundsdir = SoundsDir.from_folder(
+                folder, jobs=options.jobs, use_snapshot=False
+            )
+            results = asyncio.run(run(soundsdir, options, pool))
+    finally:
+        if pool is not None:
+            pool.close()
+
+    results["spec"] = None if spec is None else asdict(spec)
+    print_results(results)
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
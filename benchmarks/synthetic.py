@@ -0,0 +1,191 @@
+"""Generate a synthetic sounds folder, for benchmarking at scale
+
+Each sound has some files named explicitly and some matched by globs, spread
+over a number of subfolders. Every sound is playable from a choice command,
+and the choice commands are nested into subcommand groups to the given depth.
+
+The files are empty (or --file-bytes of zeros), unless --opus-frames is set,
+when each is a silent Ogg Opus file of that many 20ms frames which can be
+played without ffmpeg.
+
+Usage: python benchmarks/synthetic.py OUT [--sounds N] [--files-per-glob F]
+           [--depth D] [--folders N] [--file-bytes B] [--opus-frames N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import struct
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Any, Dict, List
+
+from wowbot.model.command import MAX_SUBCOMMAND_DEPTH
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE
+
+
+@dataclass
+class LibrarySpec:
+    sounds: int = 1000
+    """The number of sounds"""
+    filenames: int = 2
+    """The number of files each sound names explicitly"""
+    globs: int = 1
+    """The number of globs each sound has"""
+    files_per_glob: int = 10
+    """The number of files each glob matches"""
+    folders: int = 100
+    """The number of subfolders the files are spread over"""
+    depth: int = 1
+    """How deeply commands are nested: 0 is only top-level commands"""
+    fanout: int = 25
+    """The number of choices per command, and of subcommands per group"""
+    file_bytes: int = 0
+    """The size of each sound file"""
+    opus_frames: int = 0
+    """If set, each file is a silent Ogg Opus file with this many frames"""
+
+    def files(self) -> int:
+        return self.sounds * (self.filenames + self.globs * self.files_per_glob)
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        for field in fields(cls):
+            flag = "--" + field.name.replace("_", "-")
+            parser.add_argument(flag, type=int, default=field.default)
+
+    @classmethod
+    def from_options(cls, options: argparse.Namespace) -> LibrarySpec:
+        return cls(
+            **{field.name: getattr(options, field.name) for field in fields(cls)}
+        )
+
+
+def _sound(index: int, spec: LibrarySpec) -> Dict[str, Any]:
+    folder = f"d{index % spec.folders}"
+    files: List[Any] = [f"{folder}/s{index}-f{k}.opus" for k in range(spec.filenames)]
+    files.extend(
+        {"glob": f"{folder}/s{index}-g{j}-*.opus", "weight": j + 1}
+        for j in range(spec.globs)
+    )
+    return {"name": f"s.{index}", "files": files}
+
+
+def _commands(spec: LibrarySpec) -> List[Dict[str, Any]]:
+    if not 0 <= spec.depth <= MAX_SUBCOMMAND_DEPTH:
+        raise ValueError(f"depth must be between 0 and {MAX_SUBCOMMAND_DEPTH}")
+
+    commands: List[Dict[str, Any]] = []
+    for start in range(0, spec.sounds, spec.fanout):
+        stop = min(start + spec.fanout, spec.sounds)
+        commands.append(
+            {
+                "name": f"c{start // spec.fanout}",
+                "choices": [
+                    {"name": f"Sound {i}", "sound": f"s.{i}"}
+                    for i in range(start, stop)
+                ],
+            }
+        )
+    for level in range(spec.depth):
+        commands = [
+            {
+                "name": f"g{level}-{start // spec.fanout}",
+                "subcommands": commands[start : start + spec.fanout],
+            }
+            for start in range(0, len(commands), spec.fanout)
+        ]
+    return commands
+
+
+OPUS_HEAD = b"OpusHead" + struct.pack("<BBHIhB", 1, 2, 312, 48000, 0, 0)
+OPUS_TAGS = b"OpusTags" + struct.pack("<I", 9) + b"synthetic" + struct.pack("<I", 0)
+SILENT_FRAME = b"\xfc\xff\xfe"  # CELT, 20ms, stereo
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def _ogg_page(packets: List[bytes], sequence: int, granule: int, flags: int):
+    # Each packet here is shorter than 255 bytes, so takes one lacing value
+    header = struct.pack(
+        "<4sBBqIIIB", b"OggS", 0, flags, granule, 1, sequence, 0, len(packets)
+    )
+    page = bytearray(header + bytes(len(p) for p in packets) + b"".join(packets))
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ byte]
+    struct.pack_into("<I", page, 22, crc)
+    return bytes(page)
+
+
+def silent_opus(frames: int) -> bytes:
+    """An Ogg Opus file of frames 20ms frames of silence"""
+    pages = [_ogg_page([OPUS_HEAD], 0, 0, 2), _ogg_page([OPUS_TAGS], 1, 0, 0)]
+    for start in range(0, frames, 255):
+        count = min(255, frames - start)
+        last = start + count >= frames
+        pages.append(
+            _ogg_page(
+                [SILENT_FRAME] * count,
+                len(pages),
+                312 + 960 * (start + count),
+                4 if last else 0,
+            )
+        )
+    return b"".join(pages)
+
+
+def make_library(folder: Path, spec: LibrarySpec) -> None:
+    """Write a sounds folder to folder, which must not exist yet"""
+    folder.mkdir(parents=True)
+    for index in range(spec.folders):
+        (folder / f"d{index}").mkdir()
+
+    if spec.opus_frames:
+        contents = silent_opus(spec.opus_frames)
+    else:
+        contents = bytes(spec.file_bytes)
+    for index in range(spec.sounds):
+        prefix = folder / f"d{index % spec.folders}" / f"s{index}"
+        names = [f"-f{k}.opus" for k in range(spec.filenames)]
+        names.extend(
+            f"-g{j}-{k}.opus"
+            for j in range(spec.globs)
+            for k in range(spec.files_per_glob)
+        )
+        for name in names:
+            with open(f"{prefix}{name}", "wb") as f:
+                f.write(contents)
+
+    sounds = {"version": 1, "sounds": [_sound(i, spec) for i in range(spec.sounds)]}
+    with open(folder / SOUNDS_FILE, "w") as f:
+        json.dump(sounds, f, indent=1)
+    with open(folder / COMMANDS_FILE, "w") as f:
+        json.dump({"version": 1, "commands": _commands(spec)}, f, indent=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out", type=Path)
+    LibrarySpec.add_arguments(parser)
+    options = parser.parse_args()
+
+    spec = LibrarySpec.from_options(options)
+    make_library(options.out, spec)
+    print(f"Wrote {spec.sounds} sounds and {spec.files()} files: {asdict(spec)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,40 @@
 from __future__ import annotations
 
+import logging
 import os
+import time
 from pathlib import Path
 
 import dotenv
 from discord import Bot
 
+from ..model.loudness import LOUDNESS_FILE, LoudnessCache
+from ..model.media import MediaIndex
+from ..model.probe import ProbeCache
+from ..model.profile import Profiler, set_profiler
+from ..model.sound import SoundCollection
 from ..model.soundsdir import SoundsDir
+from ..model.storage import HTTPStorage
+from ..model.transcode import TranscodeCache
+from ..model.watch import SoundsDirWatcher
 from .cogs import AdminCog, JoinCog
-from .slash import make_cog
+from .commandsync import sync_commands
+from .ffmpegpool import FFmpegWorkerPool
+from .framecache import OpusFrameCache
+from .metrics import BotMetrics, MetricsServer
+from .slash import BaseSoundsCog, make_cog
+from .sound import SoundPlayer
+from .trace import make_tracer
+from .voice import VoiceManager
+
+_log = logging.getLogger(__name__)
+
+
+def swap_sounds(cog: BaseSoundsCog, sounds: SoundCollection) -> None:
+    try:
+        cog.swap_sounds(sounds)
+    except Exception:
+        _log.exception("Not reloading sounds, as they no longer match the commands")
 
 
 def main():
@@ -18,23 +44,180 @@ def main():
     if TOKEN is None:
         raise Exception("No token supplied. Please set DISCORD_BOT_TOKEN")
 
-    ROOT = Path(os.environ.get("WOWBOT_SOUNDS_DIR", "./sounds"))
-    if not ROOT.is_dir():
+    SOUNDS_DIR = os.environ.get("WOWBOT_SOUNDS_DIR", "./sounds")
+    REMOTE = SOUNDS_DIR.startswith(("http://", "https://"))
+    ROOT = Path(SOUNDS_DIR)
+    if not REMOTE and not ROOT.exists():
+        # A zip or tar file is mounted as an archive
         raise Exception("Sounds directory doesn't exist. Please set WOWBOT_SOUNDS_DIR")
 
-    sounds_dir = SoundsDir.from_folder(ROOT)
+    CACHE_DIR = os.environ.get("WOWBOT_CACHE_DIR")
+    # Snapshots are pickled, so are only loaded from a trusted folder on request
+    USE_SNAPSHOT = os.environ.get("WOWBOT_USE_SNAPSHOT", "") not in ("", "0")
+    JOBS = int(os.environ.get("WOWBOT_JOBS", "1"))
+
+    PROFILE = os.environ.get("WOWBOT_PROFILE")
+    if PROFILE:
+        # Loading the sounds, building the cog and each command are profiled
+        default_dir = Path(CACHE_DIR or ".") / "profiles"
+        set_profiler(
+            Profiler(
+                PROFILE,
+                Path(os.environ.get("WOWBOT_PROFILE_DIR", default_dir)),
+                keep=int(os.environ.get("WOWBOT_PROFILE_KEEP", "20")),
+            )
+        )
+
+    LOUDNESS_TARGET = os.environ.get("WOWBOT_LOUDNESS_TARGET")
+    loudness_cache: LoudnessCache | None = None
+    if LOUDNESS_TARGET is not None:
+        loudness_cache = LoudnessCache(
+            None if CACHE_DIR is None else Path(CACHE_DIR) / "loudness.json",
+            target=float(LOUDNESS_TARGET),
+            workers=JOBS,
+        )
+        if not REMOTE and ROOT.is_dir():
+            # measured ahead of time by `wowbot-sounds loudness`
+            loudness_cache.load(ROOT / LOUDNESS_FILE)
+
+    transcode_cache: TranscodeCache | None = None
+    probe_cache = ProbeCache()
+    media_index = MediaIndex(workers=JOBS)
+    if CACHE_DIR is not None:
+        transcode_cache = TranscodeCache(Path(CACHE_DIR), loudness=loudness_cache)
+        probe_cache = ProbeCache(Path(CACHE_DIR) / "probes.json")
+        media_index = MediaIndex(Path(CACHE_DIR) / "media.json", workers=JOBS)
+    if not REMOTE and ROOT.is_dir():
+        # indexed ahead of time by `wowbot-sounds media`
+        media_index.load_folder(ROOT)
+
+    load_started = time.perf_counter()
+    if REMOTE:
+        if CACHE_DIR is None:
+            raise Exception("Remote sounds need a cache. Please set WOWBOT_CACHE_DIR")
+        storage = HTTPStorage(
+            SOUNDS_DIR,
+            Path(CACHE_DIR) / "remote",
+            max_bytes=int(os.environ.get("WOWBOT_REMOTE_CACHE_MB", "1024")) << 20,
+            jobs=int(os.environ.get("WOWBOT_REMOTE_JOBS", "4")),
+        )
+        sounds_dir = SoundsDir.from_storage(
+            storage,
+            transcode_cache=transcode_cache,
+            probe_cache=probe_cache,
+            loudness_cache=loudness_cache,
+            media_index=media_index,
+            jobs=JOBS,
+        )
+    else:
+        sounds_dir = SoundsDir.from_folder(
+            ROOT,
+            transcode_cache=transcode_cache,
+            probe_cache=probe_cache,
+            loudness_cache=loudness_cache,
+            media_index=media_index,
+            jobs=JOBS,
+            use_snapshot=USE_SNAPSHOT,
+        )
 
-    bot = Bot()
+    load_seconds = time.perf_counter() - load_started
+
+    # With a cache folder, only sync commands when they have changed
+    bot = Bot(auto_sync_commands=CACHE_DIR is None)
+    if CACHE_DIR is not None:
+        sync_state = Path(CACHE_DIR) / "commands-sync.json"
+
+        @bot.listen("on_connect")
+        async def on_connect():
+            await sync_commands(bot, sync_state)
+
+    VOICE_IDLE = float(os.environ.get("WOWBOT_VOICE_IDLE", "300"))
+    voice = VoiceManager(idle_timeout=VOICE_IDLE)
 
     bot.add_cog(AdminCog())
-    bot.add_cog(JoinCog())
-    bot.add_cog(make_cog(sounds_dir))
+    bot.add_cog(JoinCog(voice))
+    FRAME_CACHE_MB = int(os.environ.get("WOWBOT_FRAME_CACHE_MB", "0"))
+    frame_cache: OpusFrameCache | None = None
+    if FRAME_CACHE_MB > 0:
+        frame_cache = OpusFrameCache(
+            FRAME_CACHE_MB << 20,
+            transcode_cache=transcode_cache,
+            loudness=loudness_cache,
+        )
+
+    FFMPEG_POOL = int(os.environ.get("WOWBOT_FFMPEG_POOL", "0"))
+    ffmpeg_pool: FFmpegWorkerPool | None = None
+    if FFMPEG_POOL > 0:
+        ffmpeg_pool = FFmpegWorkerPool(
+            FFMPEG_POOL,
+            max_age=float(os.environ.get("WOWBOT_FFMPEG_POOL_MAX_AGE", "300")),
+        )
+
+    # e.g. "log" or "log,prometheus"; tracing is off unless it is set
+    tracer = make_tracer(os.environ.get("WOWBOT_TRACE", ""))
+
+    player = SoundPlayer(
+        transcode_cache=transcode_cache,
+        probe_cache=probe_cache,
+        frame_cache=frame_cache,
+        ffmpeg_pool=ffmpeg_pool,
+        archive=sounds_dir.archive,
+        loudness=loudness_cache,
+        voice=voice,
+        tracer=tracer,
+    )
+    sounds_cog = make_cog(sounds_dir, player)
+    bot.add_cog(sounds_cog)
+
+    RELOAD_INTERVAL = float(os.environ.get("WOWBOT_RELOAD_INTERVAL", "0"))
+    watcher: SoundsDirWatcher | None = None
+    if RELOAD_INTERVAL > 0:
+        # The watcher reloads in its own thread, and only the swap runs on the loop
+        watcher = SoundsDirWatcher(
+            sounds_dir,
+            lambda sd: bot.loop.call_soon_threadsafe(
+                swap_sounds, sounds_cog, sd.sound_collection
+            ),
+            interval=RELOAD_INTERVAL,
+            jobs=JOBS,
+            # Registered commands can't change, so reject sounds they don't match
+            check=sounds_cog.commands_json.check_sounds,
+        )
+        watcher.start()
+
+    METRICS_PORT = os.environ.get("WOWBOT_METRICS_PORT")
+    metrics_server: MetricsServer | None = None
+    if METRICS_PORT is not None:
+        remote = sounds_dir.storage
+        metrics = BotMetrics(
+            player,
+            storage=remote if isinstance(remote, HTTPStorage) else None,
+            watcher=watcher,
+        )
+        metrics.load_seconds = load_seconds
+        metrics_server = MetricsServer(
+            metrics,
+            os.environ.get("WOWBOT_METRICS_HOST", "127.0.0.1"),
+            int(METRICS_PORT),
+        )
+        bot.loop.run_until_complete(metrics_server.start())
 
     try:
         bot.loop.run_until_complete(bot.start(TOKEN))
     except KeyboardInterrupt:
         print("Stopping... (^C)")
         bot.loop.run_until_complete(bot.close())
+    finally:
+        if metrics_server is not None:
+            bot.loop.run_until_complete(metrics_server.stop())
+        if watcher is not None:
+            watcher.stop()
+        if ffmpeg_pool is not None:
+            ffmpeg_pool.close()
+        if sounds_dir.storage is not None:
+            sounds_dir.storage.close()
+        # probe results are saved in batches, so write out any still pending
+        probe_cache.save()
 
 
 if __name__ == "__main__":
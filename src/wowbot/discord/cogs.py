@@ -3,6 +3,7 @@ from __future__ import annotations
 from discord import ApplicationContext, Cog, slash_command
 
 from .util import get_voice_name, join, leave, respond
+from .voice import VoiceManager
 
 
 class AdminCog(Cog):
@@ -12,9 +13,18 @@ class AdminCog(Cog):
 
 
 class JoinCog(Cog):
+    voice: VoiceManager
+
+    def __init__(self, voice: VoiceManager) -> None:
+        self.voice = voice
+
+    @Cog.listener()
+    async def on_ready(self):
+        self.voice.start()
+
     @slash_command(name="join", description="Join your current voice channel")
     async def join_cmd(self, ctx: ApplicationContext):
-        if not await join(ctx):
+        if not await join(ctx, self.voice):
             return
         name = get_voice_name(ctx, "voice")
         await respond(ctx, f"Joined {name}")
@@ -22,6 +32,6 @@ class JoinCog(Cog):
     @slash_command(name="leave", description="Leave your current voice channel")
     async def leave_cmd(self, ctx: ApplicationContext):
         name = get_voice_name(ctx, "voice")
-        if not await leave(ctx):
+        if not await leave(ctx, self.voice):
             return
         await respond(ctx, f"Left {name}")
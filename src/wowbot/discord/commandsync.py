@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+from discord import ApplicationCommand, Bot
+
+_log = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+def payload_digest(payload: Any) -> str:
+    """Get a stable hash of a JSON payload"""
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def command_digests(commands: List[ApplicationCommand]) -> Dict[str, str]:
+    """Hash the payload that registering each command would send to Discord"""
+    return {cmd.name: payload_digest(cmd.to_dict()) for cmd in commands}
+
+
+def tree_digest(digests: Dict[str, str]) -> str:
+    """Hash a whole command tree from the hashes of its commands"""
+    return payload_digest(sorted(digests.items()))
+
+
+class CommandSyncState:
+    """The hashes and IDs of the commands last registered with Discord"""
+
+    def __init__(
+        self,
+        application_id: int | None = None,
+        tree: str | None = None,
+        commands: Dict[str, Dict[str, Any]] | None = None,
+    ) -> None:
+        self.application_id = application_id
+        self.tree = tree
+        self.commands = {} if commands is None else commands
+
+    @classmethod
+    def load(cls, path: Path) -> CommandSyncState:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError):
+            _log.warning("Ignoring unreadable command sync state %s", path)
+            return cls()
+
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return cls()
+        return cls(data.get("application_id"), data.get("tree"), data.get("commands"))
+
+    def save(self, path: Path) -> None:
+        data = {
+            "version": STATE_VERSION,
+            "application_id": self.application_id,
+            "tree": self.tree,
+            "commands": self.commands,
+        }
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+
+def _restore_id(bot: Bot, cmd: ApplicationCommand, command_id: Any) -> None:
+    # This is what Bot.register_commands does with the IDs Discord returns, so
+    # that interactions are routed by ID rather than by name
+    cmd.id = command_id
+    bot._application_commands[command_id] = cmd
+
+
+async def sync_commands(bot: Bot, state_path: Path) -> None:
+    """Register the bot's global commands with Discord, if they have changed
+
+    The payload of every command is hashed, and compared with the hashes stored
+    at state_path when the commands were last registered. If none have changed,
+    nothing is sent to Discord at all; otherwise, only the new and changed
+    commands are registered, and removed commands are deleted.
+
+    With no stored state, or with guild commands, this falls back to
+    :code:`Bot.sync_commands`, which fetches the registered commands to compare.
+    Delete the state file to force this.
+    """
+    assert bot.user is not None
+    application_id = bot.user.id
+    commands = bot.pending_application_commands
+
+    if bot.debug_guilds or any(cmd.guild_ids is not None for cmd in commands):
+        await bot.sync_commands()
+        return
+
+    state = CommandSyncState.load(state_path)
+    digests = command_digests(commands)
+    tree = tree_digest(digests)
+
+    if state.application_id != application_id or not state.commands:
+        _log.info("Syncing all commands")
+        await bot.sync_commands()
+    elif state.tree == tree:
+        _log.info("Commands are unchanged; skipping sync")
+        for cmd in commands:
+            _restore_id(bot, cmd, state.commands[cmd.name]["id"])
+        return
+    else:
+        for cmd in commands:
+            stored = state.commands.get(cmd.name)
+            if stored is not None and stored["hash"] == digests[cmd.name]:
+                _restore_id(bot, cmd, stored["id"])
+                continue
+            _log.info("Registering command %s", cmd.name)
+            registered = await bot.http.upsert_global_command(
+                application_id, cmd.to_dict()
+            )
+            _restore_id(bot, cmd, registered["id"])
+
+        for name, stored in state.commands.items():
+            if name not in digests:
+                _log.info("Deleting command %s", name)
+                await bot.http.delete_global_command(application_id, stored["id"])
+
+    if any(cmd.id is None for cmd in commands):
+        return
+    state = CommandSyncState(
+        application_id,
+        tree,
+        {cmd.name: {"hash": digests[cmd.name], "id": cmd.id} for cmd in commands},
+    )
+    state.save(state_path)
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import IO, Deque, Dict, Iterator, List, NamedTuple
+
+from discord import AudioSource
+
+from ..model.transcode import opus_transcode_args
+from .framecache import iter_opus_frames
+
+_log = logging.getLogger(__name__)
+
+_BLOCK_SIZE = 1 << 16
+
+
+def pipe_transcode_args(*, executable: str = "ffmpeg", bitrate: int = 128) -> List[str]:
+    """Get the arguments for ffmpeg to transcode stdin into Ogg Opus on stdout"""
+    args = opus_transcode_args(
+        "pipe:0", "pipe:1", executable=executable, bitrate=bitrate
+    )
+    # The input is read from stdin, so it can't be disabled
+    args.remove("-nostdin")
+    return args
+
+
+class _Worker(NamedTuple):
+    process: subprocess.Popen[bytes]
+    spawned_at: float
+
+
+class PooledOpusAudio(AudioSource):
+    """An audio source which feeds a file to an already running ffmpeg process"""
+
+    def __init__(
+        self, process: subprocess.Popen[bytes], data: Path | bytes | IO[bytes]
+    ) -> None:
+        self._process = process
+        assert process.stdout is not None
+        self._packets: Iterator[bytes] = iter_opus_frames(process.stdout)
+        self._writer = threading.Thread(
+            target=self._write,
+            args=(data,),
+            name=f"wowbot-ffmpeg-writer:{process.pid}",
+            daemon=True,
+        )
+        self._writer.start()
+
+    def _write(self, data: Path | bytes | IO[bytes]) -> None:
+        stdin = self._process.stdin
+        assert stdin is not None
+        try:
+            if isinstance(data, bytes):
+                stdin.write(data)
+            elif isinstance(data, Path):
+                with open(data, "rb") as f:
+                    self._copy(f, stdin)
+            else:
+                with data:
+                    self._copy(data, stdin)
+        except (OSError, ValueError):
+            # the process was killed before it read everything
+            _log.debug("Stopped writing to ffmpeg %s", self._process.pid)
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _copy(src: IO[bytes], dest: IO[bytes]) -> None:
+        for block in iter(lambda: src.read(_BLOCK_SIZE), b""):
+            dest.write(block)
+
+    def read(self) -> bytes:
+        return next(self._packets, b"")
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        if self._process.stdout is not None:
+            self._process.stdout.close()
+
+
+class FFmpegWorkerPool:
+    """A pool of ffmpeg processes, started ahead of time, which read from stdin
+
+    Each process transcodes one file into Ogg Opus, so a new process is started
+    in a background thread whenever one is taken. Idle processes older than
+    :code:`max_age` seconds are replaced, so that the pool doesn't hold onto
+    stale processes forever.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        *,
+        executable: str = "ffmpeg",
+        bitrate: int = 128,
+        max_age: float = 300.0,
+        args: List[str] | None = None,
+    ) -> None:
+        self.size = size
+        self.max_age = max_age
+        self.args = (
+            pipe_transcode_args(executable=executable, bitrate=bitrate)
+            if args is None
+            else args
+        )
+
+        self.spawned = 0
+        self.taken = 0
+        self.misses = 0
+        self.recycled = 0
+
+        self._lock = threading.Lock()
+        self._idle: Deque[_Worker] = deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._fill_forever, name="wowbot-ffmpeg-pool", daemon=True
+        )
+        self._thread.start()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "spawned": self.spawned,
+                "taken": self.taken,
+                "misses": self.misses,
+                "recycled": self.recycled,
+            }
+
+    def _is_usable(self, worker: _Worker, now: float) -> bool:
+        return worker.process.poll() is None and now - worker.spawned_at < self.max_age
+
+    def take(self) -> subprocess.Popen[bytes] | None:
+        """Take an idle process, or return None if there isn't one ready"""
+        now = time.monotonic()
+        stale: List[_Worker] = []
+        process = None
+        with self._lock:
+            while self._idle:
+                worker = self._idle.popleft()
+                if self._is_usable(worker, now):
+                    process = worker.process
+                    self.taken += 1
+                    break
+                stale.append(worker)
+            else:
+                self.misses += 1
+            self.recycled += len(stale)
+
+        for worker in stale:
+            self._kill(worker.process)
+        self._wakeup.set()
+        return process
+
+    def source(self, data: Path | bytes | IO[bytes]) -> PooledOpusAudio | None:
+        """Start transcoding data in an idle process, if there is one"""
+        process = self.take()
+        if process is None:
+            return None
+        return PooledOpusAudio(process, data)
+
+    def _spawn(self) -> _Worker:
+        process = subprocess.Popen(
+            self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        return _Worker(process, time.monotonic())
+
+    def _recycle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stale = [w for w in self._idle if not self._is_usable(w, now)]
+            for worker in stale:
+                self._idle.remove(worker)
+            self.recycled += len(stale)
+        for worker in stale:
+            self._kill(worker.process)
+
+    def _fill_forever(self) -> None:
+        while not self._closed:
+            self._wakeup.clear()
+            self._recycle()
+            while not self._closed and len(self._idle) < self.size:
+                try:
+                    worker = self._spawn()
+                except OSError:
+                    _log.exception("Failed to start ffmpeg worker")
+                    break
+                with self._lock:
+                    self._idle.append(worker)
+                    self.spawned += 1
+            self._wakeup.wait(min(self.max_age / 4, 30.0))
+
+    @staticmethod
+    def _kill(process: subprocess.Popen[bytes]) -> None:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        for pipe in (process.stdin, process.stdout):
+            if pipe is not None:
+                pipe.close()
+
+    def close(self) -> None:
+        """Stop refilling the pool, and kill every idle process"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for worker in idle:
+            self._kill(worker.process)
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import logging
+import subprocess
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Dict, Iterator, NamedTuple, Sequence, Set, Tuple
+
+from discord import AudioSource
+from discord.oggparse import OggStream
+
+from ..model.loudness import LoudnessCache
+from ..model.probe import FileIdentity
+from ..model.transcode import TranscodeCache, opus_transcode_args
+
+_log = logging.getLogger(__name__)
+
+OPUS_HEADER_MAGICS = (b"OpusHead", b"OpusTags")
+
+
+def iter_opus_frames(stream: IO[bytes]) -> Iterator[bytes]:
+    """Iterate over the audio packets of an Ogg Opus stream, skipping the headers"""
+    for packet in OggStream(stream).iter_packets():
+        if packet[:8] not in OPUS_HEADER_MAGICS:
+            yield packet
+
+
+class CachedOpusAudio(AudioSource):
+    """An audio source which plays pre-encoded Opus frames from memory"""
+
+    def __init__(self, frames: Sequence[bytes]) -> None:
+        self._frames = frames
+        self._index = 0
+
+    def read(self) -> bytes:
+        if self._index >= len(self._frames):
+            return b""
+        frame = self._frames[self._index]
+        self._index += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class _Entry(NamedTuple):
+    identity: FileIdentity
+    frames: Tuple[bytes, ...]
+    size: int
+
+
+class OpusFrameCache:
+    """An in-memory cache of the Opus frames of the most played files
+
+    A file is loaded in the background once it has been played
+    :code:`admit_after` times. The least recently played files are evicted to
+    keep the total size of the frames under :code:`max_bytes`, except for pinned
+    files, which are never evicted.
+
+    Plays are only counted for files which are not in memory, and at most
+    :code:`max_tracked` files are counted at once. Past that, every count is
+    halved and files whose count reaches zero are forgotten, so files which
+    were played once long ago don't take up memory forever.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        *,
+        admit_after: int = 2,
+        max_tracked: int = 4096,
+        max_entry_bytes: int | None = None,
+        transcode_cache: TranscodeCache | None = None,
+        loudness: LoudnessCache | None = None,
+        executable: str = "ffmpeg",
+        bitrate: int = 128,
+        workers: int = 2,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self.max_tracked = max_tracked
+        self.max_entry_bytes = (
+            max_bytes // 8 if max_entry_bytes is None else max_entry_bytes
+        )
+        self.transcode_cache = transcode_cache
+        self.loudness = loudness
+        self.executable = executable
+        self.bitrate = bitrate
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Path, _Entry] = OrderedDict()
+        self._pinned: Set[Path] = set()
+        self._plays: Counter[Path] = Counter()
+        self._loading: Set[Path] = set()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="wowbot-frames")
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups which were served from memory"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Get the current counters of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "evictions": self.evictions,
+                "resident_bytes": self.resident_bytes,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "tracked": len(self._plays),
+            }
+
+    def get(self, path: Path) -> Sequence[bytes] | None:
+        """Get the frames of a file, recording the play
+
+        On a miss, the file is loaded in the background if it has become hot.
+        """
+        try:
+            identity = FileIdentity.of(path)
+        except OSError:
+            identity = None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.identity == identity:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry.frames
+
+            if entry is not None:
+                self._remove(path)
+            self.misses += 1
+            self._plays[path] += 1
+            if len(self._plays) > self.max_tracked:
+                self._decay_plays()
+            admit = (
+                identity is not None
+                and self._plays[path] >= self.admit_after
+                and path not in self._loading
+            )
+            if admit:
+                self._loading.add(path)
+                del self._plays[path]
+
+        if admit:
+            self._pool.submit(self._load_in_background, path)
+        return None
+
+    def put(self, path: Path, frames: Sequence[bytes], *, pinned: bool = False) -> bool:
+        """Store the frames of a file, returning whether they were stored"""
+        identity = FileIdentity.of(path)
+        frames = tuple(frames)
+        size = sum(len(frame) for frame in frames)
+
+        with self._lock:
+            if pinned:
+                self._pinned.add(path)
+            elif size > self.max_entry_bytes:
+                return False
+
+            if path in self._entries:
+                self._remove(path)
+            self._plays.pop(path, None)
+            self._entries[path] = _Entry(identity, frames, size)
+            self.resident_bytes += size
+            self._evict()
+            return path in self._entries
+
+    def pin(self, path: Path) -> None:
+        """Load a file and keep it in memory until it is unpinned"""
+        self.put(path, self.load(path), pinned=True)
+
+    def unpin(self, path: Path) -> None:
+        """Allow a pinned file to be evicted again"""
+        with self._lock:
+            self._pinned.discard(path)
+            self._evict()
+
+    def load(self, path: Path) -> Tuple[bytes, ...]:
+        """Read the Opus frames of a file
+
+        A transcoded rendition is read directly if there is one; otherwise, the
+        file is transcoded by ffmpeg, with its gain if it has been measured.
+        """
+        rendition = None
+        if self.transcode_cache is not None:
+            rendition = self.transcode_cache.get(path)
+
+        if rendition is not None:
+            with open(rendition, "rb") as f:
+                return tuple(iter_opus_frames(f))
+
+        args = opus_transcode_args(
+            str(path),
+            "pipe:1",
+            executable=self.executable,
+            bitrate=self.bitrate,
+            gain=None if self.loudness is None else self.loudness.gain(path),
+        )
+        with subprocess.Popen(
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+        ) as proc:
+            try:
+                assert proc.stdout is not None
+                frames = tuple(iter_opus_frames(proc.stdout))
+            except BaseException:
+                proc.kill()
+                raise
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+        return frames
+
+    def _load_in_background(self, path: Path) -> None:
+        try:
+            self.put(path, self.load(path))
+        except Exception:
+            _log.exception("Failed to load frames of %s", path)
+        finally:
+            with self._lock:
+                self._loading.discard(path)
+
+    def _decay_plays(self) -> None:
+        for path, plays in list(self._plays.items()):
+            if plays > 1:
+                self._plays[path] = plays // 2
+            else:
+                del self._plays[path]
+
+    def _remove(self, path: Path) -> None:
+        entry = self._entries.pop(path)
+        self.resident_bytes -= entry.size
+
+    def _evict(self) -> None:
+        for path in list(self._entries):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            if path not in self._pinned:
+                self._remove(path)
+                self.evictions += 1
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from ..model.storage import HTTPStorage
+from ..model.watch import SoundsDirWatcher
+from .sound import SoundPlayer
+from .trace import DEFAULT_BUCKETS, Histogram, PrometheusSink, Tracer, escape_label
+
+_log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def count_children(prefix: str = "ffmpeg") -> int | None:
+    """Count this process's children whose names start with prefix
+
+    Returns None where there is no :code:`/proc` to read them from.
+    """
+    pid = str(os.getpid())
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    running = 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The name is in brackets, and may have spaces or brackets in it
+        name = stat[stat.index("(") + 1 : stat.rindex(")")]
+        ppid = stat[stat.rindex(")") + 2 :].split()[1]
+        if ppid == pid and name.startswith(prefix):
+            running += 1
+    return running
+
+
+def resident_bytes() -> int | None:
+    """Get this process's resident set size, or None without :code:`/proc`"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes from a sleep of interval seconds"""
+
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval = interval
+        self.histogram = Histogram(DEFAULT_BUCKETS)
+        self.last = 0.0
+        self.max = 0.0
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        while True:
+            began = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - began - self.interval)
+            self.max = max(self.max, self.last)
+            self.histogram.observe(self.last)
+
+    def start(self) -> None:
+        """Start measuring on the running event loop, if it isn't already"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class _Lines:
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+
+    def family(self, name: str, kind: str, help: str) -> None:
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, **labels: str) -> None:
+        if labels:
+            label_text = ",".join(
+                f'{key}="{escape_label(text)}"' for key, text in labels.items()
+            )
+            name = f"{name}{{{label_text}}}"
+        self.lines.append(f"{name} {value}")
+
+    def metric(self, name: str, kind: str, help: str, value: float | None) -> None:
+        if value is not None:
+            self.family(name, kind, help)
+            self.sample(name, value)
+
+
+class BotMetrics:
+    """Collects the bot's metrics, in the Prometheus text format
+
+    Everything is read from the objects' own counters when :meth:`render` is
+    called, so keeping metrics costs nothing between scrapes except measuring the
+    event loop's lag. Any of the sources but the player may be left out.
+    """
+
+    def __init__(
+        self,
+        player: SoundPlayer,
+        *,
+        storage: HTTPStorage | None = None,
+        watcher: SoundsDirWatcher | None = None,
+        lag: LoopLagMonitor | None = None,
+    ) -> None:
+        self.player = player
+        self.storage = storage
+        self.watcher = watcher
+        self.lag = LoopLagMonitor() if lag is None else lag
+        self.load_seconds: float | None = None
+
+    def _caches(self) -> Dict[str, Tuple[int, int]]:
+        """Get each cache's hits and misses"""
+        caches: Dict[str, Tuple[int, int]] = {}
+        player = self.player
+        if player.probe_cache is not None:
+            caches["probe"] = (player.probe_cache.hits, player.probe_cache.misses)
+        if player.frame_cache is not None:
+            caches["frames"] = (player.frame_cache.hits, player.frame_cache.misses)
+        if player.ffmpeg_pool is not None:
+            stats = player.ffmpeg_pool.stats()
+            caches["ffmpeg_pool"] = (stats["taken"], stats["misses"])
+        if self.storage is not None:
+            caches["remote"] = (self.storage.hits, self.storage.downloads)
+        return caches
+
+    def render(self) -> str:
+        out = _Lines()
+
+        out.family(
+            "wowbot_command_requests_total", "counter", "Sound command invocations"
+        )
+        for command, count in sorted(self.player.command_requests.items()):
+            out.sample("wowbot_command_requests_total", count, command=command)
+
+        totals: Dict[str, int] = {}
+        for stats in self.player.stats().values():
+            for key in ("played", "coalesced", "cancelled", "failed"):
+                totals[key] = totals.get(key, 0) + stats[key]
+        out.family("wowbot_queue_sounds_total", "counter", "Queued sounds, by outcome")
+        for outcome, count in sorted(totals.items()):
+            out.sample("wowbot_queue_sounds_total", count, outcome=outcome)
+
+        out.metric(
+            "wowbot_voice_connections",
+            "gauge",
+            "Open voice connections",
+            self.player.voice.connected(),
+        )
+        out.metric(
+            "wowbot_ffmpeg_processes",
+            "gauge",
+            "Running ffmpeg child processes",
+            count_children("ffmpeg"),
+        )
+
+        caches = self._caches()
+        if caches:
+            out.family("wowbot_cache_hits_total", "counter", "Cache hits")
+            for cache, (hits, _) in caches.items():
+                out.sample("wowbot_cache_hits_total", hits, cache=cache)
+            out.family("wowbot_cache_misses_total", "counter", "Cache misses")
+            for cache, (_, misses) in caches.items():
+                out.sample("wowbot_cache_misses_total", misses, cache=cache)
+            out.family("wowbot_cache_hit_ratio", "gauge", "Fraction of cache hits")
+            for cache, (hits, misses) in caches.items():
+                ratio = hits / (hits + misses) if hits + misses else 0.0
+                out.sample("wowbot_cache_hit_ratio", ratio, cache=cache)
+
+        lag = self.lag
+        out.family(
+            "wowbot_event_loop_lag_seconds",
+            "histogram",
+            "How late the event loop woke from a sleep",
+        )
+        for bound, count in lag.histogram.cumulative():
+            out.sample("wowbot_event_loop_lag_seconds_bucket", count, le=bound)
+        out.sample("wowbot_event_loop_lag_seconds_sum", lag.histogram.sum)
+        out.sample("wowbot_event_loop_lag_seconds_count", lag.histogram.count)
+        out.metric(
+            "wowbot_event_loop_lag_max_seconds",
+            "gauge",
+            "The longest the event loop has been late",
+            lag.max,
+        )
+
+        out.metric(
+            "process_resident_memory_bytes",
+            "gauge",
+            "Resident memory size in bytes",
+            resident_bytes(),
+        )
+
+        out.metric(
+            "wowbot_sounds_load_seconds",
+            "gauge",
+            "How long loading the sounds folder took",
+            self.load_seconds,
+        )
+        watcher = self.watcher
+        if watcher is not None:
+            out.metric(
+                "wowbot_sounds_reloads_total",
+                "counter",
+                "Reloads of the sounds folder",
+                watcher.reloads,
+            )
+            out.metric(
+                "wowbot_sounds_reload_failures_total",
+                "counter",
+                "Failed polls of the sounds folder",
+                watcher.failures,
+            )
+            out.metric(
+                "wowbot_sounds_poll_seconds",
+                "gauge",
+                "How long the last poll of the sounds folder took",
+                watcher.last_poll_seconds,
+            )
+            out.metric(
+                "wowbot_sounds_reload_seconds",
+                "gauge",
+                "How long the last reload of the sounds folder took",
+                watcher.last_reload_seconds,
+            )
+
+        text = "\n".join(out.lines) + "\n"
+        tracer: Tracer | None = self.player.tracer
+        if tracer is not None:
+            for sink in tracer.sinks:
+                if isinstance(sink, PrometheusSink):
+                    text += sink.render()
+        return text
+
+
+class MetricsServer:
+    """Serves metrics over HTTP at :code:`/metrics`, on the running event loop"""
+
+    def __init__(self, metrics: BotMetrics, host: str, port: int) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.metrics.render().encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # With port 0, the system picks a free port
+        self.port = self._runner.addresses[0][1]
+        self.metrics.lag.start()
+        _log.info("Serving metrics at http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        self.metrics.lag.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -18,9 +18,16 @@ from ..model.command import (
     SoundCommand,
     SubcommandsCommand,
 )
+from ..model.profile import profiled
 from ..model.sound import SoundCollection, SoundName
 from ..model.soundsdir import SoundsDir
-from .sound import play_sound
+from .sound import SoundPlayer
+
+
+def _profiled_callback(callback, name: str, parent: SlashCommandGroup | None):
+    if parent is not None:
+        name = f"{parent.qualified_name} {name}"
+    return profiled(f"/{name}")(callback)
 
 
 class SoundSlashCommand(SlashCommand):
@@ -31,14 +38,15 @@ class SoundSlashCommand(SlashCommand):
         sounds: SoundCollection,
         parent: SlashCommandGroup | None = None,
     ) -> "SoundSlashCommand":
-        return cls(cls.make_callback(cmd, sounds), name=cmd.name, parent=parent)
+        callback = _profiled_callback(cls.make_callback(cmd, sounds), cmd.name, parent)
+        return cls(callback, name=cmd.name, parent=parent)
 
     @staticmethod
     def make_callback(cmd: SoundCommand, sounds: SoundCollection):
-        sound = sounds[cmd.sound]
+        sounds[cmd.sound]  # fail early on a missing sound
 
         async def callback(self: BaseSoundsCog, ctx: ApplicationContext):
-            await play_sound(ctx, sound)
+            await self.player.play_sound(ctx, self.sounds[cmd.sound])
 
         return callback
 
@@ -60,16 +68,15 @@ class ChoiceSlashCommand(SlashCommand):
             default=None if default is None else default.sound,
             required=default is None,
         )
-        return cls(
-            cls.make_callback(cmd, sounds), name=cmd.name, options=[opt], parent=parent
-        )
+        callback = _profiled_callback(cls.make_callback(cmd, sounds), cmd.name, parent)
+        return cls(callback, name=cmd.name, options=[opt], parent=parent)
 
     @staticmethod
     def make_callback(cmd: ChoiceCommand, sounds: SoundCollection):
         async def callback(
             self: BaseSoundsCog, ctx: ApplicationContext, choice: SoundName
         ):
-            await play_sound(ctx, sounds[choice])
+            await self.player.play_sound(ctx, self.sounds[choice])
 
         return callback
 
@@ -107,12 +114,28 @@ def make_command(
 
 
 class BaseSoundsCog(Cog):
-    pass
+    commands_json: CommandsJson
+    sounds: SoundCollection
+    player: SoundPlayer
+
+    def __init__(
+        self, commands_json: CommandsJson, sounds: SoundCollection, player: SoundPlayer
+    ) -> None:
+        self.commands_json = commands_json
+        self.sounds = sounds
+        self.player = player
+
+    def swap_sounds(self, sounds: SoundCollection) -> None:
+        # The commands are fixed when the cog is created, so they must all still
+        # have their sounds; the swap itself is a single assignment
+        self.commands_json.check_sounds(sounds)
+        self.sounds = sounds
 
 
 COG_NAME = "SoundsCog"
 
 
+@profiled("make_cog_type")
 def make_cog_type(cmds: CommandsJson, sounds: SoundCollection) -> type[BaseSoundsCog]:
     members: dict[str, Any] = {}
     for cmd in cmds.commands:
@@ -120,6 +143,13 @@ def make_cog_type(cmds: CommandsJson, sounds: SoundCollection) -> type[BaseSound
     return type(COG_NAME, (BaseSoundsCog,), members)
 
 
-def make_cog(soundsdir: SoundsDir) -> BaseSoundsCog:
+def make_cog(soundsdir: SoundsDir, player: SoundPlayer | None = None) -> BaseSoundsCog:
+    if player is None:
+        player = SoundPlayer(
+            transcode_cache=soundsdir.transcode_cache,
+            probe_cache=soundsdir.probe_cache,
+            archive=soundsdir.archive,
+            loudness=soundsdir.loudness_cache,
+        )
     SoundsCog = make_cog_type(soundsdir.commands_json, soundsdir.sound_collection)
-    return SoundsCog()
+    return SoundsCog(soundsdir.commands_json, soundsdir.sound_collection, player)
@@ -1,23 +1,498 @@
 from __future__ import annotations
 
-from discord import ApplicationContext, FFmpegOpusAudio, VoiceClient
+import asyncio
+import logging
+import mmap
+import struct
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Tuple, TypeVar
 
+from discord import (
+    ApplicationContext,
+    AudioSource,
+    FFmpegOpusAudio,
+    Guild,
+    VoiceClient,
+)
+
+from ..model.archive import Archive
+from ..model.loudness import LoudnessCache
+from ..model.probe import FileIdentity, ProbeCache
 from ..model.sound import ResolvedSound
+from ..model.transcode import TranscodeCache, volume_filter
+from .ffmpegpool import FFmpegWorkerPool
+from .framecache import CachedOpusAudio, OpusFrameCache
+from .trace import PlayTrace, TracedSource, Tracer
 from .util import join, respond
+from .voice import VoiceManager
+
+_log = logging.getLogger(__name__)
+
+_OGG_PAGE = struct.Struct("<4sBBqIIIB")  # capture, version, type, ..., segments
+_OPUS_HEAD = struct.Struct("<8sBBHIhB")  # magic, version, channels, ..., mapping
+_NATIVE_CACHE_SIZE = 4096  # files remembered as playable without ffmpeg, or not
+
+_K = TypeVar("_K", bound=Hashable)
+
+
+def iter_ogg_packets(
+    data: bytes | mmap.mmap, start: int = 0, stop: int | None = None
+) -> Iterator[bytes]:
+    """Iterate over the packets of an Ogg stream held in memory
+
+    Page headers are read in place, so only the packets themselves are copied
+    out of data. The stream may be just the part of data from start to stop.
+
+    Only one logical stream is read: a page with a different serial number to
+    the first page, as in a multiplexed or chained file, raises ValueError.
+    """
+    offset = start
+    end = len(data) if stop is None else stop
+    partial: List[bytes] = []
+    first_serial = None
+    while offset + _OGG_PAGE.size <= end:
+        capture, _, _, _, serial, _, _, segments = _OGG_PAGE.unpack_from(data, offset)
+        if capture != b"OggS":
+            raise ValueError(f"Bad Ogg page at offset {offset}")
+        if first_serial is None:
+            first_serial = serial
+        elif serial != first_serial:
+            raise ValueError(f"Another Ogg stream at offset {offset}")
+
+        table = offset + _OGG_PAGE.size
+        start = body = table + segments
+        lacings = data[table:body]
+        if body + sum(lacings) > end:
+            raise ValueError(f"Truncated Ogg page at offset {offset}")
+        for lacing in lacings:
+            body += lacing
+            if lacing < 255:
+                # this segment ends a packet
+                partial.append(data[start:body])
+                yield b"".join(partial) if len(partial) > 1 else partial[0]
+                partial.clear()
+                start = body
+        if start < body:
+            # the last packet continues on the next page
+            partial.append(data[start:body])
+        offset = body
+
+
+def _is_20ms_frame(packet: bytes) -> bool:
+    # See RFC 6716 section 3.1: the TOC byte gives the mode and frame size, and
+    # frame count code 0 means the packet holds a single frame
+    if not packet:
+        return False
+    config, code = packet[0] >> 3, packet[0] & 0x3
+    if config < 12:
+        twenty_ms = config % 4 == 1  # SILK
+    elif config < 16:
+        twenty_ms = config % 2 == 1  # hybrid
+    else:
+        twenty_ms = config % 4 == 3  # CELT
+    return twenty_ms and code == 0
+
+
+def sniff_ogg_opus(
+    data: bytes | mmap.mmap, start: int = 0, stop: int | None = None
+) -> bool:
+    """Check whether data is an Ogg Opus stream which can be sent as-is
+
+    Opus always decodes at 48kHz, so this checks for a mono or stereo stream
+    with only one logical stream, whose audio packets are each a single 20ms
+    frame, as Discord expects. Every packet is checked, so this reads the whole
+    stream. The stream may be just the part of data from start to stop.
+    """
+    if data[start : start + 4] != b"OggS":
+        return False
+    packets = iter_ogg_packets(data, start, stop)
+    try:
+        head = next(packets, b"")
+        if len(head) < _OPUS_HEAD.size:
+            return False
+        magic, version, channels, _, _, _, mapping = _OPUS_HEAD.unpack_from(head)
+        if not (
+            magic == b"OpusHead"
+            and version >> 4 == 0
+            and channels in (1, 2)
+            and mapping == 0
+            and next(packets, b"")[:8] == b"OpusTags"
+        ):
+            return False
+
+        audio = 0
+        for packet in packets:
+            if not _is_20ms_frame(packet):
+                return False
+            audio += 1
+    except ValueError:
+        return False
+    finally:
+        packets.close()
+    return audio > 0
+
+
+class OggOpusAudio(AudioSource):
+    """An audio source which sends the packets of an Ogg Opus file without ffmpeg
+
+    The file is memory-mapped, and should already have passed
+    :func:`sniff_ogg_opus`.
+    """
+
+    _mmap: mmap.mmap | None
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start(iter_ogg_packets(self._mmap))
+
+    @classmethod
+    def from_range(cls, data: bytes | mmap.mmap, start: int, stop: int) -> OggOpusAudio:
+        """Play the Ogg Opus stream between start and stop in data
+
+        data is not closed by :meth:`cleanup`, so it can be shared, like the
+        mapping of an archive.
+        """
+        self = cls.__new__(cls)
+        self._mmap = None
+        self._start(iter_ogg_packets(data, start, stop))
+        return self
+
+    def _start(self, packets: Iterator[bytes]) -> None:
+        # skip OpusHead and OpusTags
+        next(packets, None)
+        next(packets, None)
+        self._packets = packets
+
+    def read(self) -> bytes:
+        try:
+            return next(self._packets, b"")
+        except ValueError:
+            _log.warning("Stopped playing a corrupt Ogg stream")
+            return b""
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        self._packets.close()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+def is_native_opus(path: Path) -> bool:
+    """Check whether a file can be played by :class:`OggOpusAudio`"""
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            return sniff_ogg_opus(mm)
+    except (OSError, ValueError):
+        # including empty files, which can't be mapped
+        return False
+
+
+@dataclass
+class GuildQueueStats:
+    requests: int = 0
+    played: int = 0
+    coalesced: int = 0
+    cancelled: int = 0
+    failed: int = 0
+    max_depth: int = 0
+
+    @property
+    def dropped(self) -> int:
+        return self.coalesced + self.cancelled
+
+
+@dataclass
+class _GuildQueue:
+    # Only the latest request is kept: a newer one replaces it while it waits,
+    # and cancels it while its source is being made
+    pending: ResolvedSound | None = None
+    pending_trace: PlayTrace | None = None
+    building: asyncio.Task[None] | None = None
+    task: asyncio.Task[None] | None = None
+    stats: GuildQueueStats = field(default_factory=GuildQueueStats)
+
+    @property
+    def depth(self) -> int:
+        return (self.pending is not None) + (self.building is not None)
+
+
+class SoundPlayer:
+    transcode_cache: TranscodeCache | None
+    probe_cache: ProbeCache | None
+    frame_cache: OpusFrameCache | None
+    ffmpeg_pool: FFmpegWorkerPool | None
+    archive: Archive | None
+    loudness: LoudnessCache | None
+    voice: VoiceManager
+    tracer: Tracer | None
+
+    def __init__(
+        self,
+        *,
+        transcode_cache: TranscodeCache | None = None,
+        probe_cache: ProbeCache | None = None,
+        frame_cache: OpusFrameCache | None = None,
+        ffmpeg_pool: FFmpegWorkerPool | None = None,
+        archive: Archive | None = None,
+        loudness: LoudnessCache | None = None,
+        voice: VoiceManager | None = None,
+        tracer: Tracer | None = None,
+    ) -> None:
+        self.transcode_cache = transcode_cache
+        self.probe_cache = probe_cache
+        self.frame_cache = frame_cache
+        self.ffmpeg_pool = ffmpeg_pool
+        self.archive = archive
+        self.loudness = loudness
+        self.voice = VoiceManager() if voice is None else voice
+        self.tracer = tracer
+        self.command_requests: Counter[str] = Counter()
+        self._queues: Dict[int, _GuildQueue] = {}
+        # Both are least recently used first, and bounded by _NATIVE_CACHE_SIZE
+        self._native: OrderedDict[FileIdentity, bool] = OrderedDict()
+        self._native_members: OrderedDict[Tuple[Path, int, int], bool] = OrderedDict()
+
+    @staticmethod
+    def _remember(cache: OrderedDict[_K, bool], key: _K, native: bool) -> None:
+        cache[key] = native
+        if len(cache) > _NATIVE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    async def _is_native(self, path: Path) -> bool:
+        try:
+            identity = FileIdentity.of(path)
+        except OSError:
+            return False
+        native = self._native.get(identity)
+        if native is not None:
+            self._native.move_to_end(identity)
+            return native
+
+        if self.probe_cache is not None:
+            probe = self.probe_cache.get(path)
+            if probe is not None and probe.codec != "opus":
+                native = False
+        if native is None:
+            # The whole file is read, so not on the event loop
+            loop = asyncio.get_running_loop()
+            native = await loop.run_in_executor(None, is_native_opus, path)
+        self._remember(self._native, identity, native)
+        return native
+
+    async def _get_archive_source(
+        self, archive: Archive, path: Path
+    ) -> AudioSource | None:
+        found = archive.member_range(path)
+        if found is not None:
+            mm = archive.mmap
+            assert mm is not None
+            # The member's range changes if the archive is replaced
+            key = (path, *found)
+            native = self._native_members.get(key)
+            if native is not None:
+                self._native_members.move_to_end(key)
+            else:
+                loop = asyncio.get_running_loop()
+                native = await loop.run_in_executor(None, sniff_ogg_opus, mm, *found)
+                self._remember(self._native_members, key, native)
+            if native:
+                return OggOpusAudio.from_range(mm, *found)
+
+        # Anything else is piped to ffmpeg, still without extracting it to disk
+        member = archive.open(path)
+        if member is None:
+            return None
+        if self.ffmpeg_pool is not None:
+            source = self.ffmpeg_pool.source(member)
+            if source is not None:
+                return source
+        return FFmpegOpusAudio(member, pipe=True)
+
+    async def get_source(
+        self, sound: ResolvedSound, trace: PlayTrace | None = None
+    ) -> AudioSource:
+        handle = sound.random()
+
+        archive = handle.storage if isinstance(handle.storage, Archive) else None
+        if archive is None:
+            archive = self.archive
+        if archive is not None:
+            source = await self._get_archive_source(archive, handle.path)
+            if source is not None:
+                return source
+
+        path = handle.local_path()
+        if path is None:
+            # Not downloaded yet, so fetch it without blocking the loop
+            loop = asyncio.get_running_loop()
+            began = time.perf_counter()
+            path = await loop.run_in_executor(None, handle.fetch)
+            if trace is not None:
+                trace.record("fetch", began)
+        if path is None:
+            raise FileNotFoundError(handle.path)
+
+        if self.frame_cache is not None:
+            frames = self.frame_cache.get(path)
+            if frames is not None:
+                return CachedOpusAudio(frames)
+
+        if self.transcode_cache is not None:
+            rendition = self.transcode_cache.get(path)
+            if rendition is not None:
+                # Renditions are already Ogg Opus in 20ms frames
+                return OggOpusAudio(rendition)
+
+        gain = None if self.loudness is None else self.loudness.gain(path)
+        if gain:
+            # Without a baked-in rendition, the gain needs ffmpeg to re-encode
+            return FFmpegOpusAudio(str(path), options=f"-af {volume_filter(gain)}")
+
+        if await self._is_native(path):
+            return OggOpusAudio(path)
+
+        if self.ffmpeg_pool is not None:
+            # Pooled processes are already running, so don't need probing
+            source = self.ffmpeg_pool.source(path)
+            if source is not None:
+                return source
+
+        if self.probe_cache is not None:
+            probe = self.probe_cache.get(path)
+            if probe is None:
+                loop = asyncio.get_running_loop()
+                began = time.perf_counter()
+                probe = await loop.run_in_executor(None, self.probe_cache.probe, path)
+                if trace is not None:
+                    trace.record("probe", began)
+            return FFmpegOpusAudio(str(path), codec=probe.codec, bitrate=probe.bitrate)
+
+        began = time.perf_counter()
+        source = await FFmpegOpusAudio.from_probe(str(path))
+        if trace is not None:
+            trace.record("probe", began)
+        return source
+
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        return {
+            guild_id: {
+                "depth": queue.depth,
+                "max_depth": queue.stats.max_depth,
+                "requests": queue.stats.requests,
+                "played": queue.stats.played,
+                "coalesced": queue.stats.coalesced,
+                "cancelled": queue.stats.cancelled,
+                "dropped": queue.stats.dropped,
+                "failed": queue.stats.failed,
+            }
+            for guild_id, queue in self._queues.items()
+        }
+
+    def _finish(self, trace: PlayTrace | None, outcome: str) -> None:
+        if trace is not None and self.tracer is not None:
+            self.tracer.finish(trace, outcome)
+
+    def _responded(self, trace: PlayTrace | None, since: float | None) -> None:
+        if trace is not None and self.tracer is not None:
+            self.tracer.responded(trace, since)
+
+    def enqueue(
+        self, guild: Guild, sound: ResolvedSound, trace: PlayTrace | None = None
+    ) -> None:
+        queue = self._queues.get(guild.id)
+        if queue is None:
+            queue = self._queues[guild.id] = _GuildQueue()
+
+        queue.stats.requests += 1
+        if queue.pending is not None:
+            queue.stats.coalesced += 1
+            self._finish(queue.pending_trace, "coalesced")
+        queue.pending = sound
+        queue.pending_trace = trace
+        if trace is not None:
+            trace.mark("enqueued")
+        if queue.building is not None and queue.building.cancel():
+            queue.stats.cancelled += 1
+        queue.stats.max_depth = max(queue.stats.max_depth, queue.depth)
+
+        if queue.task is None:
+            queue.task = asyncio.get_running_loop().create_task(
+                self._run_queue(guild, queue)
+            )
+
+    async def _run_queue(self, guild: Guild, queue: _GuildQueue) -> None:
+        try:
+            while queue.pending is not None:
+                sound, queue.pending = queue.pending, None
+                trace, queue.pending_trace = queue.pending_trace, None
+                building = asyncio.get_running_loop().create_task(
+                    self._play(guild, sound, trace)
+                )
+                queue.building = building
+                await asyncio.wait({building})
+                queue.building = None
+
+                if building.cancelled():
+                    self._finish(trace, "cancelled")
+                    continue
+                exc = building.exception()
+                if exc is not None:
+                    queue.stats.failed += 1
+                    self._finish(trace, "failed")
+                    _log.error("Failed to play %s", sound.name, exc_info=exc)
+                else:
+                    queue.stats.played += 1
+        finally:
+            queue.building = None
+            queue.task = None
 
+    async def _play(
+        self, guild: Guild, sound: ResolvedSound, trace: PlayTrace | None = None
+    ) -> None:
+        if trace is not None:
+            queued = trace.record("queue", trace.marks["enqueued"])
+        voice_client = guild.voice_client
+        if not isinstance(voice_client, VoiceClient):
+            self._finish(trace, "stopped")
+            return
 
-async def get_source(sound: ResolvedSound) -> FFmpegOpusAudio:
-    return await FFmpegOpusAudio.from_probe(str(sound.random()))
+        # Stop the current source first, so its ffmpeg process is killed before
+        # the next one is started
+        if voice_client.is_playing():
+            voice_client.stop()
 
+        source = await self.get_source(sound, trace)
+        if trace is not None and self.tracer is not None:
+            trace.record("source", queued)
+            source = TracedSource(source, self.tracer, trace)
+        voice_client.play(source)
+        self.voice.touch(guild)
 
-async def play_sound(ctx: ApplicationContext, sound: ResolvedSound):
-    if not await join(ctx):
-        return
+    async def play_sound(self, ctx: ApplicationContext, sound: ResolvedSound):
+        trace = None
+        if self.tracer is not None and ctx.guild is not None:
+            trace = self.tracer.start(ctx.command.name, ctx.guild.id, sound.name)
 
-    if ctx.guild is not None and isinstance(ctx.guild.voice_client, VoiceClient):
-        if ctx.guild.voice_client.is_playing():
-            ctx.guild.voice_client.stop()
+        joined = await join(ctx, self.voice, trace)
+        if not (
+            joined
+            and ctx.guild is not None
+            and isinstance(ctx.guild.voice_client, VoiceClient)
+        ):
+            self._finish(trace, "rejected")
+            self._responded(trace, None)
+            return
 
-        source = await get_source(sound)
-        ctx.guild.voice_client.play(source)
+        self.command_requests[ctx.command.name] += 1
+        self.enqueue(ctx.guild, sound, trace)
+        began = time.perf_counter()
         await respond(ctx, ctx.command.name)
+        self._responded(trace, began)
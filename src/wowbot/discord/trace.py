@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Protocol, Tuple
+
+from discord import AudioSource
+
+_log = logging.getLogger(__name__)
+
+# The phases of playing a sound, in the order they happen
+PHASES = (
+    "join",  # util.join, including the handshake
+    "handshake",  # connecting to the voice channel, if not already connected
+    "respond",  # replying to the interaction
+    "queue",  # waiting for the guild's previous sound to be built
+    "fetch",  # downloading a remote file
+    "probe",  # running ffprobe
+    "source",  # SoundPlayer.get_source, including fetching and probing
+    "start",  # from playing the source to its first packet, e.g. ffmpeg starting
+    "total",  # from the interaction to the first packet
+)
+
+# Prometheus' default buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclass
+class PlayTrace:
+    """The timings of one invocation of a sound command
+
+    Times are from :func:`time.perf_counter`, and phases are in seconds.
+    """
+
+    command: str
+    guild_id: int
+    sound: str
+    started: float = field(default_factory=time.perf_counter)
+    phases: Dict[str, float] = field(default_factory=dict)
+    marks: Dict[str, float] = field(default_factory=dict)
+    outcome: str | None = None
+    # Playing and responding happen side by side, and both must finish
+    pending: int = 2
+
+    def record(self, phase: str, since: float) -> float:
+        """Record phase as having taken from since until now, and return now"""
+        now = time.perf_counter()
+        self.phases[phase] = now - since
+        return now
+
+    def mark(self, event: str) -> float:
+        now = self.marks[event] = time.perf_counter()
+        return now
+
+
+class TraceSink(Protocol):
+    def emit(self, trace: PlayTrace) -> None: ...
+
+
+class LogSink:
+    """Logs a line for each finished trace"""
+
+    def __init__(self, logger: logging.Logger = _log, level: int = logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def emit(self, trace: PlayTrace) -> None:
+        phases = " ".join(
+            f"{phase}={trace.phases[phase] * 1000:.1f}ms"
+            for phase in PHASES
+            if phase in trace.phases
+        )
+        self.logger.log(
+            self.level,
+            "/%s %s in guild %d %s: %s",
+            trace.command,
+            trace.sound,
+            trace.guild_id,
+            trace.outcome,
+            phases,
+        )
+
+
+class RingBufferSink:
+    """Keeps the last size finished traces in memory"""
+
+    def __init__(self, size: int = 1000) -> None:
+        self.traces: Deque[PlayTrace] = deque(maxlen=size)
+
+    def emit(self, trace: PlayTrace) -> None:
+        self.traces.append(trace)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Get each bucket's upper bound and the count at or below it"""
+        total = 0
+        result: List[Tuple[str, int]] = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((f"{bound:g}", total))
+        result.append(("+Inf", self.count))
+        return result
+
+
+def escape_label(value: str) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusSink:
+    """Aggregates traces into histograms of each phase per command and per guild
+
+    :meth:`render` gives them in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.by_command: Dict[Tuple[str, str], Histogram] = {}
+        self.by_guild: Dict[Tuple[str, int], Histogram] = {}
+        self.outcomes: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms: Dict, key: Tuple) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def emit(self, trace: PlayTrace) -> None:
+        assert trace.outcome is not None
+        with self._lock:
+            key = (trace.command, trace.outcome)
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            for phase, seconds in trace.phases.items():
+                self._histogram(self.by_command, (phase, trace.command)).observe(
+                    seconds
+                )
+                self._histogram(self.by_guild, (phase, trace.guild_id)).observe(seconds)
+
+    def _render_histograms(
+        self, name: str, label: str, histograms: Dict[Tuple[str, object], Histogram]
+    ) -> List[str]:
+        lines: List[str] = []
+        for (phase, value), histogram in sorted(
+            histograms.items(), key=lambda item: str(item[0])
+        ):
+            labels = f'phase="{phase}",{label}="{escape_label(str(value))}"'
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP wowbot_plays_total Sound command invocations, by outcome",
+                "# TYPE wowbot_plays_total counter",
+            ]
+            for (command, outcome), count in sorted(self.outcomes.items()):
+                lines.append(
+                    f'wowbot_plays_total{{command="{escape_label(command)}",'
+                    f'outcome="{outcome}"}} {count}'
+                )
+            lines += [
+                "# HELP wowbot_play_seconds Time in each phase of playing a sound",
+                "# TYPE wowbot_play_seconds histogram",
+            ]
+            lines += self._render_histograms(
+                "wowbot_play_seconds", "command", self.by_command
+            )
+            lines += [
+                "# HELP wowbot_guild_play_seconds Time in each phase, by guild",
+                "# TYPE wowbot_guild_play_seconds histogram",
+            ]
+            lines += self._render_histograms(
+                "wowbot_guild_play_seconds", "guild", self.by_guild
+            )
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Times the phases of playing sounds, and passes the timings to sinks
+
+    A trace is emitted once both its response has been sent and its sound has an
+    outcome: played, when its first packet is read; stopped, if its source is
+    cleaned up before that; rejected, if the user couldn't be joined; or
+    coalesced, cancelled or failed, as in the guild's queue statistics. Players
+    without a tracer don't make traces at all.
+    """
+
+    def __init__(self, sinks: Iterable[TraceSink]) -> None:
+        self.sinks = list(sinks)
+        # Sources are read and cleaned up in the audio player's thread
+        self._lock = threading.Lock()
+
+    def start(self, command: str, guild_id: int, sound: str) -> PlayTrace:
+        return PlayTrace(command, guild_id, sound)
+
+    def finish(self, trace: PlayTrace, outcome: str) -> None:
+        """Give trace's sound its outcome, if it doesn't have one already"""
+        with self._lock:
+            if trace.outcome is not None:
+                return
+            trace.outcome = outcome
+            if outcome == "played":
+                trace.record("total", trace.started)
+            trace.pending -= 1
+            done = trace.pending == 0
+        if done:
+            self._emit(trace)
+
+    def responded(self, trace: PlayTrace, since: float | None) -> None:
+        """Record that trace's response was sent, having started at since"""
+        with self._lock:
+            if since is not None:
+                trace.record("respond", since)
+            trace.pending -= 1
+            done = trace.pending == 0
+        if done:
+            self._emit(trace)
+
+    def _emit(self, trace: PlayTrace) -> None:
+        for sink in self.sinks:
+            try:
+                sink.emit(trace)
+            except Exception:
+                _log.exception("Trace sink %r failed", sink)
+
+
+class TracedSource(AudioSource):
+    """Wraps a source to finish its trace when its first packet is read"""
+
+    def __init__(self, source: AudioSource, tracer: Tracer, trace: PlayTrace):
+        self.source = source
+        self.tracer = tracer
+        self.trace: PlayTrace | None = trace
+        self.playing = trace.mark("playing")
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        if self.trace is not None:
+            self.trace.record("start", self.playing)
+            self.tracer.finish(self.trace, "played" if data else "stopped")
+            self.trace = None
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+        if self.trace is not None:
+            self.tracer.finish(self.trace, "stopped")
+            self.trace = None
+
+
+def make_tracer(spec: str) -> Tracer | None:
+    """Make a tracer from a comma-separated list of sinks
+
+    The sinks are :code:`log`, :code:`ring` (or :code:`ring:SIZE`) and
+    :code:`prometheus`. An empty spec gives no tracer.
+    """
+    sinks: List[TraceSink] = []
+    for name in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, arg = name.partition(":")
+        if name == "log":
+            sinks.append(LogSink())
+        elif name == "ring":
+            sinks.append(RingBufferSink(int(arg) if arg else 1000))
+        elif name == "prometheus":
+            sinks.append(PrometheusSink())
+        else:
+            raise ValueError(f"unknown trace sink {name!r}")
+    return Tracer(sinks) if sinks else None
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import time
 from typing import Any
 
 from discord import ApplicationContext, Member
 from discord.channel import VocalGuildChannel
 
+from .trace import PlayTrace
+from .voice import VoiceManager
+
 
 async def respond(ctx: ApplicationContext, *args: Any, **kwargs: Any):
     await ctx.send_response(*args, ephemeral=True, delete_after=4, **kwargs)
@@ -24,7 +28,9 @@ def get_voice_name(ctx: ApplicationContext, default: str) -> str:
     return default
 
 
-async def join(ctx: ApplicationContext) -> bool:
+async def join(
+    ctx: ApplicationContext, voice: VoiceManager, trace: PlayTrace | None = None
+) -> bool:
     if ctx.guild is None:
         await err(ctx, "You aren't in a server!")
         return False
@@ -39,18 +45,14 @@ async def join(ctx: ApplicationContext) -> bool:
     if ctx.author.voice.channel is None:
         return False
 
-    if ctx.guild.voice_client is None:
-        await ctx.author.voice.channel.connect()
-        return True
-    elif ctx.guild.voice_client.channel == ctx.author.voice.channel:
-        return True
-    else:
-        await ctx.guild.voice_client.disconnect(force=False)
-        await ctx.author.voice.channel.connect()
-        return True
+    began = time.perf_counter()
+    await voice.connect(ctx.author.voice.channel, trace)
+    if trace is not None:
+        trace.record("join", began)
+    return True
 
 
-async def leave(ctx: ApplicationContext) -> bool:
+async def leave(ctx: ApplicationContext, voice: VoiceManager) -> bool:
     if ctx.guild is None:
         await err(ctx, "You aren't in a server!")
         return False
@@ -72,5 +74,5 @@ async def leave(ctx: ApplicationContext) -> bool:
         await err(ctx, "I'm not in your voice chat!")
         return False
     else:
-        await ctx.guild.voice_client.disconnect(force=False)
+        await voice.disconnect(ctx.guild)
         return True
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+from discord import Guild, VoiceClient
+from discord.channel import VocalGuildChannel
+
+from .trace import PlayTrace
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class GuildVoiceStats:
+    connected_at: float
+    last_used: float
+    connects: int = 0
+    moves: int = 0
+    reuses: int = 0
+
+
+class VoiceManager:
+    """Keeps voice connections open between sounds, and closes idle ones
+
+    Joining a channel in a guild which already has a connection moves it,
+    rather than disconnecting and connecting again. Connections which have not
+    played anything for :code:`idle_timeout` seconds are disconnected by a
+    sweeper task, which runs every :code:`sweep_interval` seconds once started.
+    An :code:`idle_timeout` of 0 keeps connections open forever.
+    """
+
+    def __init__(self, *, idle_timeout: float = 300.0, sweep_interval: float = 30.0):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.reclaimed = 0
+
+        self._guilds: Dict[int, Guild] = {}
+        self._stats: Dict[int, GuildVoiceStats] = {}
+        self._sweeper: asyncio.Task[None] | None = None
+
+    def _voice_client(self, guild: Guild) -> VoiceClient | None:
+        voice_client = guild.voice_client
+        if isinstance(voice_client, VoiceClient) and voice_client.is_connected():
+            return voice_client
+        return None
+
+    async def connect(
+        self, channel: VocalGuildChannel, trace: PlayTrace | None = None
+    ) -> VoiceClient:
+        """Get a connection to channel, reusing or moving the guild's connection
+
+        A new connection's handshake is recorded in trace, if given.
+        """
+        guild = channel.guild
+        now = time.monotonic()
+        stats = self._stats.get(guild.id)
+        voice_client = self._voice_client(guild)
+
+        if voice_client is None:
+            if guild.voice_client is not None:
+                # a half-open connection can't be moved
+                await guild.voice_client.disconnect(force=True)
+            began = time.perf_counter()
+            voice_client = await channel.connect()
+            if trace is not None:
+                trace.record("handshake", began)
+            connects = 1 if stats is None else stats.connects + 1
+            stats = self._stats[guild.id] = GuildVoiceStats(now, now, connects)
+        else:
+            if stats is None:
+                # connected by something else, so start tracking it now
+                stats = self._stats[guild.id] = GuildVoiceStats(now, now)
+            if voice_client.channel == channel:
+                stats.reuses += 1
+            else:
+                await voice_client.move_to(channel)
+                stats.moves += 1
+
+        self._guilds[guild.id] = guild
+        stats.last_used = now
+        return voice_client
+
+    def touch(self, guild: Guild) -> None:
+        """Record that the guild's connection has just been used"""
+        stats = self._stats.get(guild.id)
+        if stats is not None:
+            stats.last_used = time.monotonic()
+
+    async def disconnect(self, guild: Guild) -> None:
+        """Disconnect the guild's connection, and stop tracking it"""
+        self._guilds.pop(guild.id, None)
+        self._stats.pop(guild.id, None)
+        if guild.voice_client is not None:
+            await guild.voice_client.disconnect(force=False)
+
+    async def sweep(self, now: float | None = None) -> int:
+        """Disconnect every idle connection, returning how many were closed"""
+        if now is None:
+            now = time.monotonic()
+
+        closed = 0
+        for guild_id, guild in list(self._guilds.items()):
+            stats = self._stats[guild_id]
+            voice_client = self._voice_client(guild)
+            if voice_client is None:
+                # disconnected by Discord, or by someone else
+                self._guilds.pop(guild_id)
+                self._stats.pop(guild_id)
+            elif voice_client.is_playing():
+                stats.last_used = now
+            elif self.idle_timeout > 0 and now - stats.last_used >= self.idle_timeout:
+                _log.info("Disconnecting from idle voice in guild %s", guild_id)
+                await self.disconnect(guild)
+                closed += 1
+        self.reclaimed += closed
+        return closed
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                _log.exception("Failed to sweep idle voice connections")
+
+    def start(self) -> None:
+        """Start the sweeper on the running event loop, if it isn't running"""
+        if self.idle_timeout > 0 and self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(
+                self._sweep_forever()
+            )
+
+    def stop(self) -> None:
+        """Stop the sweeper"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def connected(self) -> int:
+        """Count the guilds with an open connection"""
+        return sum(
+            self._voice_client(guild) is not None for guild in self._guilds.values()
+        )
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        """Get the age, idle time and reuse counts of each guild's connection"""
+        now = time.monotonic()
+        return {
+            guild_id: {
+                "age": now - stats.connected_at,
+                "idle": now - stats.last_used,
+                "connects": stats.connects,
+                "moves": stats.moves,
+                "reuses": stats.reuses,
+            }
+            for guild_id, stats in self._stats.items()
+        }
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+__all__ = [
+    "Archive",
+    "MappedMember",
+]
+
+import io
+import mmap
+import struct
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import IO, Dict, List, Tuple
+
+from .index import DirectoryIndex
+from .storage import Storage
+
+_LOCAL_HEADER = struct.Struct("<4s22xHH")  # signature, ..., name and extra lengths
+
+
+def _member_name(name: str) -> str | None:
+    # Tar members are often stored as "./name"; anything escaping the archive is
+    # left out, so that it can't be resolved
+    parts = [part for part in PurePosixPath(name).parts if part != "."]
+    if not parts or parts[0] == "/" or ".." in parts:
+        return None
+    return "/".join(parts)
+
+
+class MappedMember(io.RawIOBase):
+    """A read-only file over part of a memory-mapped archive, without extracting it"""
+
+    def __init__(self, data: mmap.mmap, start: int, stop: int) -> None:
+        # Slicing, rather than a memoryview, so that the archive can still be
+        # closed while a member is open
+        self._data = data
+        self._pos = start
+        self._stop = stop
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore[override]
+        size = min(len(buffer), self._stop - self._pos)
+        buffer[:size] = self._data[self._pos : self._pos + size]
+        self._pos += size
+        return size
+
+
+class Archive(Storage):
+    """A zip or tar file used as a sounds folder
+
+    The archive's own path is the sounds root, so a sound file resolves to a path
+    below it, and is found in the archive by its path relative to the root.
+
+    The archive is memory-mapped, and members which are stored uncompressed (all
+    members of a plain tar file, and stored members of a zip file) are read from
+    the mapping without being extracted. Other members are decompressed into
+    memory when they are read.
+
+    .. autoattribute:: path
+
+    .. automethod:: names
+    .. automethod:: index
+    .. automethod:: read_text
+    .. automethod:: read_bytes
+    .. automethod:: member_range
+    .. automethod:: open
+    .. automethod:: read
+    .. automethod:: close
+    """
+
+    path: Path
+    """The archive file, which is also the sounds root"""
+    mmap: mmap.mmap | None
+    """The mapped archive, or None if the whole file is compressed"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = self.root = path
+        self.mmap = None
+        self._zip: zipfile.ZipFile | None = None
+        self._tar: tarfile.TarFile | None = None
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        self._members: Dict[str, zipfile.ZipInfo | tarfile.TarInfo] = {}
+        try:
+            if zipfile.is_zipfile(path):
+                self._zip = zipfile.ZipFile(path)
+                self._map()
+                self._read_zip(self._zip)
+            else:
+                try:
+                    self._tar = tarfile.open(path, "r:")
+                except tarfile.ReadError:
+                    # compressed as a whole, so members can't be mapped
+                    self._tar = tarfile.open(path, "r:*")
+                    self._read_tar(self._tar, mapped=False)
+                else:
+                    self._map()
+                    self._read_tar(self._tar, mapped=True)
+        except (tarfile.TarError, zipfile.BadZipFile) as err:
+            self.close()
+            raise ValueError(f"{path} is not a zip or tar file") from err
+        except BaseException:
+            self.close()
+            raise
+
+    def _map(self) -> None:
+        with open(self.path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_zip(self, zf: zipfile.ZipFile) -> None:
+        assert self.mmap is not None
+        for info in zf.infolist():
+            name = _member_name(info.filename)
+            if name is None or info.is_dir():
+                continue
+            self._members[name] = info
+            if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+                continue
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack_from(
+                self.mmap, info.header_offset
+            )
+            if signature != b"PK\x03\x04":
+                raise ValueError(f"Bad local header for {info.filename}")
+            start = info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+            self._ranges[name] = (start, start + info.file_size)
+
+    def _read_tar(self, tf: tarfile.TarFile, *, mapped: bool) -> None:
+        for info in tf.getmembers():
+            name = _member_name(info.name)
+            if name is None or not info.isfile():
+                continue
+            self._members[name] = info
+            if mapped and not info.sparse:  # type: ignore[attr-defined]
+                self._ranges[name] = (info.offset_data, info.offset_data + info.size)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def _member(self, path: Path) -> str | None:
+        try:
+            return path.relative_to(self.path).as_posix()
+        except ValueError:
+            return None
+
+    def names(self) -> List[str]:
+        """Get the paths of the sound files in the archive, relative to its root"""
+        return list(self._members)
+
+    def index(self, jobs: int = 1) -> DirectoryIndex:
+        """Get an index of the sound files in the archive, rooted at its path"""
+        return DirectoryIndex.from_paths(self.path, self.names())
+
+    def read_member(self, name: str) -> bytes:
+        """Read a member of the archive by its name"""
+        found = self._ranges.get(name)
+        if found is not None:
+            assert self.mmap is not None
+            start, stop = found
+            return self.mmap[start:stop]
+
+        info = self._members.get(name)
+        if info is None:
+            raise FileNotFoundError(f"{name} is not in {self.path}")
+        if isinstance(info, zipfile.ZipInfo):
+            assert self._zip is not None
+            return self._zip.read(info)
+        assert self._tar is not None
+        f = self._tar.extractfile(info)
+        assert f is not None
+        with f:
+            return f.read()
+
+    def read_text(self, name: str) -> str:
+        """Read a member of the archive as text"""
+        return self.read_member(name).decode()
+
+    def read_bytes(self, name: str) -> bytes:
+        """Read a member of the archive, like :meth:`read_member`"""
+        return self.read_member(name)
+
+    def member_range(self, path: Path) -> Tuple[int, int] | None:
+        """Get the start and end of a sound file in :attr:`mmap`
+
+        path is a resolved sound file, below :attr:`path`. This is None if the
+        file isn't in the archive, or isn't stored uncompressed.
+        """
+        name = self._member(path)
+        if name is None:
+            return None
+        return self._ranges.get(name)
+
+    def open(self, path: Path) -> IO[bytes] | None:
+        """Open a sound file, reading it from the mapping if it is stored there"""
+        name = self._member(path)
+        if name is None or name not in self._members:
+            return None
+        found = self._ranges.get(name)
+        if found is not None:
+            assert self.mmap is not None
+            return io.BufferedReader(MappedMember(self.mmap, *found))
+        return io.BytesIO(self.read_member(name))
+
+    def read(self, path: Path) -> bytes | None:
+        """Read a sound file, or return None if it isn't in the archive"""
+        name = self._member(path)
+        if name is None or name not in self._members:
+            return None
+        return self.read_member(name)
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+        if self.mmap is not None:
+            self.mmap.close()
+
+    def __enter__(self) -> Archive:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+__all__ = [
+    "MANIFEST_FILE",
+    "Bundle",
+    "BundleSource",
+    "build_bundle",
+    "iter_sources",
+    "open_archive",
+    "transcode_to_bytes",
+]
+
+import json
+import os
+import subprocess
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from .archive import Archive
+from .transcode import TRANSCODE_VERSION, file_digest, opus_transcode_args
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def transcode_to_bytes(
+    source: str, *, executable: str = "ffmpeg", bitrate: int = 128
+) -> bytes:
+    """Transcode a file into 48kHz stereo Ogg Opus, returning the output"""
+    args = opus_transcode_args(source, "pipe:1", executable=executable, bitrate=bitrate)
+    return subprocess.run(
+        args, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+    ).stdout
+
+
+class BundleSource(NamedTuple):
+    """A sound file to put into a bundle"""
+
+    name: str
+    """The path of the file in the bundle, relative to the sounds folder"""
+    path: Path
+    """The file to transcode"""
+
+
+class _Stamp(NamedTuple):
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+class Bundle(Archive):
+    """A single file holding a sounds folder, with every sound file transcoded
+
+    A bundle is an uncompressed zip file. It holds the sounds and commands files,
+    a manifest, and one Ogg Opus object for each distinct sound file, named by
+    the hash of the file's contents. The manifest maps the path of each sound
+    file in the original folder to its object, so a bundle is mounted like any
+    other :class:`~wowbot.model.archive.Archive`, and its objects are played
+    from the mapping without being copied.
+
+    .. autoattribute:: manifest
+    """
+
+    manifest: Dict[str, Any]
+    """The parsed manifest"""
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        try:
+            if self._zip is None or len(self._ranges) != len(self._members):
+                raise ValueError(f"{path} is not an uncompressed zip file")
+            self.manifest = json.loads(self.read_text(MANIFEST_FILE))
+            if self.manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"Unsupported bundle version in {path}")
+        except BaseException:
+            self.close()
+            raise
+        self._files: Dict[str, str] = self.manifest["files"]
+
+    def _member(self, path: Path) -> str | None:
+        name = super()._member(path)
+        return None if name is None else self._files.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._files)
+
+
+def open_archive(path: Path) -> Archive:
+    """Open an archive to use as a sounds folder, as a Bundle if it is one"""
+    archive = Archive(path)
+    if archive._zip is None or MANIFEST_FILE not in archive:
+        return archive
+    archive.close()
+    return Bundle(path)
+
+
+def _object_name(digest: str, bitrate: int) -> str:
+    return f"objects/{digest[:2]}/{digest}-v{TRANSCODE_VERSION}-{bitrate}k.opus"
+
+
+def _read_previous(out: Path) -> Tuple[Dict[str, _Stamp], Bundle | None]:
+    try:
+        previous = Bundle(out)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return {}, None
+    stamps = {
+        name: _Stamp(*stamp)
+        for name, stamp in previous.manifest.get("sources", {}).items()
+    }
+    return stamps, previous
+
+
+def build_bundle(
+    out: Path,
+    sources: Iterable[BundleSource],
+    sounds_text: str,
+    commands_text: str,
+    *,
+    jobs: int | None = None,
+    executable: str = "ffmpeg",
+    bitrate: int = 128,
+    progress: Callable[[str], object] | None = None,
+) -> Dict[str, int]:
+    """Write a bundle of the given sound files to out
+
+    Files are hashed, and each distinct file is transcoded once, in a pool of
+    jobs processes. If out is already a bundle, files whose size and
+    modification time are unchanged are not hashed again, and objects which it
+    already holds are copied rather than transcoded.
+
+    Returns counts of the files, objects, and objects which were transcoded.
+    """
+    stamps, previous = _read_previous(out)
+    files: Dict[str, str] = {}
+    new_stamps: Dict[str, _Stamp] = {}
+    to_transcode: Dict[str, Path] = {}
+    tmp = out.with_name(f".{out.name}.{os.getpid()}")
+    try:
+        for source in sources:
+            st = source.path.stat()
+            stamp = stamps.get(source.name)
+            if stamp is None or stamp[:2] != (st.st_size, st.st_mtime_ns):
+                stamp = _Stamp(st.st_size, st.st_mtime_ns, file_digest(source.path))
+            new_stamps[source.name] = stamp
+
+            obj = _object_name(stamp.digest, bitrate)
+            files[source.name] = obj
+            if previous is None or obj not in previous._ranges:
+                to_transcode.setdefault(obj, source.path)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "transcode_version": TRANSCODE_VERSION,
+            "bitrate": bitrate,
+            "files": files,
+            "sources": {name: list(stamp) for name, stamp in new_stamps.items()},
+        }
+
+        with zipfile.ZipFile(tmp, "w") as zf:
+            _write_stored(zf, MANIFEST_FILE, json.dumps(manifest, indent=1).encode())
+            _write_stored(zf, "sounds.json", sounds_text.encode())
+            _write_stored(zf, "commands.json", commands_text.encode())
+            for obj in sorted(set(files.values()).difference(to_transcode)):
+                assert previous is not None
+                _write_stored(zf, obj, previous.read_member(obj))
+
+            if to_transcode:
+                # Objects are written as they finish, so that only a few are held
+                # in memory at once
+                with ProcessPoolExecutor(jobs) as pool:
+                    futures = {
+                        pool.submit(
+                            transcode_to_bytes,
+                            str(path),
+                            executable=executable,
+                            bitrate=bitrate,
+                        ): obj
+                        for obj, path in to_transcode.items()
+                    }
+                    for future in as_completed(futures):
+                        _write_stored(zf, futures[future], future.result())
+                        if progress is not None:
+                            progress(futures[future])
+
+        if previous is not None:
+            previous.close()
+            previous = None
+        os.replace(tmp, out)
+    finally:
+        if previous is not None:
+            previous.close()
+        if tmp.exists():
+            tmp.unlink()
+
+    return {
+        "files": len(files),
+        "objects": len(set(files.values())),
+        "transcoded": len(to_transcode),
+    }
+
+
+def _write_stored(zf: zipfile.ZipFile, name: str, data: bytes) -> None:
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    zf.writestr(info, data)
+
+
+def iter_sources(root: Path, files: Iterable[Path]) -> List[BundleSource]:
+    """Get the name in the bundle of every file, which must be below root"""
+    sources: List[BundleSource] = []
+    for path in dict.fromkeys(files):
+        name = path.relative_to(root).as_posix()
+        if ".." in name.split("/"):
+            raise ValueError(f"{path} is not inside {root}")
+        sources.append(BundleSource(name, path))
+    return sources
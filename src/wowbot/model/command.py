@@ -11,12 +11,12 @@ __all__ = [
     "CommandsJson",
 ]
 
-from typing import TYPE_CHECKING, Iterable, List, Literal, NewType, Union
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Literal, NewType, Union
 
 from pydantic import conlist, constr, field_validator
 
 from .errors import BaseModelError, ContextModelError, ErrorCollection, context
-from .model import BaseModel
+from .model import BaseModel, tagged_union
 from .sound import SoundCollection, SoundName
 
 
@@ -190,7 +190,20 @@ class SubcommandsCommand(BaseModel):
             raise ErrorCollection(*errors)
 
 
-AnyCommand = Union[SoundCommand, ChoiceCommand, SubcommandsCommand]
+def _command_tag(value: Dict[str, Any]) -> str:
+    if "subcommands" in value:
+        return "SubcommandsCommand"
+    if "choices" in value:
+        return "ChoiceCommand"
+    return "SoundCommand"
+
+
+if TYPE_CHECKING:
+    AnyCommand = Union[SoundCommand, ChoiceCommand, SubcommandsCommand]
+else:
+    AnyCommand = tagged_union(
+        _command_tag, SoundCommand, ChoiceCommand, SubcommandsCommand
+    )
 
 
 SubcommandsCommand.model_rebuild()
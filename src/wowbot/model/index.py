@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+__all__ = [
+    "DirectoryIndex",
+]
+
+import fnmatch
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from pathlib import Path, PurePath
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+_Matcher = Callable[[str], "re.Match[str] | None"]
+
+
+class _Node:
+    """An entry in a directory index
+
+    :code:`exists` and :code:`is_dir` follow symlinks. :code:`children` is None
+    for files, and for folders which could not be indexed.
+    """
+
+    __slots__ = ("exists", "is_dir", "is_symlink", "children")
+
+    def __init__(
+        self,
+        exists: bool,
+        is_dir: bool,
+        is_symlink: bool,
+        children: Dict[str, _Node] | None,
+    ) -> None:
+        self.exists = exists
+        self.is_dir = is_dir
+        self.is_symlink = is_symlink
+        self.children = children
+
+
+class _Unindexed(Exception):
+    """Raised when a lookup reaches a part of the tree which is not indexed"""
+
+
+@lru_cache(maxsize=None)
+def _compile(part: str) -> _Matcher:
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile(fnmatch.translate(part), flags).fullmatch
+
+
+def _is_wildcard(part: str) -> bool:
+    return "*" in part or "?" in part or "[" in part
+
+
+_Pending = List[Tuple[_Node, str, str]]
+
+
+def _scan_dir(path: str, real: str) -> Tuple[Dict[str, _Node], _Pending]:
+    entries: Dict[str, _Node] = {}
+    subdirs: _Pending = []
+    with os.scandir(path) as it:
+        for entry in it:
+            is_symlink = entry.is_symlink()
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            exists = not is_symlink or is_dir or os.path.exists(entry.path)
+
+            node = _Node(exists, is_dir, is_symlink, None)
+            entries[entry.name] = node
+
+            if is_dir:
+                if is_symlink:
+                    child_real = os.path.realpath(entry.path)
+                    # don't follow a link back into one of its own ancestors
+                    looped = real == child_real or real.startswith(
+                        os.path.join(child_real, "")
+                    )
+                else:
+                    child_real = os.path.join(real, entry.name)
+                    looped = False
+                if not looped:
+                    subdirs.append((node, entry.path, child_real))
+    return entries, subdirs
+
+
+def _try_scan_dir(
+    pending: Tuple[_Node, str, str],
+) -> Tuple[Dict[str, _Node], _Pending] | None:
+    _, path, real = pending
+    try:
+        return _scan_dir(path, real)
+    except OSError:
+        return None
+
+
+def _scan(path: str, real: str, jobs: int) -> Dict[str, _Node]:
+    tree, pending = _scan_dir(path, real)
+
+    with ExitStack() as stack:
+        map_: Callable[..., Iterable[Any]] = map
+        if jobs > 1:
+            map_ = stack.enter_context(ThreadPoolExecutor(jobs)).map
+
+        # Scan a level of the tree at a time, so a pool can scan folders in parallel
+        while pending:
+            next_pending: _Pending = []
+            for (node, _, _), result in zip(pending, map_(_try_scan_dir, pending)):
+                if result is not None:
+                    node.children, subdirs = result
+                    next_pending.extend(subdirs)
+            pending = next_pending
+
+    return tree
+
+
+class DirectoryIndex:
+    """An in-memory index of every entry below a folder
+
+    The folder is walked once with :code:`os.scandir`, and then paths and glob
+    patterns are looked up in memory. Lookups give the same results as
+    :code:`Path.exists` and :code:`Path.glob`, falling back to them for anything
+    which the index cannot answer exactly: paths and patterns with :code:`..`,
+    absolute patterns, or lookups of names which are not in the index (for
+    example on a case-insensitive filesystem).
+
+    If jobs is greater than 1, folders are scanned in parallel by that many
+    threads, which helps on filesystems with high latency.
+
+    An index can also be made from a list of file paths with :meth:`from_paths`,
+    for sounds which are not in a real folder. Such an index never falls back to
+    the filesystem: anything it cannot answer does not exist.
+
+    .. autoattribute:: root
+
+    .. automethod:: from_paths
+    .. automethod:: exists
+    .. automethod:: glob
+    .. automethod:: directories
+    """
+
+    root: Path
+    """The indexed folder"""
+
+    def __init__(self, root: Path, *, jobs: int = 1) -> None:
+        self.root = root
+        self._virtual = False
+        self._tree: Dict[str, _Node] | None
+        try:
+            self._tree = _scan(str(root), os.path.realpath(root), jobs)
+        except OSError:
+            self._tree = None
+
+    @classmethod
+    def from_paths(cls, root: Path, paths: Iterable[str]) -> DirectoryIndex:
+        """Make an index of the files in paths, which are relative to root"""
+        self = cls.__new__(cls)
+        self.root = root
+        self._virtual = True
+        self._tree = {}
+        for path in paths:
+            *parents, name = PurePath(path).parts
+            children = self._tree
+            for part in parents:
+                node = children.get(part)
+                if node is None:
+                    node = children[part] = _Node(True, True, False, {})
+                assert node.children is not None, f"{part} is a file and a folder"
+                children = node.children
+            children.setdefault(name, _Node(True, False, False, None))
+        return self
+
+    def _children(self, node: _Node | None) -> Dict[str, _Node]:
+        children = self._tree if node is None else node.children
+        if children is None:
+            raise _Unindexed
+        return children
+
+    def _lookup(self, parts: Tuple[str, ...]) -> _Node | None:
+        node = None
+        for part in parts:
+            node = self._children(node).get(part)
+            if node is None:
+                raise _Unindexed
+        return node
+
+    def exists(self, name: str) -> bool:
+        """Check whether :code:`root / name` exists"""
+        parts = PurePath(name).parts
+        if ".." not in parts and not PurePath(name).anchor:
+            try:
+                node = self._lookup(parts)
+            except _Unindexed:
+                pass
+            else:
+                if node is None:
+                    return self._tree is not None
+                return node.exists
+        if self._virtual:
+            return False
+        return (self.root / name).exists()
+
+    def glob(self, pattern: str) -> List[Path]:
+        """Find every path matching :code:`pattern`, relative to root"""
+        parts = PurePath(pattern).parts
+        simple = (
+            parts
+            and not PurePath(pattern).anchor
+            and not pattern.endswith(("/", os.sep))
+            and parts[-1] != "**"
+            and all(
+                part != ".." and (part == "**" or "**" not in part) for part in parts
+            )
+        )
+        if simple and self._tree is not None:
+            try:
+                return [
+                    self.root.joinpath(*match)
+                    for match in self._select(None, (), parts)
+                ]
+            except _Unindexed:
+                pass
+        if self._virtual:
+            return []
+        return list(self.root.glob(pattern))
+
+    def directories(self) -> Iterator[Path]:
+        """Iterate over every indexed folder, including root"""
+        if self._tree is None:
+            return
+        yield self.root
+        stack: List[Tuple[Tuple[str, ...], Dict[str, _Node]]] = [((), self._tree)]
+        while stack:
+            prefix, children = stack.pop()
+            for name, child in children.items():
+                if child.children is not None:
+                    yield self.root.joinpath(*prefix, name)
+                    stack.append((prefix + (name,), child.children))
+
+    def _select(
+        self, node: _Node | None, prefix: Tuple[str, ...], parts: Tuple[str, ...]
+    ) -> Iterator[Tuple[str, ...]]:
+        # This mirrors the selectors used by Path.glob
+        if not parts:
+            yield prefix
+            return
+
+        part, rest = parts[0], parts[1:]
+        dironly = bool(rest)
+
+        if part == "**":
+            yielded = set()
+            for dirnode, dirprefix in self._iterate_directories(node, prefix):
+                for match in self._select(dirnode, dirprefix, rest):
+                    if match not in yielded:
+                        yielded.add(match)
+                        yield match
+        elif _is_wildcard(part):
+            match = _compile(part)
+            for name, child in list(self._children(node).items()):
+                if dironly and not child.is_dir:
+                    continue
+                if match(name):
+                    yield from self._select(child, prefix + (name,), rest)
+        else:
+            child = self._children(node).get(part)
+            if child is None:
+                if self._virtual:
+                    return
+                # it may still exist under another case or normalisation
+                raise _Unindexed
+            if child.is_dir if dironly else child.exists:
+                yield from self._select(child, prefix + (part,), rest)
+
+    def _iterate_directories(
+        self, node: _Node | None, prefix: Tuple[str, ...]
+    ) -> Iterator[Tuple[_Node | None, Tuple[str, ...]]]:
+        yield node, prefix
+        for name, child in self._children(node).items():
+            if child.is_dir and not child.is_symlink:
+                yield from self._iterate_directories(child, prefix + (name,))
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+__all__ = [
+    "JsonFiles",
+    "locate",
+]
+
+import json
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import pydantic
+
+_K = TypeVar("_K", bound=Hashable)
+_M = TypeVar("_M", bound=pydantic.BaseModel)
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class JsonFiles(Generic[_K]):
+    """JSON files, read as bytes side by side and validated straight from them
+
+    Validating the bytes with :code:`model_validate_json` parses and validates
+    them in one pass, without building the objects :func:`json.loads` would.
+    Every file but the first is read in its own thread as soon as this is made,
+    so slow reads overlap each other and the validation of the first file.
+
+    .. automethod:: read
+    .. automethod:: validate
+    """
+
+    def __init__(
+        self,
+        read: Callable[[_K], bytes],
+        names: Sequence[_K],
+        *,
+        concurrent: bool = True,
+    ) -> None:
+        self._read = read
+        self._files: Dict[_K, Future[bytes] | bytes] = {}
+        rest = names[1:] if concurrent else []
+        if rest:
+            executor = ThreadPoolExecutor(len(rest), thread_name_prefix="wowbot-json")
+            for name in rest:
+                self._files[name] = executor.submit(read, name)
+            executor.shutdown(wait=False)
+
+    def read(self, name: _K) -> bytes:
+        """Get a file's contents, waiting for them if they are being read
+
+        Errors from reading the file are raised here."""
+        found = self._files.get(name)
+        if found is None:
+            found = self._files[name] = self._read(name)
+        elif isinstance(found, Future):
+            found = self._files[name] = found.result()
+        return found
+
+    def validate(self, model: Type[_M], name: _K) -> _M:
+        """Validate a file as model"""
+        return model.model_validate_json(self.read(name))
+
+
+def _skip(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()  # type: ignore[union-attr]
+
+
+def _find_key(text: str, pos: int, key: str) -> int | None:
+    """Find where the value of key starts, in the object starting at pos"""
+    found = None
+    pos = _skip(text, pos + 1)
+    while text.startswith('"', pos):
+        name, pos = json.decoder.scanstring(text, pos + 1)  # type: ignore
+        pos = _skip(text, _skip(text, pos) + 1)  # past the colon
+        if name == key:
+            found = pos  # but a later duplicate wins, as when parsing
+        _, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if not text.startswith(",", pos):
+            break
+        pos = _skip(text, pos + 1)
+    return found
+
+
+def _find_index(text: str, pos: int, index: int) -> int | None:
+    """Find where item index starts, in the array starting at pos"""
+    pos = _skip(text, pos + 1)
+    for _ in range(index):
+        if text.startswith("]", pos):
+            return None
+        _, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if not text.startswith(",", pos):
+            return None
+        pos = _skip(text, pos + 1)
+    return None if text.startswith("]", pos) else pos
+
+
+def locate(source: str | bytes, loc: Iterable[int | str]) -> Tuple[int, int] | None:
+    """Find the line and column of the value at a validation error's location
+
+    Parts of loc which aren't in the source, like the names of union members, are
+    skipped, so a missing key gives the object it is missing from. Lines and
+    columns start at 1. Returns None if the source isn't valid JSON.
+    """
+    text = source.decode(errors="replace") if isinstance(source, bytes) else source
+    pos = _skip(text, 0)
+    try:
+        for part in loc:
+            found = None
+            if isinstance(part, str) and text.startswith("{", pos):
+                found = _find_key(text, pos, part)
+            elif isinstance(part, int) and text.startswith("[", pos):
+                found = _find_index(text, pos, part)
+            if found is not None:
+                pos = found
+    except ValueError:  # including json.JSONDecodeError
+        return None
+    if pos >= len(text):
+        return None
+    return text.count("\n", 0, pos) + 1, pos - text.rfind("\n", 0, pos)
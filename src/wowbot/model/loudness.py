@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+__all__ = [
+    "LOUDNESS_FILE",
+    "Loudness",
+    "LoudnessCache",
+    "measure_loudness",
+]
+
+import json
+import logging
+import math
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from .probe import FileIdentity
+from .transcode import file_digest
+
+_log = logging.getLogger(__name__)
+
+LOUDNESS_FILE = "wowbot.loudness.json"
+SIDECAR_VERSION = 1
+
+DEFAULT_TARGET = -18.0
+"""The default integrated loudness sounds are normalised to, in LUFS"""
+TRUE_PEAK_LIMIT = -1.0
+"""Gain is limited so that the true peak stays below this, in dBTP"""
+
+
+class Loudness(NamedTuple):
+    """The EBU R128 integrated loudness and true peak of a file
+
+    .. autoattribute:: integrated
+    .. autoattribute:: true_peak
+
+    .. automethod:: gain
+    """
+
+    integrated: float
+    """In LUFS"""
+    true_peak: float
+    """In dBTP"""
+
+    def gain(self, target: float = DEFAULT_TARGET) -> float:
+        """Get the gain in dB which brings the file to the target loudness
+
+        The gain is limited so that the file does not clip, and is 0 for silent
+        files, whose loudness can't be measured.
+        """
+        if not math.isfinite(self.integrated):
+            return 0.0
+        gain = target - self.integrated
+        if math.isfinite(self.true_peak):
+            gain = min(gain, TRUE_PEAK_LIMIT - self.true_peak)
+        return round(gain, 1)
+
+
+def loudness_args(source: str, *, executable: str = "ffmpeg") -> List[str]:
+    """Get the arguments for ffmpeg to measure the loudness of source"""
+    return [
+        executable,
+        "-nostdin",
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        source,
+        "-vn",
+        "-af",
+        "loudnorm=print_format=json",
+        "-f",
+        "null",
+        "-",
+    ]
+
+
+def measure_loudness(path: str, executable: str = "ffmpeg") -> Loudness:
+    """Measure the loudness of a file with ffmpeg's loudnorm filter
+
+    This takes and returns only simple types, so it can run in another process.
+    Raises ValueError if ffmpeg didn't print the measurements.
+    """
+    proc = subprocess.run(
+        loudness_args(path, executable=executable),
+        check=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    # The measurements are the last JSON object ffmpeg prints
+    start = proc.stderr.rindex("{")
+    end = proc.stderr.index("}", start) + 1
+    data = json.loads(proc.stderr[start:end])
+    try:
+        return Loudness(float(data["input_i"]), float(data["input_tp"]))
+    except (KeyError, TypeError) as err:
+        raise ValueError("ffmpeg printed no loudness measurements") from err
+
+
+class LoudnessCache:
+    """A cache of loudness measurements, keyed by the hash of each file
+
+    Files are hashed to find their measurement, so renamed or duplicated files
+    are only measured once. The hash of each file is also remembered by its
+    identity, so unchanged files are not hashed again. If a sidecar path is
+    given, the cache is loaded from it and saved back to it after each fill.
+
+    .. autoattribute:: sidecar
+    .. autoattribute:: target
+
+    .. automethod:: get
+    .. automethod:: gain
+    .. automethod:: measure
+    .. automethod:: fill
+    .. automethod:: fill_in_background
+    .. automethod:: load
+    .. automethod:: save
+    """
+
+    sidecar: Path | None
+    """The file the cache is persisted to"""
+    target: float
+    """The integrated loudness gains bring files to, in LUFS"""
+
+    def __init__(
+        self,
+        sidecar: Path | None = None,
+        *,
+        target: float = DEFAULT_TARGET,
+        executable: str = "ffmpeg",
+        workers: int | None = None,
+    ) -> None:
+        self.sidecar = sidecar
+        self.target = target
+        self.executable = executable
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._digests: Dict[FileIdentity, str] = {}
+        self._measurements: Dict[str, Loudness] = {}
+        if sidecar is not None:
+            self.load(sidecar)
+
+    def load(self, sidecar: Path) -> None:
+        """Add the measurements from a sidecar file, such as another cache's"""
+        try:
+            with open(sidecar) as f:
+                data: Any = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            _log.warning("Ignoring unreadable loudness cache %s", sidecar)
+            return
+
+        if not isinstance(data, dict) or data.get("version") != SIDECAR_VERSION:
+            return
+        for entry in data.get("files", []):
+            try:
+                self._digests[FileIdentity(*entry["file"])] = entry["digest"]
+            except (KeyError, TypeError):
+                continue
+        for digest, loudness in data.get("loudness", {}).items():
+            try:
+                self._measurements[digest] = Loudness(*loudness)
+            except TypeError:
+                continue
+
+    def save(self) -> None:
+        """Write the cache to the sidecar file, if there is one"""
+        if self.sidecar is None:
+            return
+
+        with self._lock:
+            files = [
+                {"file": list(identity), "digest": digest}
+                for identity, digest in self._digests.items()
+            ]
+            loudness = {
+                digest: list(loudness)
+                for digest, loudness in self._measurements.items()
+            }
+        tmp = self.sidecar.with_name(
+            f".{self.sidecar.name}.{os.getpid()}.{threading.get_ident()}"
+        )
+        self.sidecar.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(
+                {"version": SIDECAR_VERSION, "files": files, "loudness": loudness}, f
+            )
+        os.replace(tmp, self.sidecar)
+
+    def _digest(self, path: Path) -> Tuple[FileIdentity, str]:
+        identity = FileIdentity.of(path)
+        with self._lock:
+            digest = self._digests.get(identity)
+        if digest is None:
+            digest = file_digest(path)
+        return identity, digest
+
+    def get(self, path: Path) -> Loudness | None:
+        """Get the measurement of a file, without hashing or measuring it"""
+        try:
+            identity = FileIdentity.of(path)
+        except OSError:
+            return None
+        with self._lock:
+            digest = self._digests.get(identity)
+            return None if digest is None else self._measurements.get(digest)
+
+    def gain(self, path: Path) -> float | None:
+        """Get the gain in dB for a file, if it has already been measured"""
+        loudness = self.get(path)
+        return None if loudness is None else loudness.gain(self.target)
+
+    def measure(self, path: Path) -> Loudness | None:
+        """Get the measurement of a file, measuring it here if needed"""
+        try:
+            identity, digest = self._digest(path)
+            with self._lock:
+                loudness = self._measurements.get(digest)
+            if loudness is None:
+                loudness = measure_loudness(str(path), self.executable)
+        except (OSError, ValueError, subprocess.SubprocessError):
+            _log.exception("Failed to measure the loudness of %s", path)
+            return None
+        with self._lock:
+            self._digests[identity] = digest
+            self._measurements[digest] = loudness
+        return loudness
+
+    def fill(self, paths: Iterable[Path]) -> Dict[str, int]:
+        """Measure every file in paths which is not already cached
+
+        Files are hashed in a pool of threads, and each file with a hash which
+        hasn't been measured is measured in a pool of processes. Returns the
+        number of files, how many of them were new, and how many were measured.
+        """
+        unique = list(dict.fromkeys(paths))
+        with self._lock:
+            known = {path for path in unique if self._known(path)}
+        hashed: Dict[Path, Tuple[FileIdentity, str]] = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = {
+                path: pool.submit(self._digest, path)
+                for path in unique
+                if path not in known
+            }
+        for path, future in futures.items():
+            try:
+                hashed[path] = future.result()
+            except OSError:
+                continue  # the file has disappeared since it was resolved
+
+        with self._lock:
+            self._digests.update(hashed.values())
+            missing = {
+                digest: path
+                for path, (_, digest) in hashed.items()
+                if digest not in self._measurements
+            }
+
+        measured = 0
+        if missing:
+            with ProcessPoolExecutor(self.workers) as pool:
+                results = {
+                    digest: pool.submit(measure_loudness, str(path), self.executable)
+                    for digest, path in missing.items()
+                }
+            for digest, result in results.items():
+                try:
+                    loudness = result.result()
+                except (OSError, ValueError, subprocess.SubprocessError):
+                    _log.exception(
+                        "Failed to measure the loudness of %s", missing[digest]
+                    )
+                    continue
+                with self._lock:
+                    self._measurements[digest] = loudness
+                measured += 1
+
+        if hashed:
+            self.save()
+        return {"files": len(unique), "new": len(hashed), "measured": measured}
+
+    def _known(self, path: Path) -> bool:
+        try:
+            digest = self._digests.get(FileIdentity.of(path))
+        except OSError:
+            return False
+        return digest is not None and digest in self._measurements
+
+    def fill_in_background(self, paths: Iterable[Path]) -> threading.Thread:
+        """Run :meth:`fill` in a daemon thread, returning the started thread"""
+        thread = threading.Thread(
+            target=self.fill, args=(list(paths),), name="wowbot-loudness", daemon=True
+        )
+        thread.start()
+        return thread
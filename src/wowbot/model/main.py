@@ -1,27 +1,43 @@
 from __future__ import annotations
 
 import json
+import random
+import shutil
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Any, Generator
+from typing import Any, Dict, Generator, Iterator, List
 
 import pydantic
 import typer
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
 from rich.text import Text
 
+from .archive import Archive
+from .bundle import build_bundle, iter_sources, open_archive
 from .command import CommandsJson, SoundNotFoundError
+from .index import DirectoryIndex
+from .jsonfile import JsonFiles, locate
+from .loudness import DEFAULT_TARGET, LOUDNESS_FILE, LoudnessCache
+from .media import MEDIA_FILE, MediaIndex
+from .profile import PROFILE_MODES, Profiler
+from .snapshot import SNAPSHOT_FILE, Snapshot
 from .sound import (
     BaseModelError,
     ContextModelError,
     EmptyGlobError,
     ErrorCollection,
+    GlobFile,
     SoundCollection,
     SoundFileNotFoundError,
     SoundNameReuseError,
     SoundsJson,
 )
-from .soundsdir import COMMANDS_FILE, SOUNDS_FILE
+from .soundsdir import COMMANDS_FILE, SOUNDS_FILE, get_directories
+from .storage import LISTING_FILE, write_listing
 
 app = typer.Typer(no_args_is_help=True)
 
@@ -37,7 +53,7 @@ STYLE_ERR_MSG_FILENAME = STYLE_FILENAME
 
 
 def make_validation_error(
-    err: pydantic.ValidationError, name: str
+    err: pydantic.ValidationError, name: str, source: bytes | None = None
 ) -> Generator[Text, None, None]:
     errors = err.errors()
     plural = "Errors" if len(errors) else "Error"
@@ -50,12 +66,34 @@ def make_validation_error(
         loc_str = Text(" -> ", STYLE_LOC_ARROW).join(
             Text(str(e), STYLE_LOC) for e in error["loc"]
         )
+        position = None if source is None else locate(source, error["loc"])
+        if position is not None:
+            loc_str += (
+                Text(" (line ", STYLE_ERR_MSG)
+                + Text(str(position[0]), STYLE_LOC)
+                + Text(" column ", STYLE_ERR_MSG)
+                + Text(str(position[1]), STYLE_LOC)
+                + Text(")", STYLE_ERR_MSG)
+            )
         yield Text("  ", STYLE_ERR_MSG) + loc_str
         yield Text("    " + error["msg"], STYLE_ERR_MSG)
 
 
-def make_validation_error_panel(err: pydantic.ValidationError, name: str) -> Panel:
-    return Panel(Text("\n", STYLE_ERR_MSG).join(make_validation_error(err, name)))
+def make_validation_error_panel(
+    err: pydantic.ValidationError, name: str, source: bytes | None = None
+) -> Panel:
+    """Make a panel of validation errors, with their places in source if given"""
+    if source is not None and any(e["type"] == "json_invalid" for e in err.errors()):
+        # The standard parser's errors say where the JSON broke
+        try:
+            json.loads(source)
+        except json.JSONDecodeError as json_err:
+            return make_json_error_panel(json_err, name)
+        except UnicodeDecodeError:
+            pass
+    return Panel(
+        Text("\n", STYLE_ERR_MSG).join(make_validation_error(err, name, source))
+    )
 
 
 def make_json_error_panel(err: json.JSONDecodeError, name: str) -> Panel:
@@ -144,9 +182,43 @@ def make_checksounds_error_panel(
     return Panel(err_text)
 
 
-@app.command("check")
-def check_folder(folder: Path) -> None:
-    console = Console(markup=False)
+def make_media_error_panel(errors: Dict[Path, str], folder: Path) -> Panel:
+    plural = "file" if len(errors) == 1 else "files"
+    err_text = Text(f"{len(errors)} unreadable sound {plural}:", STYLE_ERR)
+    for path, message in sorted(errors.items()):
+        err_text += (
+            Text("\n  ", STYLE_ERR_MSG)
+            + Text(path.relative_to(folder).as_posix(), STYLE_ERR_MSG_FILENAME)
+            + Text("\n    " + message, STYLE_ERR_MSG)
+        )
+    return Panel(err_text)
+
+
+JOBS_OPTION = typer.Option(
+    1,
+    "--jobs",
+    "-j",
+    min=1,
+    help="Resolve sounds in parallel with this many threads",
+)
+
+
+def validate_folder(
+    console: Console, folder: Path, jobs: int = 1, *, allow_archive: bool = False
+) -> Snapshot:
+    """Validate a sounds folder, printing the progress and any errors to console
+
+    If allow_archive is set, folder may also be a zip or tar file. If there are
+    any errors, :code:`typer.Exit` is raised.
+    """
+    if allow_archive and folder.is_file():
+        try:
+            archive = open_archive(folder)
+        except ValueError as err:
+            console.print(Panel(Text(str(err), STYLE_ERR_MSG)))
+            raise typer.Exit(1)
+        with archive:
+            return _validate(console, folder, jobs, archive)
 
     if not folder.is_dir():
         console.print(
@@ -154,66 +226,65 @@ def check_folder(folder: Path) -> None:
             + Text(" is not a folder!", STYLE_ERR_MSG),
         )
         raise typer.Exit(1)
+    return _validate(console, folder, jobs, None)
 
-    exit_code = 0
 
-    sounds_path = folder / SOUNDS_FILE
+def _validate(
+    console: Console, folder: Path, jobs: int, archive: Archive | None
+) -> Snapshot:
+    def read_bytes(name: str) -> bytes:
+        if archive is not None:
+            return archive.read_member(name)
+        return (folder / name).read_bytes()
 
-    sounds_data: Any | None = None
-    try:
-        with open(sounds_path) as f:
-            sounds_data = json.load(f)
-    except json.JSONDecodeError as err:
-        console.print(make_json_error_panel(err, SOUNDS_FILE))
-        exit_code |= 1
+    exit_code = 0
+    files = JsonFiles(
+        read_bytes, [SOUNDS_FILE, COMMANDS_FILE], concurrent=archive is None
+    )
 
     sounds: SoundsJson | None = None
-    if sounds_data is not None:
-        try:
-            sounds = SoundsJson.model_validate(sounds_data)
-        except pydantic.ValidationError as err:
-            console.print(make_validation_error_panel(err, SOUNDS_FILE))
-            exit_code |= 1
-        else:
-            console.print(
-                Text("Parsed ", STYLE_SUCCESS)
-                + Text(SOUNDS_FILE, STYLE_FILENAME)
-                + Text(".", STYLE_SUCCESS)
-            )
+    try:
+        sounds = files.validate(SoundsJson, SOUNDS_FILE)
+    except pydantic.ValidationError as err:
+        console.print(
+            make_validation_error_panel(err, SOUNDS_FILE, files.read(SOUNDS_FILE))
+        )
+        exit_code |= 1
+    else:
+        console.print(
+            Text("Parsed ", STYLE_SUCCESS)
+            + Text(SOUNDS_FILE, STYLE_FILENAME)
+            + Text(".", STYLE_SUCCESS)
+        )
 
     soundcol: SoundCollection | None = None
+    if archive is not None:
+        dir_index = archive.index()
+    else:
+        dir_index = DirectoryIndex(folder, jobs=jobs)
     if sounds is not None:
         try:
-            soundcol = sounds.resolve_files(folder)
+            soundcol = sounds.resolve_files(folder, dir_index, jobs=jobs)
         except BaseModelError as err:
             console.print(make_resolve_error_panel(err))
             exit_code |= 1
         else:
             console.print(Text("Located sound files.", STYLE_SUCCESS))
 
-    commands_path = folder / COMMANDS_FILE
-
-    commands_data: Any | None = None
+    commands: CommandsJson | None = None
     try:
-        with open(commands_path) as f:
-            commands_data = json.load(f)
-    except json.JSONDecodeError as err:
-        console.print(make_json_error_panel(err, COMMANDS_FILE))
+        commands = files.validate(CommandsJson, COMMANDS_FILE)
+    except pydantic.ValidationError as err:
+        console.print(
+            make_validation_error_panel(err, COMMANDS_FILE, files.read(COMMANDS_FILE))
+        )
         exit_code |= 1
-
-    commands: CommandsJson | None = None
-    if commands_data is not None:
-        try:
-            commands = CommandsJson.model_validate(commands_data)
-        except pydantic.ValidationError as err:
-            console.print(make_validation_error_panel(err, COMMANDS_FILE))
-            exit_code |= 1
-        else:
-            console.print(
-                Text("Parsed ", STYLE_SUCCESS)
-                + Text(COMMANDS_FILE, STYLE_FILENAME)
-                + Text(".", STYLE_SUCCESS)
-            )
+    else:
+        console.print(
+            Text("Parsed ", STYLE_SUCCESS)
+            + Text(COMMANDS_FILE, STYLE_FILENAME)
+            + Text(".", STYLE_SUCCESS)
+        )
 
     if commands is not None and soundcol is not None:
         try:
@@ -225,6 +296,356 @@ def check_folder(folder: Path) -> None:
     if exit_code:
         raise typer.Exit(exit_code)
 
+    assert sounds is not None and soundcol is not None and commands is not None
+    return Snapshot(
+        sounds_json=sounds,
+        sound_collection=soundcol,
+        commands_json=commands,
+        directories=get_directories(dir_index, soundcol),
+    )
+
+
+def _sound_files(snapshot: Snapshot) -> List[Path]:
+    return list(
+        dict.fromkeys(
+            path
+            for sound in snapshot.sound_collection.values()
+            for path in sound.files()
+        )
+    )
+
+
+@app.command("check")
+def check_folder(
+    folder: Path,
+    jobs: int = JOBS_OPTION,
+    media: bool = typer.Option(
+        False,
+        "--media",
+        "-m",
+        help="Also read every sound file in the folder, flagging corrupt ones",
+    ),
+    profile: str = typer.Option(
+        None,
+        "--profile",
+        "-p",
+        help="Profile the check with cProfile (cpu) or tracemalloc (mem)",
+    ),
+    profile_dir: Path = typer.Option(
+        Path("profiles"), "--profile-dir", help="Where to write the profile"
+    ),
+) -> None:
+    if profile is not None and profile not in PROFILE_MODES:
+        raise typer.BadParameter(
+            f"must be one of {', '.join(PROFILE_MODES)}", param_hint="--profile"
+        )
+    console = Console(markup=False)
+    profiler = None if profile is None else Profiler(profile, profile_dir)
+
+    try:
+        with nullcontext() if profiler is None else profiler.profile("check"):
+            snapshot = validate_folder(console, folder, jobs, allow_archive=not media)
+
+            if media:
+                # Reuse the index from `wowbot-sounds media`, but don't write to it
+                index = MediaIndex(workers=jobs)
+                index.load_folder(folder)
+                errors = index.fill(_sound_files(snapshot))
+                if errors:
+                    console.print(make_media_error_panel(errors, folder))
+                    raise typer.Exit(1)
+                console.print(Text("Read sound files.", STYLE_SUCCESS))
+    finally:
+        if profiler is not None:
+            for path in profiler.written:
+                console.print(
+                    Text("Wrote profile ", STYLE_SUCCESS)
+                    + Text(str(path), STYLE_FILENAME)
+                    + Text(".", STYLE_SUCCESS)
+                )
+
+
+@app.command("media")
+def media_folder(folder: Path, jobs: int = JOBS_OPTION) -> None:
+    """Index the format and duration of every sound file, for the bot to use
+
+    Only files which are new or have changed since the last run are read."""
+    console = Console(markup=False)
+    snapshot = validate_folder(console, folder, jobs)
+
+    index = MediaIndex(workers=jobs)
+    index.load_folder(folder)
+    files = _sound_files(snapshot)
+    errors = index.fill(files)
+    index.save_folder(folder)
+    if errors:
+        console.print(make_media_error_panel(errors, folder))
+
+    infos = [info for info in map(index.get, files) if info is not None]
+    formats = Counter(info.codec or info.format for info in infos)
+    total = sum(info.duration or 0.0 for info in infos)
+    longest = max((info.duration or 0.0 for info in infos), default=0.0)
+    summary = [
+        f"{len(infos)} files",
+        f"{total:.1f}s in total",
+        f"longest {longest:.1f}s",
+    ]
+    summary.extend(f"{n} {codec}" for codec, n in formats.most_common())
+    console.print(
+        Text("Wrote ", STYLE_SUCCESS)
+        + Text(MEDIA_FILE, STYLE_FILENAME)
+        + Text(f" ({', '.join(summary)}).", STYLE_SUCCESS)
+    )
+    if errors:
+        raise typer.Exit(1)
+
+
+@app.command("compile")
+def compile_folder(folder: Path, jobs: int = JOBS_OPTION) -> None:
+    console = Console(markup=False)
+    snapshot = validate_folder(console, folder, jobs)
+
+    snapshot.write(
+        folder / SNAPSHOT_FILE, folder / SOUNDS_FILE, folder, folder / COMMANDS_FILE
+    )
+    console.print(
+        Text("Compiled ", STYLE_SUCCESS)
+        + Text(SNAPSHOT_FILE, STYLE_FILENAME)
+        + Text(".", STYLE_SUCCESS)
+    )
+
+
+@app.command("build")
+def build_folder(
+    folder: Path,
+    out: Path,
+    jobs: int = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Transcode with this many processes (default: one per CPU)",
+    ),
+    bitrate: int = typer.Option(128, "--bitrate", "-b", min=6, help="In kbit/s"),
+) -> None:
+    """Build a bundle of the folder, with every sound file transcoded"""
+    console = Console(markup=False)
+    snapshot = validate_folder(console, folder, jobs or 1)
+
+    files = (
+        path for sound in snapshot.sound_collection.values() for path in sound.files()
+    )
+    try:
+        sources = iter_sources(folder, files)
+    except ValueError as err:
+        console.print(Panel(Text(str(err), STYLE_ERR_MSG)))
+        raise typer.Exit(1)
+
+    with open(folder / SOUNDS_FILE) as f:
+        sounds_text = f.read()
+    with open(folder / COMMANDS_FILE) as f:
+        commands_text = f.read()
+
+    counts = build_bundle(
+        out, sources, sounds_text, commands_text, jobs=jobs, bitrate=bitrate
+    )
+    console.print(
+        Text("Built ", STYLE_SUCCESS)
+        + Text(str(out), STYLE_FILENAME)
+        + Text(
+            f" ({counts['files']} files, {counts['objects']} objects,"
+            f" {counts['transcoded']} transcoded).",
+            STYLE_SUCCESS,
+        )
+    )
+
+
+@app.command("loudness")
+def loudness_folder(
+    folder: Path,
+    jobs: int = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Measure with this many processes (default: one per CPU)",
+    ),
+    target: float = typer.Option(DEFAULT_TARGET, "--target", "-t", help="In LUFS"),
+) -> None:
+    """Measure the loudness of every sound file, for the bot to normalise them
+
+    Only files which are new or have changed since the last run are measured."""
+    console = Console(markup=False)
+    snapshot = validate_folder(console, folder, jobs or 1)
+
+    cache = LoudnessCache(folder / LOUDNESS_FILE, target=target, workers=jobs)
+    files = _sound_files(snapshot)
+    counts = cache.fill(files)
+    gains = [gain for gain in map(cache.gain, files) if gain is not None]
+    failed = len(files) - len(gains)
+    if failed:
+        console.print(Text(f"Failed to measure {failed} files.", STYLE_ERR_MSG))
+    console.print(
+        Text("Wrote ", STYLE_SUCCESS)
+        + Text(LOUDNESS_FILE, STYLE_FILENAME)
+        + Text(
+            f" ({counts['files']} files, {counts['measured']} measured,"
+            f" gains {min(gains, default=0):+.1f} to {max(gains, default=0):+.1f}dB).",
+            STYLE_SUCCESS,
+        )
+    )
+    if failed:
+        raise typer.Exit(1)
+
+
+def percentile(times: List[float], p: float) -> float:
+    """Get the p-th percentile of times, interpolating between samples"""
+    ordered = sorted(times)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+BENCH_PERCENTILES = (50, 90, 99)
+
+
+@contextmanager
+def _timed(timings: Dict[str, List[float]], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+
+def _bench_run(
+    folder: Path, jobs: int, samples: int, sources: int
+) -> Dict[str, List[float]]:
+    timings: Dict[str, List[float]] = {}
+
+    # Load the files as SoundsDir does, but wait for the reads before validating
+    # so the two are timed apart
+    sounds_path, commands_path = folder / SOUNDS_FILE, folder / COMMANDS_FILE
+    with _timed(timings, "read"):
+        files = JsonFiles(Path.read_bytes, [sounds_path, commands_path])
+        files.read(sounds_path)
+        files.read(commands_path)
+    with _timed(timings, "validate_json"):
+        sounds = files.validate(SoundsJson, sounds_path)
+        commands = files.validate(CommandsJson, commands_path)
+    with _timed(timings, "index"):
+        dir_index = DirectoryIndex(folder, jobs=jobs)
+
+    # Time paths and globs apart, so resolve_files is taken apart here
+    resolve = glob = 0.0
+    for sound in sounds.sounds:
+        for file in sound.files:
+            start = time.perf_counter()
+            file.resolve_files(folder, dir_index)
+            if isinstance(file, GlobFile):
+                glob += time.perf_counter() - start
+            else:
+                resolve += time.perf_counter() - start
+    timings["resolve"] = [resolve]
+    timings["glob"] = [glob]
+
+    soundcol = sounds.resolve_files(folder, dir_index, jobs=jobs)
+    with _timed(timings, "check"):
+        commands.check_sounds(soundcol)
+
+    resolved = list(soundcol.values())
+    picks = random.choices(resolved, k=samples)
+    with _timed(timings, "sample"):
+        for sound in picks:
+            sound.random()
+
+    if sources:
+        # Only imported when needed, as the model doesn't otherwise need discord
+        from discord import FFmpegOpusAudio
+
+        for sound in random.choices(resolved, k=sources):
+            path = sound.random().path
+            with _timed(timings, "source"):
+                source = FFmpegOpusAudio(str(path))
+            source.cleanup()
+    return timings
+
+
+@app.command("bench")
+def bench_folder(
+    folder: Path,
+    jobs: int = JOBS_OPTION,
+    repeat: int = typer.Option(5, "--repeat", "-r", min=1, help="Runs to time"),
+    samples: int = typer.Option(
+        100_000, "--samples", "-n", min=1, help="Sounds to pick in each run"
+    ),
+    sources: int = typer.Option(
+        0,
+        "--sources",
+        "-s",
+        min=0,
+        help="Also time starting ffmpeg for this many sounds in each run",
+    ),
+    as_json: bool = typer.Option(
+        False, "--json", help="Print the results as JSON, rather than a table"
+    ),
+) -> None:
+    """Time each stage of loading a sound folder, on this machine"""
+    console = Console(markup=False, stderr=as_json)
+    if sources and shutil.which("ffmpeg") is None:
+        console.print(Text("Timing sources needs ffmpeg on the path.", STYLE_ERR_MSG))
+        raise typer.Exit(1)
+    validate_folder(console, folder, jobs)
+
+    runs: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        for stage, times in _bench_run(folder, jobs, samples, sources).items():
+            runs.setdefault(stage, []).extend(times)
+
+    results: Dict[str, Dict[str, float]] = {}
+    for stage, times in runs.items():
+        results[stage] = {f"p{p}": percentile(times, p) for p in BENCH_PERCENTILES}
+        results[stage].update(min=min(times), max=max(times), count=len(times))
+    sample_rate = samples / percentile(runs["sample"], 50)
+
+    if as_json:
+        output = {"repeat": repeat, "samples": samples, "stages": results}
+        output["samples_per_second"] = sample_rate
+        print(json.dumps(output, indent=1))
+        return
+
+    table = Table(title=f"{folder} ({repeat} runs)")
+    table.add_column("Stage")
+    for p in BENCH_PERCENTILES:
+        table.add_column(f"p{p} (ms)", justify="right")
+    table.add_column("min (ms)", justify="right")
+    table.add_column("max (ms)", justify="right")
+    for stage, result in results.items():
+        keys = [f"p{p}" for p in BENCH_PERCENTILES] + ["min", "max"]
+        table.add_row(stage, *(f"{result[key] * 1000:.2f}" for key in keys))
+    console.print(table)
+    console.print(Text(f"Picked {sample_rate:,.0f} sounds per second.", STYLE_SUCCESS))
+
+
+@app.command("publish")
+def publish_folder(folder: Path, jobs: int = JOBS_OPTION) -> None:
+    """Write the listing the bot needs to load the folder from a web server"""
+    console = Console(markup=False)
+    snapshot = validate_folder(console, folder, jobs)
+
+    write_listing(
+        folder,
+        (
+            path
+            for sound in snapshot.sound_collection.values()
+            for path in sound.files()
+        ),
+    )
+    console.print(
+        Text("Wrote ", STYLE_SUCCESS)
+        + Text(LISTING_FILE, STYLE_FILENAME)
+        + Text(".", STYLE_SUCCESS)
+    )
+
 
 @app.command("pass")
 def pass_():
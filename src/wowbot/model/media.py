@@ -0,0 +1,645 @@
+from __future__ import annotations
+
+__all__ = [
+    "MEDIA_FILE",
+    "MediaError",
+    "MediaInfo",
+    "MediaIndex",
+    "UnsupportedFormat",
+    "parse_media",
+    "read_media_info",
+]
+
+import json
+import logging
+import os
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from .probe import FileIdentity, ffprobe_executable
+from .transcode import file_digest
+
+_log = logging.getLogger(__name__)
+
+MEDIA_FILE = "wowbot.media.json"
+SIDECAR_VERSION = 1
+# The folder's sidecar is keyed by relative path and contents, not identity
+FOLDER_SIDECAR_VERSION = 2
+
+
+class MediaError(ValueError):
+    """A sound file is unreadable or corrupt"""
+
+
+class UnsupportedFormat(Exception):
+    """A sound file's format can't be read from its headers, so needs ffprobe"""
+
+
+class MediaInfo(NamedTuple):
+    """The format and duration of a sound file
+
+    Codec names match those given by ffprobe.
+    """
+
+    format: str
+    """The container, such as :code:`wav`, :code:`ogg` or :code:`mp3`"""
+    codec: str | None
+    """The audio codec, such as :code:`pcm_s16le`, :code:`opus` or :code:`mp3`"""
+    duration: float | None
+    """The length of the audio, in seconds"""
+    sample_rate: int | None
+    channels: int | None
+
+
+# WAV
+
+
+_WAV_CODECS = {6: "pcm_alaw", 7: "pcm_mulaw"}
+
+
+def _wav_codec(tag: int, bits: int) -> str | None:
+    if tag == 1:
+        return "pcm_u8" if bits == 8 else f"pcm_s{bits}le"
+    if tag == 3:
+        return f"pcm_f{bits}le"
+    return _WAV_CODECS.get(tag)
+
+
+def _parse_wav(f: IO[bytes], size: int) -> MediaInfo:
+    _, _, wave = struct.unpack("<4sI4s", f.read(12))
+    if wave != b"WAVE":
+        raise MediaError("RIFF file is not WAVE")
+
+    fmt: Tuple[int, int, int, int, int] | None = None
+    pos = 12
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise MediaError("no data chunk" if fmt else "no fmt chunk")
+        chunk, chunk_size = struct.unpack("<4sI", header)
+        pos += 8
+        if chunk == b"fmt ":
+            body = f.read(chunk_size)
+            if len(body) < 16:
+                raise MediaError("fmt chunk is truncated")
+            tag, channels, rate, byte_rate, _, bits = struct.unpack_from(
+                "<HHIIHH", body
+            )
+            if tag == 0xFFFE and len(body) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE, which gives the format in its GUID
+                (tag,) = struct.unpack_from("<H", body, 24)
+            fmt = tag, channels, rate, byte_rate, bits
+        elif chunk == b"data":
+            if fmt is None:
+                raise MediaError("data chunk before fmt chunk")
+            remaining = size - pos
+            if chunk_size == 0xFFFFFFFF:
+                chunk_size = remaining  # streamed, so the size was never filled in
+            elif chunk_size > remaining:
+                raise MediaError("data chunk is truncated")
+            break
+        pos += chunk_size + (chunk_size & 1)  # chunks are word-aligned
+        f.seek(pos)
+
+    tag, channels, rate, byte_rate, bits = fmt
+    if not byte_rate or not channels or not rate:
+        raise MediaError("fmt chunk is invalid")
+    return MediaInfo(
+        "wav", _wav_codec(tag, bits), chunk_size / byte_rate, rate, channels
+    )
+
+
+# Ogg
+
+_OGG_PAGE = struct.Struct("<4sBBqIIIB")  # capture, ..., granule, serial, ..., segments
+_OPUS_HEAD = struct.Struct("<8sBBHI")  # magic, version, channels, pre-skip, rate
+_VORBIS_ID = struct.Struct("<7sIBI")  # magic, version, channels, rate
+_OGG_TAIL = 1 << 17  # more than the largest possible page
+
+
+def _parse_ogg(f: IO[bytes], size: int) -> MediaInfo:
+    header = f.read(_OGG_PAGE.size)
+    if len(header) < _OGG_PAGE.size:
+        raise MediaError("first Ogg page is truncated")
+    _, _, _, _, serial, _, _, segments = _OGG_PAGE.unpack(header)
+    lacing = f.read(segments)
+    length = 0
+    for value in lacing:
+        length += value
+        if value < 255:
+            break
+    packet = f.read(length)
+    if len(lacing) < segments or len(packet) < length:
+        raise MediaError("first Ogg page is truncated")
+
+    if packet.startswith(b"OpusHead") and len(packet) >= _OPUS_HEAD.size:
+        _, _, channels, pre_skip, _ = _OPUS_HEAD.unpack_from(packet)
+        # Opus always decodes at 48kHz; the header's rate is only the input's
+        codec, rate = "opus", 48000
+    elif packet.startswith(b"\x01vorbis") and len(packet) >= _VORBIS_ID.size:
+        _, _, channels, rate = _VORBIS_ID.unpack_from(packet)
+        codec, pre_skip = "vorbis", 0
+    else:
+        raise UnsupportedFormat("Ogg stream is not Opus or Vorbis")
+    if not channels or not rate:
+        raise MediaError(f"{codec} header is invalid")
+
+    # The granule position of the stream's last page is its length in samples
+    start = max(0, size - _OGG_TAIL)
+    f.seek(start)
+    tail = f.read()
+    end = len(tail)
+    while (pos := tail.rfind(b"OggS", 0, end)) >= 0:
+        end = pos
+        if pos + _OGG_PAGE.size > len(tail):
+            continue
+        _, version, _, granule, page_serial, _, _, _ = _OGG_PAGE.unpack_from(tail, pos)
+        if version == 0 and page_serial == serial and granule != -1:
+            duration = max(0, granule - pre_skip) / rate
+            return MediaInfo("ogg", codec, duration, rate, channels)
+    raise MediaError("no last Ogg page")
+
+
+# MP3
+
+_MP3_BITRATES = {
+    # kbit/s, by whether the version is MPEG-1, for layer III
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),  # MPEG-2.5
+}
+_MP3_SEARCH = 1 << 16  # how far past any tag to look for the first frame
+
+
+class _MP3Frame(NamedTuple):
+    mpeg1: bool
+    bitrate: int
+    sample_rate: int
+    channels: int
+    length: int
+
+    @property
+    def samples(self) -> int:
+        return 1152 if self.mpeg1 else 576
+
+    @classmethod
+    def parse(cls, data: bytes, pos: int) -> _MP3Frame | None:
+        if pos + 4 > len(data):
+            return None
+        (h,) = struct.unpack_from(">I", data, pos)
+        version = (h >> 19) & 3
+        layer = (h >> 17) & 3
+        bitrate_index = (h >> 12) & 15
+        rate_index = (h >> 10) & 3
+        if h >> 21 != 0x7FF or version == 1 or layer != 1:
+            return None
+        if bitrate_index in (0, 15) or rate_index == 3:
+            return None  # free format is too rare to be worth reading
+
+        mpeg1 = version == 3
+        bitrate = _MP3_BITRATES[mpeg1][bitrate_index]
+        rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (h >> 9) & 1
+        length = (144000 if mpeg1 else 72000) * bitrate // rate + padding
+        channels = 1 if (h >> 6) & 3 == 3 else 2
+        return cls(mpeg1, bitrate, rate, channels, length)
+
+
+def _id3_size(header: bytes) -> int:
+    if not header.startswith(b"ID3") or len(header) < 10:
+        return 0
+    size = 0
+    for byte in header[6:10]:  # syncsafe, 7 bits per byte
+        size = size << 7 | byte & 0x7F
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _parse_mp3(f: IO[bytes], size: int) -> MediaInfo:
+    start = _id3_size(f.read(10))
+    f.seek(start)
+    data = f.read(_MP3_SEARCH)
+    if data[:1] == b"\xff" and data[1:2] and data[1] & 0xE6 in (0xE4, 0xE6):
+        raise UnsupportedFormat("MPEG audio is not layer III")
+
+    # A frame only counts if another follows it, so stray sync bits are skipped
+    pos = data.find(b"\xff")
+    while pos >= 0:
+        frame = _MP3Frame.parse(data, pos)
+        if frame is not None:
+            following = pos + frame.length
+            if start + following >= size or _MP3Frame.parse(data, following):
+                break
+        pos = data.find(b"\xff", pos + 1)
+    else:
+        raise MediaError("no MPEG audio frames")
+    assert frame is not None
+
+    # A Xing, Info or VBRI header in the first frame gives the number of frames
+    stereo = frame.channels == 2
+    side_info = (32 if stereo else 17) if frame.mpeg1 else (17 if stereo else 9)
+    xing = pos + 4 + side_info
+    frames: int | None = None
+    if data[xing : xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12:
+        flags, count = struct.unpack_from(">II", data, xing + 4)
+        if flags & 1:
+            frames = count
+    elif data[pos + 36 : pos + 40] == b"VBRI" and len(data) >= pos + 54:
+        (frames,) = struct.unpack_from(">I", data, pos + 50)
+
+    if frames is not None:
+        duration = frames * frame.samples / frame.sample_rate
+    else:
+        # Without one, assume a constant bitrate
+        audio = size - start - pos
+        f.seek(max(0, size - 128))
+        if f.read(3) == b"TAG":
+            audio -= 128  # ID3v1 tag
+        duration = audio * 8 / (frame.bitrate * 1000)
+    return MediaInfo("mp3", "mp3", duration, frame.sample_rate, frame.channels)
+
+
+def parse_media(f: IO[bytes], size: int) -> MediaInfo:
+    """Read the format and duration of a WAV, Ogg or MP3 file from its headers
+
+    f must be seekable, and size is its length. This raises :exc:`MediaError`
+    if the file is unreadable or corrupt, or :exc:`UnsupportedFormat` if it is
+    in another format.
+    """
+    magic = f.read(12)
+    f.seek(0)
+    if not magic:
+        raise MediaError("file is empty")
+    try:
+        if magic.startswith(b"RIFF"):
+            return _parse_wav(f, size)
+        if magic.startswith(b"OggS"):
+            return _parse_ogg(f, size)
+        if magic.startswith(b"ID3") or (
+            len(magic) >= 2 and magic[0] == 0xFF and magic[1] & 0xE0 == 0xE0
+        ):
+            return _parse_mp3(f, size)
+    except struct.error as err:
+        raise MediaError("file is truncated") from err
+    raise UnsupportedFormat("unknown format")
+
+
+def ffprobe_media(path: Path, executable: str = "ffmpeg") -> MediaInfo:
+    """Read the format and duration of a file with ffprobe"""
+    args = [
+        ffprobe_executable(executable),
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        "-select_streams",
+        "a:0",
+        str(path),
+    ]
+    try:
+        proc = subprocess.run(
+            args, capture_output=True, timeout=20, stdin=subprocess.DEVNULL
+        )
+    except subprocess.TimeoutExpired as err:
+        raise MediaError("ffprobe timed out") from err
+    if proc.returncode != 0:
+        message = proc.stderr.decode(errors="replace").strip()
+        raise MediaError(message.splitlines()[-1] if message else "ffprobe failed")
+
+    try:
+        data = json.loads(proc.stdout)
+        streams = data.get("streams") or []
+        fmt = data.get("format") or {}
+    except (AttributeError, ValueError) as err:
+        raise MediaError("ffprobe printed invalid JSON") from err
+    if not streams:
+        raise MediaError("no audio stream")
+    stream = streams[0]
+    duration = fmt.get("duration") or stream.get("duration")
+    rate = stream.get("sample_rate")
+    try:
+        return MediaInfo(
+            fmt.get("format_name", "unknown"),
+            stream.get("codec_name"),
+            None if duration is None else float(duration),
+            None if rate is None else int(rate),
+            stream.get("channels"),
+        )
+    except (TypeError, ValueError) as err:
+        raise MediaError("ffprobe printed an invalid duration or rate") from err
+
+
+def read_media_info(path: Path, executable: str = "ffmpeg") -> MediaInfo:
+    """Read the format and duration of a file
+
+    WAV, Ogg and MP3 files are read from their headers; anything else is
+    probed with ffprobe. This raises :exc:`MediaError` if the file is
+    unreadable or corrupt, or :exc:`UnsupportedFormat` if it needs ffprobe
+    and ffprobe isn't installed.
+    """
+    try:
+        with open(path, "rb") as f:
+            return parse_media(f, os.fstat(f.fileno()).st_size)
+    except UnsupportedFormat as err:
+        reason = err
+    try:
+        return ffprobe_media(path, executable)
+    except FileNotFoundError as err:
+        raise UnsupportedFormat(f"{reason}, and there is no ffprobe") from err
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class MediaIndex:
+    """An index of the format and duration of sound files, keyed by file identity
+
+    Files are read with :func:`read_media_info`, so most are only read from
+    their headers. Files which can't be read are also remembered, with the
+    error, until they change. If a sidecar path is given, the index is loaded
+    from it and saved back to it after each fill; as it is keyed by identity,
+    it only matches on the machine which wrote it.
+
+    A sounds folder's own index, :code:`wowbot.media.json`, is instead read
+    and written with :meth:`load_folder` and :meth:`save_folder`. It is keyed by
+    each file's path in the folder, size and digest, so it still matches after
+    the folder is moved or copied.
+
+    .. autoattribute:: sidecar
+
+    .. automethod:: get
+    .. automethod:: error
+    .. automethod:: read
+    .. automethod:: fill
+    .. automethod:: fill_in_background
+    .. automethod:: load
+    .. automethod:: save
+    .. automethod:: load_folder
+    .. automethod:: save_folder
+    """
+
+    sidecar: Path | None
+    """The file the index is persisted to"""
+
+    def __init__(
+        self,
+        sidecar: Path | None = None,
+        *,
+        executable: str = "ffmpeg",
+        workers: int | None = None,
+    ) -> None:
+        self.sidecar = sidecar
+        self.executable = executable
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._entries: Dict[FileIdentity, MediaInfo | str] = {}
+        self._digests: Dict[FileIdentity, str] = {}
+        if sidecar is not None:
+            self.load(sidecar)
+
+    def load(self, sidecar: Path) -> None:
+        """Add the entries from a sidecar file, such as another index's"""
+        try:
+            with open(sidecar) as f:
+                data: Any = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            _log.warning("Ignoring unreadable media index %s", sidecar)
+            return
+
+        if not isinstance(data, dict) or data.get("version") != SIDECAR_VERSION:
+            return
+        for entry in data.get("entries", []):
+            try:
+                identity = FileIdentity(*entry["file"])
+                if "error" in entry:
+                    self._entries[identity] = str(entry["error"])
+                else:
+                    self._entries[identity] = MediaInfo(*entry["media"])
+            except (KeyError, TypeError):
+                continue
+
+    def save(self) -> None:
+        """Write the index to the sidecar file, if there is one"""
+        if self.sidecar is None:
+            return
+
+        with self._lock:
+            entries = [
+                (
+                    {"file": list(identity), "error": entry}
+                    if isinstance(entry, str)
+                    else {"file": list(identity), "media": list(entry)}
+                )
+                for identity, entry in self._entries.items()
+            ]
+        _write_json(self.sidecar, {"version": SIDECAR_VERSION, "entries": entries})
+
+    def _digest(self, path: Path, identity: FileIdentity) -> str:
+        with self._lock:
+            digest = self._digests.get(identity)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._digests[identity] = digest
+        return digest
+
+    def _match(self, path: Path, size: int, digest: str) -> FileIdentity | None:
+        try:
+            identity = FileIdentity.of(path)
+            if identity.size != size:
+                return None
+            with self._lock:
+                if identity in self._entries:
+                    return None  # already indexed, so there's no need to hash it
+            if self._digest(path, identity) != digest:
+                return None
+        except OSError:
+            return None
+        return identity
+
+    def load_folder(self, folder: Path) -> None:
+        """Add the entries from a folder's sidecar which still match its files
+
+        Files which aren't already indexed, and have the same size as in the
+        sidecar, are hashed in a pool of threads to check they are unchanged.
+        """
+        sidecar = folder / MEDIA_FILE
+        try:
+            with open(sidecar) as f:
+                data: Any = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            _log.warning("Ignoring unreadable media index %s", sidecar)
+            return
+
+        if not isinstance(data, dict) or data.get("version") != FOLDER_SIDECAR_VERSION:
+            return
+        files: List[Tuple[Path, int, str, MediaInfo | str]] = []
+        for entry in data.get("files", []):
+            try:
+                name = PurePosixPath(entry["path"])
+                if name.is_absolute() or ".." in name.parts:
+                    continue
+                if "error" in entry:
+                    value: MediaInfo | str = str(entry["error"])
+                else:
+                    value = MediaInfo(*entry["media"])
+                files.append(
+                    (
+                        folder.joinpath(*name.parts),
+                        entry["size"],
+                        entry["digest"],
+                        value,
+                    )
+                )
+            except (KeyError, TypeError):
+                continue
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [
+                (pool.submit(self._match, path, size, digest), value)
+                for path, size, digest, value in files
+            ]
+        with self._lock:
+            for future, value in futures:
+                identity = future.result()
+                if identity is not None:
+                    self._entries.setdefault(identity, value)
+
+    def _folder_entry(
+        self, folder: Path, identity: FileIdentity, value: MediaInfo | str
+    ) -> Dict[str, Any] | None:
+        path = Path(identity.path)
+        try:
+            name = path.relative_to(folder)
+            if FileIdentity.of(path) != identity:
+                return None  # the file has changed since it was read
+            digest = self._digest(path, identity)
+        except (OSError, ValueError):
+            return None
+        entry: Dict[str, Any] = {
+            "path": name.as_posix(),
+            "size": identity.size,
+            "digest": digest,
+        }
+        if isinstance(value, str):
+            entry["error"] = value
+        else:
+            entry["media"] = list(value)
+        return entry
+
+    def save_folder(self, folder: Path) -> None:
+        """Write the entries of the files in folder to the folder's sidecar
+
+        Only files which are unchanged since they were read are written.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [
+                pool.submit(self._folder_entry, folder, identity, value)
+                for identity, value in entries
+            ]
+        files = [entry for entry in (f.result() for f in futures) if entry is not None]
+        files.sort(key=lambda entry: entry["path"])
+        _write_json(
+            folder / MEDIA_FILE, {"version": FOLDER_SIDECAR_VERSION, "files": files}
+        )
+
+    def _peek(self, path: Path) -> MediaInfo | str | None:
+        try:
+            identity = FileIdentity.of(path)
+        except OSError:
+            return None
+        with self._lock:
+            return self._entries.get(identity)
+
+    def get(self, path: Path) -> MediaInfo | None:
+        """Get the indexed format and duration of a file, without reading it"""
+        entry = self._peek(path)
+        return entry if isinstance(entry, MediaInfo) else None
+
+    def error(self, path: Path) -> str | None:
+        """Get why a file couldn't be read, if it has been read and couldn't"""
+        entry = self._peek(path)
+        return entry if isinstance(entry, str) else None
+
+    def _read(self, path: Path) -> Tuple[FileIdentity, MediaInfo | str]:
+        identity = FileIdentity.of(path)
+        try:
+            return identity, read_media_info(path, self.executable)
+        except MediaError as err:
+            return identity, str(err)
+
+    def read(self, path: Path) -> MediaInfo:
+        """Get the format and duration of a file, reading it if it isn't indexed
+
+        This raises :exc:`MediaError` if the file is unreadable or corrupt."""
+        entry = self._peek(path)
+        if entry is None:
+            identity, entry = self._read(path)
+            with self._lock:
+                self._entries[identity] = entry
+        if isinstance(entry, str):
+            raise MediaError(entry)
+        return entry
+
+    def fill(self, paths: Iterable[Path]) -> Dict[Path, str]:
+        """Read every file in paths which is not already indexed
+
+        Files are read in a pool of threads. Returns the files which are
+        unreadable or corrupt, with why, including those already indexed.
+        """
+        unique = list(dict.fromkeys(paths))
+        entries = {path: self._peek(path) for path in unique}
+        missing = [path for path, entry in entries.items() if entry is None]
+        if missing:
+            with ThreadPoolExecutor(self.workers) as pool:
+                futures = {path: pool.submit(self._read, path) for path in missing}
+            unsupported = 0
+            for path, future in futures.items():
+                try:
+                    identity, entry = future.result()
+                except UnsupportedFormat:
+                    unsupported += 1
+                    continue
+                except OSError as err:
+                    # missing files are errors, but aren't worth remembering
+                    entries[path] = err.strerror or str(err)
+                    continue
+                entries[path] = entry
+                with self._lock:
+                    self._entries[identity] = entry
+            if unsupported:
+                _log.warning("Skipped %d files which need ffprobe", unsupported)
+            self.save()
+        return {
+            path: entry for path, entry in entries.items() if isinstance(entry, str)
+        }
+
+    def fill_in_background(self, paths: Iterable[Path]) -> threading.Thread:
+        """Run :meth:`fill` in a daemon thread, returning the started thread"""
+        thread = threading.Thread(
+            target=self.fill, args=(list(paths),), name="wowbot-media", daemon=True
+        )
+        thread.start()
+        return thread
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Generic, NewType, TypeVar
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generic, NewType, TypeVar, Union
 
 import pydantic
+from typing_extensions import Annotated
 
 T = TypeVar("T")
 
@@ -20,3 +21,25 @@ if TYPE_CHECKING:
 else:
     Int64 = pydantic.conint(ge=0, lt=1 << 64)
 Snowflake = NewType("Snowflake", Int64)
+
+
+def tagged_union(tag: Callable[[Dict[str, Any]], str], *members: type) -> Any:
+    """Make a union which is validated as only one of its members
+
+    A plain union is validated as each member in turn, at every level of nesting.
+    Instead, tag is given each object and returns the name of the member to
+    validate it as. Anything else is validated as the first member, unless it is
+    already an instance of one.
+    """
+    names = {member.__name__ for member in members}
+
+    def discriminator(value: Any) -> str:
+        if isinstance(value, dict):
+            return tag(value)
+        name = type(value).__name__
+        return name if name in names else members[0].__name__
+
+    tagged = tuple(
+        Annotated[member, pydantic.Tag(member.__name__)] for member in members
+    )
+    return Annotated[Union[tagged], pydantic.Discriminator(discriminator)]
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+__all__ = [
+    "FileIdentity",
+    "ProbeResult",
+    "ProbeCache",
+]
+
+import json
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, NamedTuple, Tuple
+
+_log = logging.getLogger(__name__)
+
+SIDECAR_VERSION = 1
+
+
+class FileIdentity(NamedTuple):
+    """Identifies a version of a file, without reading its contents"""
+
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def of(cls, path: Path) -> FileIdentity:
+        st = path.stat()
+        return cls(str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class ProbeResult(NamedTuple):
+    """The codec and bitrate of a file, as used by FFmpegOpusAudio"""
+
+    codec: str | None
+    bitrate: int | None
+
+
+def ffprobe_executable(executable: str = "ffmpeg") -> str:
+    """Get the probe executable which comes with an ffmpeg executable"""
+    if executable in ("ffmpeg", "avconv"):
+        return executable[:2] + "probe"
+    return executable
+
+
+def ffprobe(path: Path, executable: str = "ffmpeg") -> ProbeResult:
+    """Probe a file for its codec and bitrate
+
+    This matches the native probe method of :code:`FFmpegOpusAudio.from_probe`.
+    """
+    args = [
+        ffprobe_executable(executable),
+        "-v",
+        "quiet",
+        "-print_format",
+        "json",
+        "-show_streams",
+        "-select_streams",
+        "a:0",
+        str(path),
+    ]
+    output = subprocess.check_output(args, timeout=20, stdin=subprocess.DEVNULL)
+    if not output:
+        return ProbeResult(None, None)
+
+    streams = json.loads(output).get("streams") or [{}]
+    codec = streams[0].get("codec_name")
+    bitrate = int(streams[0].get("bit_rate", 0))
+    return ProbeResult(codec, max(round(bitrate / 1000), 512))
+
+
+class ProbeCache:
+    """A cache of probe results, keyed by file identity
+
+    Entries are keyed by path, size, modification time and inode, so a changed
+    file is probed again. Failed probes are not cached, so the file is probed
+    again next time. If a sidecar path is given, the cache is loaded from it.
+    Results from :meth:`probe` are saved back to it at most once every
+    ``save_delay`` seconds, and :meth:`fill` saves once when it is done.
+
+    .. autoattribute:: sidecar
+    .. autoattribute:: hits
+    .. autoattribute:: misses
+
+    .. automethod:: get
+    .. automethod:: probe
+    .. automethod:: fill
+    .. automethod:: fill_in_background
+    .. automethod:: save
+    """
+
+    sidecar: Path | None
+    """The file the cache is persisted to"""
+    hits: int
+    """The number of lookups which found a cached result"""
+    misses: int
+    """The number of lookups which had to probe the file"""
+
+    def __init__(
+        self,
+        sidecar: Path | None = None,
+        *,
+        executable: str = "ffmpeg",
+        workers: int | None = None,
+        save_delay: float = 5.0,
+    ) -> None:
+        self.sidecar = sidecar
+        self.executable = executable
+        self.workers = workers
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._results: Dict[FileIdentity, ProbeResult] = {}
+        self._save_timer: threading.Timer | None = None
+        if sidecar is not None:
+            self._load(sidecar)
+
+    def _load(self, sidecar: Path) -> None:
+        try:
+            with open(sidecar) as f:
+                data: Any = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            _log.warning("Ignoring unreadable probe cache %s", sidecar)
+            return
+
+        if not isinstance(data, dict) or data.get("version") != SIDECAR_VERSION:
+            return
+        for entry in data.get("entries", []):
+            try:
+                identity = FileIdentity(*entry["file"])
+                self._results[identity] = ProbeResult(*entry["probe"])
+            except (KeyError, TypeError):
+                continue
+
+    def save(self) -> None:
+        """Write the cache to the sidecar file, if there is one"""
+        if self.sidecar is None:
+            return
+
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            entries = [
+                {"file": list(identity), "probe": list(result)}
+                for identity, result in self._results.items()
+            ]
+        tmp = self.sidecar.with_name(
+            f".{self.sidecar.name}.{os.getpid()}.{threading.get_ident()}"
+        )
+        self.sidecar.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump({"version": SIDECAR_VERSION, "entries": entries}, f)
+        os.replace(tmp, self.sidecar)
+
+    def _schedule_save(self) -> None:
+        if self.sidecar is None:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return  # a save is already pending, and will include this result
+            self._save_timer = threading.Timer(self.save_delay, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _peek(self, path: Path) -> ProbeResult | None:
+        try:
+            identity = FileIdentity.of(path)
+        except OSError:
+            return None
+        with self._lock:
+            return self._results.get(identity)
+
+    def get(self, path: Path) -> ProbeResult | None:
+        """Get the cached probe result of a file, without probing it"""
+        result = self._peek(path)
+        if result is not None:
+            with self._lock:
+                self.hits += 1
+        return result
+
+    def _probe(self, path: Path) -> Tuple[FileIdentity, ProbeResult | None]:
+        identity = FileIdentity.of(path)
+        try:
+            return identity, ffprobe(path, self.executable)
+        except (OSError, ValueError, subprocess.SubprocessError):
+            _log.exception("Failed to probe %s", path)
+            return identity, None
+
+    def probe(self, path: Path) -> ProbeResult:
+        """Get the probe result of a file, probing it if it is not cached"""
+        result = self.get(path)
+        if result is not None:
+            return result
+
+        identity, result = self._probe(path)
+        with self._lock:
+            self.misses += 1
+        if result is None:
+            # FFmpegOpusAudio falls back to these when probing fails
+            return ProbeResult(None, None)
+
+        with self._lock:
+            self._results[identity] = result
+        self._schedule_save()
+        return result
+
+    def fill(self, paths: Iterable[Path]) -> None:
+        """Probe every file in paths which is not already cached"""
+        missing = [path for path in dict.fromkeys(paths) if self._peek(path) is None]
+        if not missing:
+            return
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [pool.submit(self._probe, path) for path in missing]
+        found = False
+        for future in futures:
+            try:
+                identity, result = future.result()
+            except OSError:
+                continue  # the file has disappeared since it was resolved
+            if result is None:
+                continue
+            with self._lock:
+                self._results[identity] = result
+            found = True
+        if found:
+            self.save()
+
+    def fill_in_background(self, paths: Iterable[Path]) -> threading.Thread:
+        """Run :meth:`fill` in a daemon thread, returning the started thread"""
+        thread = threading.Thread(
+            target=self.fill, args=(list(paths),), name="wowbot-probe", daemon=True
+        )
+        thread.start()
+        return thread
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+__all__ = [
+    "PROFILE_MODES",
+    "Profiler",
+    "get_profiler",
+    "profiled",
+    "set_profiler",
+]
+
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, Tuple, TypeVar
+
+_log = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cpu", "mem")
+TRACEMALLOC_FRAMES = 32
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+_FuncKey = Tuple[str, int, str]
+
+
+def _frame_name(key: _FuncKey) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name  # a builtin, like <built-in method time.sleep>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapse_pstats(stats: pstats.Stats) -> Dict[str, float]:
+    """Turn profile statistics into collapsed stacks of microseconds
+
+    cProfile only records which function called which, not whole stacks, so
+    each function's own time is put under its most expensive chain of callers.
+    """
+    raw: Dict[_FuncKey, Tuple[Any, ...]] = stats.stats  # type: ignore
+    stacks: Dict[str, float] = {}
+    for func, (_, _, tottime, _, callers) in raw.items():
+        if tottime <= 0:
+            continue
+        chain = [func]
+        seen = {func}
+        while callers:
+            caller = max(callers, key=lambda c: raw[c][3] if c in raw else 0.0)
+            if caller in seen:
+                break
+            chain.append(caller)
+            seen.add(caller)
+            callers = raw[caller][4] if caller in raw else {}
+        stack = ";".join(_frame_name(key) for key in reversed(chain))
+        stacks[stack] = stacks.get(stack, 0.0) + tottime * 1e6
+    return stacks
+
+
+def collapse_snapshots(
+    before: tracemalloc.Snapshot, after: tracemalloc.Snapshot
+) -> Dict[str, float]:
+    """Turn the memory allocated between two snapshots into collapsed stacks"""
+    stacks: Dict[str, float] = {}
+    for stat in after.compare_to(before, "traceback"):
+        if stat.size_diff <= 0:
+            continue
+        # Frames are oldest first, as collapsed stacks want them
+        stack = ";".join(
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            for frame in stat.traceback
+        )
+        stacks[stack] = stacks.get(stack, 0.0) + stat.size_diff
+    return stacks
+
+
+def _write_collapsed(path: Path, stacks: Dict[str, float]) -> None:
+    with open(path, "w") as f:
+        for stack, weight in sorted(stacks.items(), key=lambda item: -item[1]):
+            if round(weight) > 0:
+                f.write(f"{stack} {round(weight)}\n")
+
+
+class Profiler:
+    """Profiles calls of functions marked with :func:`profiled`
+
+    In :code:`cpu` mode, each call is run under cProfile, and written to the
+    folder as a pstats file and a collapsed-stack file of microseconds, for
+    flame graph tools. In :code:`mem` mode, tracemalloc records the memory the
+    call allocated and didn't free, written as collapsed stacks of bytes and a
+    text summary of the top lines.
+
+    Only one call is profiled at once: calls made while another is being
+    profiled (including calls nested inside it) run as normal. Only the newest
+    :code:`keep` results of each label are kept, so it is safe to leave enabled
+    for a while.
+
+    .. autoattribute:: mode
+    .. autoattribute:: folder
+    .. autoattribute:: keep
+    .. autoattribute:: written
+
+    .. automethod:: profile
+    """
+
+    mode: str
+    """Either cpu or mem"""
+    folder: Path
+    """Where results are written"""
+    keep: int
+    """The number of results kept for each label"""
+    written: Deque[Path]
+    """The most recently written files, including ones since rotated away"""
+
+    def __init__(self, mode: str, folder: Path, *, keep: int = 20) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"profile mode must be one of {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.folder = folder
+        self.keep = keep
+        self.written = deque(maxlen=100)
+        self._busy = threading.Lock()
+        self._count = 0
+
+    def _write(self, label: str, outputs: Dict[str, Callable[[Path], None]]) -> None:
+        # Each label has its own folder, so rotating it is a sort by name
+        folder = self.folder / re.sub(r"[^A-Za-z0-9_.-]+", "-", label).strip("-")
+        folder.mkdir(parents=True, exist_ok=True)
+        self._count += 1
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._count:06d}"
+        for suffix, write in outputs.items():
+            path = folder / f"{stem}{suffix}"
+            write(path)
+            self.written.append(path)
+
+            results = sorted(folder.glob(f"*{suffix}"))
+            for old in results[: max(0, len(results) - self.keep)]:
+                old.unlink(missing_ok=True)
+
+    def _write_cpu(self, label: str, profile: cProfile.Profile) -> None:
+        stats = pstats.Stats(profile)
+        self._write(
+            label,
+            {
+                ".pstats": stats.dump_stats,
+                ".collapsed": lambda path: _write_collapsed(
+                    path, collapse_pstats(stats)
+                ),
+            },
+        )
+
+    def _write_mem(
+        self, label: str, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot
+    ) -> None:
+        def write_top(path: Path) -> None:
+            text = io.StringIO()
+            for stat in after.compare_to(before, "lineno")[:50]:
+                text.write(f"{stat}\n")
+            path.write_text(text.getvalue())
+
+        self._write(
+            label,
+            {
+                ".collapsed": lambda path: _write_collapsed(
+                    path, collapse_snapshots(before, after)
+                ),
+                ".top.txt": write_top,
+            },
+        )
+
+    @contextmanager
+    def profile(self, label: str) -> Iterator[None]:
+        """Profile the body of the with statement, unless already profiling"""
+        if not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.mode == "cpu":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    self._save(label, self._write_cpu, profile)
+            else:
+                started = not tracemalloc.is_tracing()
+                if started:
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                before = tracemalloc.take_snapshot()
+                try:
+                    yield
+                finally:
+                    after = tracemalloc.take_snapshot()
+                    if started:
+                        tracemalloc.stop()
+                    self._save(label, self._write_mem, before, after)
+        finally:
+            self._busy.release()
+
+    def _save(self, label: str, write: Callable[..., None], *args: Any) -> None:
+        # A full disk shouldn't break what was being profiled
+        try:
+            write(label, *args)
+        except OSError:
+            _log.exception("Failed to write the profile of %s", label)
+
+
+_profiler: Profiler | None = None
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+def set_profiler(profiler: Profiler | None) -> None:
+    """Start profiling functions marked with :func:`profiled`, or stop with None"""
+    global _profiler
+    _profiler = profiler
+
+
+def profiled(label: str) -> Callable[[_F], _F]:
+    """Mark a function or coroutine function to be profiled as label
+
+    Without a profiler set by :func:`set_profiler`, the function is called
+    straight away. Profiling a coroutine covers everything else the event loop
+    runs while it is suspended.
+    """
+
+    def decorate(func: _F) -> _F:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if _profiler is None:
+                    return await func(*args, **kwargs)
+                with _profiler.profile(label):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.profile(label):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorate
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+__all__ = [
+    "SNAPSHOT_FILE",
+    "Snapshot",
+]
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import pydantic
+
+from ..__about__ import __version__
+from .command import CommandsJson
+from .sound import SoundCollection, SoundsJson
+
+SNAPSHOT_FILE = "wowbot.snapshot"
+
+SNAPSHOT_MAGIC = b"WOWBOTSNAP"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<10sHI")  # magic, format version, key length
+
+
+def _digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _stamp(path: Path) -> List[int]:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _make_key(
+    sounds_path: Path,
+    sounds_root: Path,
+    commands_path: Path,
+    directories: Iterable[Path],
+    files: Iterable[Path],
+) -> Dict[str, Any]:
+    return {
+        "versions": [__version__, pydantic.VERSION, list(sys.version_info[:2])],
+        "root": [str(sounds_root), os.path.abspath(sounds_root)],
+        "sounds": _digest(sounds_path),
+        "commands": _digest(commands_path),
+        "directories": {str(path): path.stat().st_mtime_ns for path in directories},
+        "files": {str(path): _stamp(path) for path in files},
+    }
+
+
+def _key_is_fresh(
+    key: Dict[str, Any], sounds_path: Path, sounds_root: Path, commands_path: Path
+) -> bool:
+    try:
+        return (
+            key["versions"]
+            == [__version__, pydantic.VERSION, list(sys.version_info[:2])]
+            and key["root"] == [str(sounds_root), os.path.abspath(sounds_root)]
+            and key["sounds"] == _digest(sounds_path)
+            and key["commands"] == _digest(commands_path)
+            # A folder's mtime changes whenever a file is added to or removed
+            # from it, so unchanged folders mean that globs are unchanged
+            and all(
+                Path(path).stat().st_mtime_ns == mtime
+                for path, mtime in key["directories"].items()
+            )
+            and all(_stamp(Path(path)) == stamp for path, stamp in key["files"].items())
+        )
+    except (OSError, KeyError, TypeError):
+        return False
+
+
+@dataclass
+class Snapshot:
+    """A compiled, already-validated copy of a sounds folder
+
+    A snapshot stores the validated models and resolved sounds of a folder, so
+    that they can be loaded without parsing, validating or resolving anything.
+    It is keyed by the contents of both JSON files, the modification times of
+    every folder searched for sound files, and the size and modification time of
+    every sound file, and it is only loaded if all of them are unchanged.
+
+    Snapshots are pickled, so should only be loaded from trusted locations.
+
+    .. autoattribute:: sounds_json
+    .. autoattribute:: sound_collection
+    .. autoattribute:: commands_json
+    .. autoattribute:: directories
+
+    .. automethod:: write
+    .. automethod:: read
+    """
+
+    sounds_json: SoundsJson
+    """The validated sounds file"""
+    sound_collection: SoundCollection
+    """The resolved sounds"""
+    commands_json: CommandsJson
+    """The validated commands file, which has been checked against the sounds"""
+    directories: List[Path]
+    """The folders which were searched for sound files"""
+
+    def write(
+        self,
+        path: Path,
+        sounds_path: Path,
+        sounds_root: Path,
+        commands_path: Path,
+    ) -> None:
+        """Write the snapshot to path, keyed by the current state of the folder"""
+        # The snapshot usually lives in the sounds folder, so create it before
+        # taking the folder's mtime, and then only rewrite it in place
+        path.touch(exist_ok=True)
+
+        files = {
+            file for sound in self.sound_collection.values() for file in sound.files()
+        }
+        key = _make_key(
+            sounds_path, sounds_root, commands_path, self.directories, files
+        )
+        key_data = json.dumps(key).encode()
+
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(key_data)))
+            f.write(key_data)
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def read(
+        cls,
+        path: Path,
+        sounds_path: Path,
+        sounds_root: Path,
+        commands_path: Path,
+    ) -> Snapshot | None:
+        """Read the snapshot at path, if it exists and is still fresh
+
+        The snapshot is unpickled, so this must only be used on trusted files.
+        """
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+                if len(header) != _HEADER.size:
+                    return None
+                magic, version, key_length = _HEADER.unpack(header)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    return None
+
+                key = json.loads(f.read(key_length))
+                if not _key_is_fresh(key, sounds_path, sounds_root, commands_path):
+                    return None
+
+                try:
+                    snapshot = pickle.load(f)
+                except Exception:
+                    # e.g. a class which has been moved since it was written
+                    return None
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(snapshot, cls):
+            return None
+        return snapshot
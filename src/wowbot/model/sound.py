@@ -16,14 +16,35 @@ __all__ = [
 
 import random
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import accumulate
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Literal, NewType, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    NewType,
+    Sequence,
+    Union,
+)
 
 from pydantic import conint, conlist
 
 from .errors import BaseModelError, ContextModelError, ErrorCollection, context
-from .model import BaseModel, RootModel
+from .index import DirectoryIndex
+from .media import MediaIndex, MediaInfo
+from .model import BaseModel, RootModel, tagged_union
+from .profile import profiled
+from .storage import SoundHandle, Storage
 
 SoundName = NewType("SoundName", str)
 
@@ -86,8 +107,13 @@ class SoundFileABC(BaseModel, ABC):
     """
 
     @abstractmethod
-    def resolve_files(self, root: Path) -> List[Path]:
-        """Resolve the paths relative to root"""
+    def resolve_files(
+        self, root: Path, dir_index: DirectoryIndex | None = None
+    ) -> List[Path]:
+        """Resolve the paths relative to root
+
+        If an index of root is given, paths are looked up in it rather than on
+        the filesystem."""
         ...  # no cov
 
     @abstractmethod
@@ -108,10 +134,12 @@ class Filename(SoundFileABC, RootModel[str]):
     root: str
     """The file path"""
 
-    def resolve_files(self, root: Path) -> List[Path]:
+    def resolve_files(
+        self, root: Path, dir_index: DirectoryIndex | None = None
+    ) -> List[Path]:
         """Resolve the path relative to root"""
         path = root / self.root
-        if not path.exists():
+        if not (path.exists() if dir_index is None else dir_index.exists(self.root)):
             with context("root"):
                 raise SoundFileNotFoundError(Path(self.root), path)
         return [path]
@@ -171,7 +199,9 @@ class Filenames(Weighted):
     This must be non-empty
     """
 
-    def resolve_files(self, root: Path) -> List[Path]:
+    def resolve_files(
+        self, root: Path, dir_index: DirectoryIndex | None = None
+    ) -> List[Path]:
         """Resolve the paths relative to root"""
         paths: List[Path] = []
         missing: List[SoundFileNotFoundError] = []
@@ -180,7 +210,7 @@ class Filenames(Weighted):
             for index, name in enumerate(self.filenames):
                 path = root / name
                 paths.append(path)
-                if not path.exists():
+                if not (path.exists() if dir_index is None else dir_index.exists(name)):
                     with context(index):
                         missing.append(SoundFileNotFoundError(Path(name), path))
 
@@ -205,16 +235,29 @@ class GlobFile(Weighted):
     This pattern is expanded in resolve_files into a list of files.
     """
 
-    def resolve_files(self, root: Path) -> List[Path]:
+    def resolve_files(
+        self, root: Path, dir_index: DirectoryIndex | None = None
+    ) -> List[Path]:
         """Resolve the glob into paths relative to root"""
-        paths = list(root.glob(self.glob))
+        if dir_index is None:
+            paths = list(root.glob(self.glob))
+        else:
+            paths = dir_index.glob(self.glob)
         if not paths:
             with context("glob"):
                 raise EmptyGlobError(self.glob)
         return paths
 
 
-SoundFile = Union[Filename, Filenames, GlobFile]
+if TYPE_CHECKING:
+    SoundFile = Union[Filename, Filenames, GlobFile]
+else:
+    SoundFile = tagged_union(
+        lambda value: "GlobFile" if "glob" in value else "Filenames",
+        Filename,
+        Filenames,
+        GlobFile,
+    )
 if TYPE_CHECKING:
     _NonEmptySoundFileList = list[SoundFile]
 else:
@@ -238,7 +281,9 @@ class Sound(BaseModel):
     This must be non-empty
     """
 
-    def resolve_files(self, root: Path) -> ResolvedSound:
+    def resolve_files(
+        self, root: Path, dir_index: DirectoryIndex | None = None
+    ) -> ResolvedSound:
         """Resolve all paths relative to root"""
         groups: List[List[Path]] = []
         weights: List[int] = []
@@ -249,7 +294,7 @@ class Sound(BaseModel):
             for index, file in enumerate(self.files):
                 try:
                     with context(index):
-                        groups.append(file.resolve_files(root))
+                        groups.append(file.resolve_files(root, dir_index))
                         weights.append(file.get_weight())
                 except BaseModelError as err:
                     errors.append(err)
@@ -267,25 +312,72 @@ class ResolvedSound:
     .. autoattribute:: name
     .. autoattribute:: filegroups
     .. autoattribute:: groupweights
+    .. autoattribute:: storage
+    .. autoattribute:: media
 
     .. automethod:: random
+    .. automethod:: sample
+    .. automethod:: files
+    .. automethod:: info
+    .. automethod:: max_duration
     """
 
     name: SoundName
     """The name of the sound"""
     filegroups: List[List[Path]]
     """A list of groups of paths"""
-    groupweights: List[int]
-    """A list of weights, corresponding to the elements of filegroups"""
-
-    def random(self) -> Path:
-        """Select a random file
+    groupweights: Sequence[int]
+    """The weights of the elements of filegroups, kept as a tuple"""
+    storage: Storage | None = field(default=None, repr=False, compare=False)
+    """Where the files are kept, or None if they are local files"""
+    media: MediaIndex | None = field(default=None, repr=False, compare=False)
+    """The index of the files' formats and durations, if there is one"""
+
+    _cumweights: List[int] = field(init=False, repr=False, compare=False)
+    """The running totals of groupweights, so they are not summed on every pick"""
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "groupweights":
+            # The weights can't be changed in place, and the totals follow them
+            value = tuple(value)
+            super().__setattr__("_cumweights", list(accumulate(value)))
+        super().__setattr__(name, value)
+
+    def random(self) -> SoundHandle:
+        """Select a random file, as a handle which opens it from :attr:`storage`
 
         This selects a random group, with groups biased by weight from groupweights.
         Then from this group, a file is randomly chosen, without bias.
         """
-        group = random.choices(self.filegroups, self.groupweights, k=1)[0]
-        return random.choice(group)
+        group = random.choices(self.filegroups, cum_weights=self._cumweights)[0]
+        return SoundHandle(random.choice(group), self.storage)
+
+    def sample(self, k: int) -> List[SoundHandle]:
+        """Select k random files, with replacement
+
+        Each file is selected with the same distribution as :meth:`random`.
+        """
+        groups = random.choices(self.filegroups, cum_weights=self._cumweights, k=k)
+        return [SoundHandle(random.choice(group), self.storage) for group in groups]
+
+    def files(self) -> Iterator[Path]:
+        """Iterate over every file which can be selected"""
+        for group in self.filegroups:
+            yield from group
+
+    def info(self, path: Path) -> MediaInfo | None:
+        """Get the format and duration of one of the files, if it is indexed"""
+        if self.media is None:
+            return None
+        return self.media.get(path)
+
+    def max_duration(self) -> float | None:
+        """Get the duration of the longest file, or None if any is unknown"""
+        infos = [self.info(path) for path in self.files()]
+        durations = [None if info is None else info.duration for info in infos]
+        if not durations or None in durations:
+            return None
+        return max(durations)  # type: ignore[type-var]
 
 
 class SoundsJson(BaseModel):
@@ -301,19 +393,64 @@ class SoundsJson(BaseModel):
     sounds: List[Sound]
     """The list of sounds"""
 
-    def resolve_files(self, root: Path) -> SoundCollection:
-        """Resolve the paths of all sounds relative to root"""
+    @profiled("SoundsJson.resolve_files")
+    def resolve_files(
+        self,
+        root: Path,
+        dir_index: DirectoryIndex | None = None,
+        *,
+        jobs: int = 1,
+        reuse: Mapping[int, ResolvedSound] | None = None,
+        storage: Storage | None = None,
+    ) -> SoundCollection:
+        """Resolve the paths of all sounds relative to root
+
+        Unless dir_index is given, root is indexed once up front, so that each
+        path and glob does not have to touch the filesystem.
+
+        If jobs is greater than 1, sounds are resolved in parallel by that many
+        threads. The result, and the errors raised, are the same as when they
+        are resolved one at a time.
+
+        Sounds whose index is in reuse are not resolved again; the given
+        ResolvedSound is used instead.
+
+        If the files are kept in a storage other than the local filesystem, it
+        is indexed instead of root, which should be its root, and the resolved
+        sounds open their files from it."""
+        if dir_index is None and len(reuse or ()) < len(self.sounds):
+            if storage is not None:
+                dir_index = storage.index(jobs)
+            else:
+                dir_index = DirectoryIndex(root, jobs=jobs)
+
         collection: SoundCollection = dict()
         errors: List[BaseModelError] = []
 
-        with context("sounds"):
+        with ExitStack() as stack, context("sounds"):
+            pool = None
+            if jobs > 1:
+                pool = stack.enter_context(ThreadPoolExecutor(jobs))
+
+            results: List[Callable[[], ResolvedSound]] = []
             for index, sound in enumerate(self.sounds):
+                resolve = partial(sound.resolve_files, root, dir_index)
+                if reuse is not None and index in reuse:
+                    results.append(partial(reuse.__getitem__, index))
+                elif pool is None:
+                    results.append(resolve)
+                else:
+                    with context(index):
+                        # Copy the context, so that errors get the right location
+                        results.append(pool.submit(copy_context().run, resolve).result)
+
+            for index, (sound, result) in enumerate(zip(self.sounds, results)):
                 with context(index):
                     if sound.name in collection:
                         with context("name"):
                             errors.append(SoundNameReuseError(sound.name))
                     try:
-                        collection[sound.name] = sound.resolve_files(root)
+                        collection[sound.name] = result()
                     except BaseModelError as err:
                         errors.append(err)
                         # Allocate the key anyway, for re-use checks
@@ -321,6 +458,9 @@ class SoundsJson(BaseModel):
 
         if errors:
             raise ErrorCollection(*errors)
+        if storage is not None:
+            for resolved in collection.values():
+                resolved.storage = storage
         return collection
 
 
@@ -1,40 +1,457 @@
 from __future__ import annotations
 
 import json
-from pathlib import Path
+from pathlib import Path, PurePath
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
 
+import pydantic
+
+from .archive import Archive
+from .bundle import open_archive
 from .command import CommandsJson
-from .sound import SoundCollection, SoundsJson
+from .index import DirectoryIndex
+from .jsonfile import JsonFiles
+from .loudness import LoudnessCache
+from .media import MediaIndex
+from .probe import ProbeCache
+from .profile import profiled
+from .snapshot import SNAPSHOT_FILE, Snapshot
+from .sound import GlobFile, ResolvedSound, Sound, SoundCollection, SoundsJson
+from .storage import Storage
+from .transcode import TranscodeCache
 
 SOUNDS_FILE = "sounds.json"
 COMMANDS_FILE = "commands.json"
 
 
+def get_directories(
+    dir_index: DirectoryIndex, sound_collection: SoundCollection
+) -> List[Path]:
+    """Get every folder which could affect how the sounds are resolved
+
+    This is every indexed folder, and every folder containing a sound file.
+    """
+    directories = list(dir_index.directories())
+    parents = {
+        path.parent for sound in sound_collection.values() for path in sound.files()
+    }
+    directories.extend(parents.difference(directories))
+    return directories
+
+
+def _stamp(path: Path) -> Tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _entry_key(entry: Any) -> str:
+    return json.dumps(entry, sort_keys=True)
+
+
+def _glob_base(root: Path, pattern: str) -> Path:
+    """Get the deepest folder which contains every match of a glob pattern"""
+    parts = PurePath(pattern).parts[:-1]
+    for index, part in enumerate(parts):
+        if "*" in part or "?" in part or "[" in part or part == "..":
+            parts = parts[:index]
+            break
+    return root.joinpath(*parts)
+
+
 class SoundsDir:
+    sounds_path: Path
+    sounds_root: Path
+    commands_path: Path
+
     sounds_json: SoundsJson
     sound_collection: SoundCollection
+    directories: List[Path]
 
     commands_json: CommandsJson
 
+    storage: Storage | None
+    archive: Archive | None
+    transcode_cache: TranscodeCache | None
+    probe_cache: ProbeCache | None
+    loudness_cache: LoudnessCache | None
+    media_index: MediaIndex | None
+
+    @profiled("SoundsDir")
     def __init__(
-        self, sounds_path: Path, sounds_root: Path, commands_path: Path
+        self,
+        sounds_path: Path,
+        sounds_root: Path,
+        commands_path: Path,
+        *,
+        transcode_cache: TranscodeCache | None = None,
+        probe_cache: ProbeCache | None = None,
+        loudness_cache: LoudnessCache | None = None,
+        media_index: MediaIndex | None = None,
+        jobs: int = 1,
     ) -> None:
-        with open(sounds_path) as f:
-            sounds_data = json.load(f)
+        self.sounds_path = sounds_path
+        self.sounds_root = sounds_root
+        self.commands_path = commands_path
+
+        self._file_stamps = self._get_file_stamps()
+        files = JsonFiles(Path.read_bytes, [sounds_path, commands_path])
+
+        self.sounds_json = files.validate(SoundsJson, sounds_path)
+        # There are no parsed entries to key, so the first reload validates them
+        self._entries = {}
+        dir_index = DirectoryIndex(sounds_root, jobs=jobs)
+        self.sound_collection = self.sounds_json.resolve_files(
+            sounds_root, dir_index, jobs=jobs
+        )
+        self._set_directories(get_directories(dir_index, self.sound_collection))
 
-        self.sounds_json = SoundsJson.model_validate(sounds_data)
-        self.sound_collection = self.sounds_json.resolve_files(sounds_root)
+        self.commands_json = files.validate(CommandsJson, commands_path)
+        self.commands_json.check_sounds(self.sound_collection)
+
+        self.storage = None
+        self.archive = None
+        self.transcode_cache = transcode_cache
+        self.probe_cache = probe_cache
+        self.loudness_cache = loudness_cache
+        self.media_index = media_index
+        self._attach_media(self.sound_collection)
+        self.fill_caches()
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot: Snapshot,
+        sounds_path: Path,
+        sounds_root: Path,
+        commands_path: Path,
+        *,
+        transcode_cache: TranscodeCache | None = None,
+        probe_cache: ProbeCache | None = None,
+        loudness_cache: LoudnessCache | None = None,
+        media_index: MediaIndex | None = None,
+    ) -> SoundsDir:
+        """Create a SoundsDir from a snapshot, without validating it again"""
+        self = cls.__new__(cls)
+        self.sounds_path = sounds_path
+        self.sounds_root = sounds_root
+        self.commands_path = commands_path
+
+        self._file_stamps = self._get_file_stamps()
+        self.sounds_json = snapshot.sounds_json
+        self._entries = {}
+        self.sound_collection = snapshot.sound_collection
+        self._set_directories(snapshot.directories)
+        self.commands_json = snapshot.commands_json
+
+        self.storage = None
+        self.archive = None
+        self.transcode_cache = transcode_cache
+        self.probe_cache = probe_cache
+        self.loudness_cache = loudness_cache
+        self.media_index = media_index
+        self._attach_media(self.sound_collection)
+        self.fill_caches()
+        return self
+
+    @classmethod
+    @profiled("SoundsDir.from_storage")
+    def from_storage(
+        cls,
+        storage: Storage,
+        *,
+        transcode_cache: TranscodeCache | None = None,
+        probe_cache: ProbeCache | None = None,
+        loudness_cache: LoudnessCache | None = None,
+        media_index: MediaIndex | None = None,
+        jobs: int = 1,
+    ) -> SoundsDir:
+        """Load a sounds folder kept in a storage, such as an archive or a server
 
-        with open(commands_path) as f:
-            commands_data = json.load(f)
+        The storage's root is used as the sounds root, and the resolved sounds
+        open their files from the storage. Its files are prefetched in the
+        background, and if the storage gives local files, they fill the caches.
+        """
+        self = cls.__new__(cls)
+        self.sounds_path = storage.root / SOUNDS_FILE
+        self.sounds_root = storage.root
+        self.commands_path = storage.root / COMMANDS_FILE
 
-        self.commands_json = CommandsJson.model_validate(commands_data)
+        # Archives are already in memory, and a tar file can't be read from two
+        # threads at once
+        files = JsonFiles(
+            storage.read_bytes,
+            [SOUNDS_FILE, COMMANDS_FILE],
+            concurrent=not isinstance(storage, Archive),
+        )
+        self.sounds_json = files.validate(SoundsJson, SOUNDS_FILE)
+        self._entries = {}  # a storage is never reloaded
+        self.sound_collection = self.sounds_json.resolve_files(
+            storage.root, jobs=jobs, storage=storage
+        )
+        self.commands_json = files.validate(CommandsJson, COMMANDS_FILE)
         self.commands_json.check_sounds(self.sound_collection)
 
+        # The storage is only loaded once
+        self._file_stamps = self._get_file_stamps()
+        self._set_directories([])
+
+        self.storage = storage
+        self.archive = storage if isinstance(storage, Archive) else None
+        self.transcode_cache = transcode_cache
+        self.probe_cache = probe_cache
+        self.loudness_cache = loudness_cache
+        self.media_index = media_index
+        self._attach_media(self.sound_collection)
+        self.fill_caches()
+        return self
+
     @classmethod
-    def from_folder(cls, folder: Path):
+    def from_archive(cls, path: Path, *, jobs: int = 1) -> SoundsDir:
+        """Mount a zip or tar file, or a bundle made by :code:`wowbot-sounds build`
+
+        The archive's path is used as the sounds root, so the resolved sound files
+        are paths below it, which :attr:`archive` can read. Nothing is extracted,
+        so there are no caches to fill.
+        """
+        return cls.from_storage(open_archive(path), jobs=jobs)
+
+    def to_snapshot(self) -> Snapshot:
+        """Get a snapshot of the validated and resolved sounds"""
+        return Snapshot(
+            sounds_json=self.sounds_json,
+            sound_collection=self.sound_collection,
+            commands_json=self.commands_json,
+            directories=self.directories,
+        )
+
+    def files(self) -> Iterator[Path]:
+        """Iterate over every resolved sound file, without repeats"""
+        seen: set[Path] = set()
+        for sound in self.sound_collection.values():
+            for path in sound.files():
+                if path not in seen:
+                    seen.add(path)
+                    yield path
+
+    def fill_caches(self, files: Iterable[Path] | None = None) -> None:
+        """Start filling the caches with sound files in the background
+
+        By default, this is every resolved sound file. Files in a storage are
+        prefetched first, and only fill the caches if they are already local.
+        The probe cache is only filled ahead of time if it has a sidecar."""
+        if files is None:
+            files = list(self.files())
+        if self.storage is not None:
+            self.storage.prefetch(files)
+            local = (self.storage.local_path(path) for path in files)
+            files = [path for path in local if path is not None]
+        if self.transcode_cache is not None:
+            self.transcode_cache.fill_in_background(files)
+        if self.probe_cache is not None and self.probe_cache.sidecar is not None:
+            # Without a sidecar the results would be lost on restart, so files are
+            # only probed when they are first played
+            self.probe_cache.fill_in_background(files)
+        if self.loudness_cache is not None and (
+            self.transcode_cache is None
+            or self.transcode_cache.loudness is not self.loudness_cache
+        ):
+            # otherwise, the transcode cache measures files before transcoding them
+            self.loudness_cache.fill_in_background(files)
+        if self.media_index is not None:
+            self.media_index.fill_in_background(files)
+
+    def _attach_media(self, sound_collection: SoundCollection) -> None:
+        if self.media_index is not None:
+            for sound in sound_collection.values():
+                sound.media = self.media_index
+
+    def _get_file_stamps(self) -> Tuple[Tuple[int, int] | None, ...]:
+        return _stamp(self.sounds_path), _stamp(self.commands_path)
+
+    def _set_directories(self, directories: List[Path]) -> None:
+        self.directories = directories
+        self._directory_stamps = {path: _stamp(path) for path in directories}
+
+    @staticmethod
+    def _get_entries(sounds_data: Any, sounds_json: SoundsJson) -> Dict[str, Sound]:
+        return {
+            _entry_key(entry): sound
+            for entry, sound in zip(sounds_data["sounds"], sounds_json.sounds)
+        }
+
+    def _validate_sounds(self, sounds_data: Any) -> SoundsJson:
+        # Only validate the entries which are new, unless the file as a whole has
+        # changed shape; then validate it all, to get the full errors
+        if (
+            not isinstance(sounds_data, dict)
+            or sounds_data.keys() != {"version", "sounds"}
+            or type(sounds_data["version"]) is not int
+            or sounds_data["version"] != 1
+            or not isinstance(sounds_data["sounds"], list)
+        ):
+            return SoundsJson.model_validate(sounds_data)
+
+        sounds: List[Sound] = []
+        for entry in sounds_data["sounds"]:
+            sound = self._entries.get(_entry_key(entry))
+            if sound is None:
+                try:
+                    sound = Sound.model_validate(entry)
+                except pydantic.ValidationError:
+                    return SoundsJson.model_validate(sounds_data)
+            sounds.append(sound)
+        return SoundsJson.model_construct(version=1, sounds=sounds)
+
+    def _get_reusable(
+        self, sounds_json: SoundsJson, changed_directories: List[Path]
+    ) -> Dict[int, ResolvedSound]:
+        """Find the sounds which resolving again could not change"""
+        previous = {sound.name: sound for sound in self.sounds_json.sounds}
+        changed = set(changed_directories)
+
+        reuse: Dict[int, ResolvedSound] = {}
+        for index, sound in enumerate(sounds_json.sounds):
+            resolved = self.sound_collection.get(sound.name)
+            if resolved is None or previous.get(sound.name) != sound:
+                continue
+            # A file may have been removed, or a glob may match a new file
+            if any(path.parent in changed for path in resolved.files()):
+                continue
+            if any(
+                d == base or base in d.parents
+                for file in sound.files
+                if isinstance(file, GlobFile)
+                for base in [_glob_base(self.sounds_root, file.glob)]
+                for d in changed
+            ):
+                continue
+            reuse[index] = resolved
+        return reuse
+
+    @profiled("SoundsDir.reload")
+    def reload(
+        self,
+        *,
+        jobs: int = 1,
+        check: Callable[[SoundCollection], object] | None = None,
+    ) -> bool:
+        """Reload the folder, if anything in it has changed
+
+        Sounds are only validated and resolved again if their entry in the sounds
+        file has changed, or if a folder their files could be in has changed;
+        otherwise, their previous ResolvedSound is reused.
+
+        If check is given, it is called with the new sounds before anything is
+        changed, and can raise to reject them, e.g. because commands which have
+        already been registered need a sound which is gone.
+
+        Returns whether anything was reloaded. If the folder is no longer valid,
+        or check rejects it, the error is raised, and the SoundsDir is left
+        unchanged, so the next reload tries again. A mounted folder kept in an
+        archive or another storage is never reloaded.
+        """
+        if self.storage is not None:
+            return False
+
+        file_stamps = self._get_file_stamps()
+        changed_directories = [
+            path
+            for path, stamp in self._directory_stamps.items()
+            if _stamp(path) != stamp
+        ]
+        if file_stamps == self._file_stamps and not changed_directories:
+            return False
+
+        with open(self.sounds_path) as f:
+            sounds_data = json.load(f)
+        sounds_json = self._validate_sounds(sounds_data)
+
+        reuse = self._get_reusable(sounds_json, changed_directories)
+
+        dir_index = None
+        if len(reuse) < len(sounds_json.sounds) or changed_directories:
+            dir_index = DirectoryIndex(self.sounds_root, jobs=jobs)
+        sound_collection = sounds_json.resolve_files(
+            self.sounds_root, dir_index, jobs=jobs, reuse=reuse
+        )
+
+        commands_json = self.commands_json
+        if file_stamps[1] != self._file_stamps[1]:
+            commands_json = CommandsJson.model_validate_json(
+                self.commands_path.read_bytes()
+            )
+        commands_json.check_sounds(sound_collection)
+        if check is not None:
+            check(sound_collection)
+
+        new_files = set(
+            path for sound in sound_collection.values() for path in sound.files()
+        ).difference(self.files())
+
+        self._file_stamps = file_stamps
+        self.sounds_json = sounds_json
+        self._entries = self._get_entries(sounds_data, sounds_json)
+        self.sound_collection = sound_collection
+        self._attach_media(sound_collection)
+        if dir_index is not None:
+            self._set_directories(get_directories(dir_index, sound_collection))
+        self.commands_json = commands_json
+
+        if new_files:
+            self.fill_caches(new_files)
+        return True
+
+    @classmethod
+    @profiled("SoundsDir.from_folder")
+    def from_folder(
+        cls,
+        folder: Path,
+        *,
+        transcode_cache: TranscodeCache | None = None,
+        probe_cache: ProbeCache | None = None,
+        loudness_cache: LoudnessCache | None = None,
+        media_index: MediaIndex | None = None,
+        jobs: int = 1,
+        use_snapshot: bool = False,
+    ):
+        """Load a folder, from its compiled snapshot if asked and there is a fresh one
+
+        Snapshots are pickled, so loading one can run arbitrary code. Only set
+        use_snapshot for folders whose contents are trusted.
+
+        If folder is a file, it is mounted as an archive."""
+        if folder.is_file():
+            return cls.from_archive(folder, jobs=jobs)
+
         sounds_path = folder / SOUNDS_FILE
         commands_path = folder / COMMANDS_FILE
+
+        if use_snapshot:
+            snapshot = Snapshot.read(
+                folder / SNAPSHOT_FILE, sounds_path, folder, commands_path
+            )
+            if snapshot is not None:
+                return cls.from_snapshot(
+                    snapshot,
+                    sounds_path=sounds_path,
+                    sounds_root=folder,
+                    commands_path=commands_path,
+                    transcode_cache=transcode_cache,
+                    probe_cache=probe_cache,
+                    loudness_cache=loudness_cache,
+                    media_index=media_index,
+                )
+
         return cls(
-            sounds_path=sounds_path, sounds_root=folder, commands_path=commands_path
+            sounds_path=sounds_path,
+            sounds_root=folder,
+            commands_path=commands_path,
+            transcode_cache=transcode_cache,
+            probe_cache=probe_cache,
+            loudness_cache=loudness_cache,
+            media_index=media_index,
+            jobs=jobs,
         )
@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+__all__ = [
+    "LISTING_FILE",
+    "Storage",
+    "LocalStorage",
+    "HTTPStorage",
+    "SoundHandle",
+    "write_listing",
+]
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Dict, Iterable, List, NamedTuple, Tuple
+
+from .index import DirectoryIndex
+
+_log = logging.getLogger(__name__)
+
+LISTING_FILE = "files.json"
+LISTING_VERSION = 1
+_CACHE_STATE_FILE = ".wowbot-cache.json"
+_BLOCK_SIZE = 1 << 16
+
+
+class Storage(ABC):
+    """Where a sounds folder's files are kept
+
+    A storage has a local :attr:`root`, and sound files resolve to paths below
+    it, whether or not a file is actually there. The storage lists its files
+    with :meth:`index`, so that sounds can be resolved against it, and opens the
+    resolved paths.
+
+    .. autoattribute:: root
+
+    .. automethod:: index
+    .. automethod:: read_text
+    .. automethod:: read_bytes
+    .. automethod:: open
+    .. automethod:: local_path
+    .. automethod:: fetch
+    .. automethod:: prefetch
+    .. automethod:: close
+    """
+
+    root: Path
+    """The folder which sound files are resolved relative to"""
+
+    @abstractmethod
+    def index(self, jobs: int = 1) -> DirectoryIndex:
+        """Get an index of every file, rooted at :attr:`root`"""
+        ...  # no cov
+
+    @abstractmethod
+    def read_text(self, name: str) -> str:
+        """Read a file, such as the sounds file, by its path relative to the root"""
+        ...  # no cov
+
+    def read_bytes(self, name: str) -> bytes:
+        """Read a file like :meth:`read_text`, without decoding it"""
+        return self.read_text(name).encode()
+
+    @abstractmethod
+    def open(self, path: Path) -> IO[bytes] | None:
+        """Open a resolved sound file, or return None if it isn't stored"""
+        ...  # no cov
+
+    def local_path(self, path: Path) -> Path | None:
+        """Get a local file with the contents of path, if there is one already
+
+        This never blocks, so it can be called on the event loop."""
+        return None
+
+    def fetch(self, path: Path) -> Path | None:
+        """Get a local file with the contents of path, fetching it if needed
+
+        This returns None if the storage can't give a local file at all."""
+        return self.local_path(path)
+
+    def prefetch(self, paths: Iterable[Path]) -> None:
+        """Start fetching files in the background, so later fetches are quick"""
+
+    def close(self) -> None:
+        """Release anything held by the storage"""
+
+
+class LocalStorage(Storage):
+    """A sounds folder on the local filesystem"""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def index(self, jobs: int = 1) -> DirectoryIndex:
+        return DirectoryIndex(self.root, jobs=jobs)
+
+    def read_text(self, name: str) -> str:
+        return (self.root / name).read_text()
+
+    def read_bytes(self, name: str) -> bytes:
+        return (self.root / name).read_bytes()
+
+    def open(self, path: Path) -> IO[bytes] | None:
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, path: Path) -> Path | None:
+        return path
+
+
+class _Listed(NamedTuple):
+    size: int
+    mtime_ns: int
+
+
+def write_listing(folder: Path, files: Iterable[Path]) -> Path:
+    """Write the listing of files an :class:`HTTPStorage` of folder reads
+
+    Only the listed files can be resolved by the storage, so these should be
+    every resolved sound file.
+    """
+    listing: Dict[str, List[int]] = {}
+    for path in sorted(set(files)):
+        st = path.stat()
+        listing[path.relative_to(folder).as_posix()] = [st.st_size, st.st_mtime_ns]
+    out = folder / LISTING_FILE
+    tmp = out.with_name(f".{out.name}.{os.getpid()}")
+    with open(tmp, "w") as f:
+        json.dump({"version": LISTING_VERSION, "files": listing}, f, indent=1)
+    os.replace(tmp, out)
+    return out
+
+
+class HTTPStorage(Storage):
+    """A sounds folder served over HTTP, with a size-bounded local cache
+
+    The folder must have a listing, written by :func:`write_listing`, which is
+    fetched once and used to resolve sounds. Files are downloaded into
+    :code:`cache_dir` when they are first fetched, and the least recently used
+    are deleted once they take up more than :code:`max_bytes`. Cached files are
+    kept between runs, unless the listing shows that they have changed.
+
+    Downloads run in a pool of :code:`jobs` threads, so that prefetching many
+    files doesn't wait for each in turn.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        cache_dir: Path,
+        *,
+        max_bytes: int = 1 << 30,
+        jobs: int = 4,
+        timeout: float = 30.0,
+    ) -> None:
+        self.url = url if url.endswith("/") else url + "/"
+        self.root = cache_dir / hashlib.sha256(self.url.encode()).hexdigest()[:16]
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.hits = 0
+        self.downloads = 0
+        self.evictions = 0
+
+        listing = json.loads(self.read_text(LISTING_FILE))
+        if listing.get("version") != LISTING_VERSION:
+            raise ValueError(f"Unsupported listing version at {self.url}")
+        self.listing: Dict[str, _Listed] = {
+            name: _Listed(*stamp) for name, stamp in listing["files"].items()
+        }
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._cached: OrderedDict[str, int] = OrderedDict()
+        self._pending: Dict[str, Future[Path]] = {}
+        self._pool = ThreadPoolExecutor(jobs, thread_name_prefix="wowbot-http")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load_state()
+
+    def _get(self, name: str) -> urllib.request.Request:
+        return urllib.request.Request(self.url + urllib.parse.quote(name))
+
+    def read_text(self, name: str) -> str:
+        return self.read_bytes(name).decode()
+
+    def read_bytes(self, name: str) -> bytes:
+        with urllib.request.urlopen(self._get(name), timeout=self.timeout) as r:
+            return r.read()
+
+    def index(self, jobs: int = 1) -> DirectoryIndex:
+        return DirectoryIndex.from_paths(self.root, self.listing)
+
+    def _name(self, path: Path) -> str | None:
+        try:
+            name = path.relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+        return name if name in self.listing else None
+
+    def _load_state(self) -> None:
+        # Keep the cached files which still match the listing, oldest first
+        try:
+            with open(self.root / _CACHE_STATE_FILE) as f:
+                state: List[Tuple[str, List[int]]] = json.load(f)
+        except (OSError, ValueError):
+            state = []
+        for name, stamp in state:
+            listed = self.listing.get(name)
+            path = self.root / name
+            if listed is not None and _Listed(*stamp) == listed and path.is_file():
+                self._cached[name] = listed.size
+            else:
+                path.unlink(missing_ok=True)
+
+    def _save_state(self) -> None:
+        # Saves are taken in turn, so an older state never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                state = [[name, list(self.listing[name])] for name in self._cached]
+            out = self.root / _CACHE_STATE_FILE
+            tmp = out.with_name(f".{out.name}.{threading.get_ident()}")
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, out)
+
+    def cached_bytes(self) -> int:
+        with self._lock:
+            return sum(self._cached.values())
+
+    def local_path(self, path: Path) -> Path | None:
+        name = self._name(path)
+        with self._lock:
+            if name is None or name not in self._cached:
+                return None
+            self._cached.move_to_end(name)
+            self.hits += 1
+        return path
+
+    def _download(self, name: str) -> Path:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}")
+        try:
+            with urllib.request.urlopen(
+                self._get(name), timeout=self.timeout
+            ) as r, open(tmp, "wb") as f:
+                for block in iter(lambda: r.read(_BLOCK_SIZE), b""):
+                    f.write(block)
+            os.replace(tmp, path)
+        except BaseException:
+            # Let the next fetch try again, rather than see this failure
+            with self._lock:
+                self._pending.pop(name, None)
+            raise
+        finally:
+            tmp.unlink(missing_ok=True)
+
+        evicted: List[str] = []
+        with self._lock:
+            self._pending.pop(name, None)
+            self._cached[name] = self.listing[name].size
+            self.downloads += 1
+            total = sum(self._cached.values())
+            while total > self.max_bytes and len(self._cached) > 1:
+                old, size = self._cached.popitem(last=False)
+                evicted.append(old)
+                total -= size
+            self.evictions += len(evicted)
+        for old in evicted:
+            # Anything still playing the file keeps its open handle
+            (self.root / old).unlink(missing_ok=True)
+        self._save_state()
+        return path
+
+    def _submit(self, name: str) -> Future[Path] | None:
+        with self._lock:
+            if name in self._cached:
+                return None
+            future = self._pending.get(name)
+            if future is None:
+                future = self._pending[name] = self._pool.submit(self._download, name)
+        return future
+
+    def fetch(self, path: Path) -> Path | None:
+        local = self.local_path(path)
+        if local is not None:
+            return local
+        name = self._name(path)
+        if name is None:
+            return None
+        future = self._submit(name)
+        if future is None:
+            # downloaded since the check above
+            return path
+        return future.result()
+
+    def prefetch(self, paths: Iterable[Path]) -> None:
+        """Start downloading files, as many as fit in the cache"""
+        budget = self.max_bytes
+        for path in dict.fromkeys(paths):
+            name = self._name(path)
+            if name is None:
+                continue
+            budget -= self.listing[name].size
+            if budget < 0:
+                break
+            future = self._submit(name)
+            if future is not None:
+                future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: Future[Path]) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            _log.warning("Failed to prefetch a sound", exc_info=future.exception())
+
+    def open(self, path: Path) -> IO[bytes] | None:
+        local = self.fetch(path)
+        return None if local is None else open(local, "rb")
+
+    def close(self) -> None:
+        # shutdown(cancel_futures=True) needs Python 3.9, so cancel by hand;
+        # downloads which have already started are left to finish
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for future in pending:
+            future.cancel()
+        self._pool.shutdown(wait=True)
+
+
+class SoundHandle(NamedTuple):
+    """A sound file picked from a ResolvedSound, which can be opened from its storage
+
+    .. autoattribute:: path
+    .. autoattribute:: storage
+
+    .. automethod:: open
+    .. automethod:: local_path
+    .. automethod:: fetch
+    """
+
+    path: Path
+    """The resolved path of the file"""
+    storage: Storage | None = None
+    """Where the file is kept, or None if it is a local file"""
+
+    def open(self) -> IO[bytes] | None:
+        """Open the file"""
+        if self.storage is None:
+            return open(self.path, "rb")
+        return self.storage.open(self.path)
+
+    def local_path(self) -> Path | None:
+        """Get a local file with the contents, without blocking"""
+        if self.storage is None:
+            return self.path
+        return self.storage.local_path(self.path)
+
+    def fetch(self) -> Path | None:
+        """Get a local file with the contents, fetching it if needed"""
+        if self.storage is None:
+            return self.path
+        return self.storage.fetch(self.path)
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+__all__ = [
+    "TranscodeCache",
+    "file_digest",
+    "opus_transcode_args",
+    "volume_filter",
+]
+
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Tuple
+
+if TYPE_CHECKING:
+    from .loudness import LoudnessCache
+
+_log = logging.getLogger(__name__)
+
+TRANSCODE_VERSION = 1
+"""Bumped whenever the transcode arguments change, to invalidate old renditions"""
+
+_CHUNK_SIZE = 1 << 16
+
+
+def file_digest(path: Path) -> str:
+    """Get the SHA-256 hex digest of the contents of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def opus_transcode_args(
+    source: str,
+    dest: str,
+    *,
+    executable: str = "ffmpeg",
+    bitrate: int = 128,
+    gain: float | None = None,
+) -> List[str]:
+    """Get the arguments to transcode source into 48kHz stereo Ogg Opus at dest
+
+    The output uses 20ms frames, which is the frame length Discord expects. If
+    a gain in dB is given, the volume is adjusted by it.
+    """
+    args = [
+        executable,
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        source,
+        "-vn",
+        "-map_metadata",
+        "-1",
+        "-c:a",
+        "libopus",
+        "-b:a",
+        f"{bitrate}k",
+        "-ar",
+        "48000",
+        "-ac",
+        "2",
+        "-frame_duration",
+        "20",
+        "-f",
+        "opus",
+        dest,
+    ]
+    if gain:
+        args[args.index("-c:a") : args.index("-c:a")] = ["-af", volume_filter(gain)]
+    return args
+
+
+def volume_filter(gain: float) -> str:
+    """Get the ffmpeg audio filter which adjusts the volume by gain dB"""
+    return f"volume={gain:.1f}dB"
+
+
+class _Stamp(NamedTuple):
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, path: Path) -> _Stamp:
+        st = path.stat()
+        return cls(st.st_size, st.st_mtime_ns)
+
+
+class TranscodeCache:
+    """An on-disk cache of Ogg Opus renditions of sound files
+
+    Renditions are keyed by a hash of the source file's contents, so renamed or
+    duplicated files share one rendition. Each rendition is 48kHz stereo Opus in
+    20ms frames, so it can be streamed to Discord without re-encoding.
+
+    If a loudness cache is given, files are measured before they are
+    transcoded, and each rendition has the file's gain baked in.
+
+    .. autoattribute:: directory
+
+    .. automethod:: get
+    .. automethod:: fill_one
+    .. automethod:: fill
+    .. automethod:: fill_in_background
+    """
+
+    directory: Path
+    """The folder the renditions are stored in"""
+
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        executable: str = "ffmpeg",
+        bitrate: int = 128,
+        workers: int | None = None,
+        loudness: LoudnessCache | None = None,
+    ) -> None:
+        self.directory = directory
+        self.executable = executable
+        self.bitrate = bitrate
+        self.workers = workers
+        self.loudness = loudness
+
+        self._lock = threading.Lock()
+        self._renditions: Dict[Path, Tuple[_Stamp, Path]] = {}
+
+    def _rendition_path(self, digest: str, gain: float | None = None) -> Path:
+        name = f"{digest}-v{TRANSCODE_VERSION}-{self.bitrate}k"
+        if gain:
+            name += f"{gain:+.1f}dB"
+        return self.directory / digest[:2] / f"{name}.opus"
+
+    def get(self, path: Path) -> Path | None:
+        """Get the rendition of a file, if it has already been transcoded
+
+        This never hashes or transcodes the file, so is cheap enough to call when
+        playing a sound. If the file has changed since it was transcoded, None is
+        returned until it is next filled.
+        """
+        with self._lock:
+            entry = self._renditions.get(path)
+        if entry is None:
+            return None
+
+        stamp, rendition = entry
+        try:
+            if _Stamp.of(path) != stamp or not rendition.exists():
+                return None
+        except OSError:
+            return None
+        return rendition
+
+    def _transcode(self, source: Path, dest: Path, gain: float | None) -> None:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}")
+        args = opus_transcode_args(
+            str(source),
+            str(tmp),
+            executable=self.executable,
+            bitrate=self.bitrate,
+            gain=gain,
+        )
+        try:
+            subprocess.run(args, check=True, stdin=subprocess.DEVNULL)
+            os.replace(tmp, dest)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def fill_one(self, path: Path) -> Path | None:
+        """Transcode a single file into the cache, if it is not already present"""
+        gain = None
+        if self.loudness is not None:
+            loudness = self.loudness.measure(path)
+            if loudness is not None:
+                gain = loudness.gain(self.loudness.target)
+        try:
+            stamp = _Stamp.of(path)
+            rendition = self._rendition_path(file_digest(path), gain)
+            if not rendition.exists():
+                self._transcode(path, rendition, gain)
+        except (OSError, subprocess.SubprocessError):
+            _log.exception("Failed to transcode %s", path)
+            return None
+
+        with self._lock:
+            self._renditions[path] = (stamp, rendition)
+        return rendition
+
+    def fill(self, paths: Iterable[Path]) -> None:
+        """Transcode every file in paths which is not already in the cache"""
+        unique = list(dict.fromkeys(paths))
+        if self.loudness is not None:
+            # Measure in a process pool first, rather than one at a time
+            self.loudness.fill(unique)
+        with ThreadPoolExecutor(self.workers) as pool:
+            for _ in pool.map(self.fill_one, unique):
+                pass
+
+    def fill_in_background(self, paths: Iterable[Path]) -> threading.Thread:
+        """Run :meth:`fill` in a daemon thread, returning the started thread"""
+        thread = threading.Thread(
+            target=self.fill, args=(list(paths),), name="wowbot-transcode", daemon=True
+        )
+        thread.start()
+        return thread
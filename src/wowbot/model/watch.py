@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+__all__ = [
+    "SoundsDirWatcher",
+]
+
+import logging
+import threading
+import time
+from typing import Callable
+
+from .sound import SoundCollection
+from .soundsdir import SoundsDir
+
+_log = logging.getLogger(__name__)
+
+
+class SoundsDirWatcher:
+    """Polls a sounds folder for changes, and reloads it in a background thread
+
+    Every :code:`interval` seconds, :meth:`SoundsDir.reload` is called, which
+    only stats the JSON files and the folders which were searched for sound
+    files. When something has changed, :code:`on_reload` is called from the
+    watcher's thread. If the folder has become invalid, or :code:`check` rejects
+    the new sounds, the error is logged, the previous sounds are kept, and the
+    next poll tries again.
+
+    .. autoattribute:: soundsdir
+    .. autoattribute:: interval
+    .. autoattribute:: reloads
+    .. autoattribute:: failures
+    .. autoattribute:: last_poll_seconds
+    .. autoattribute:: last_reload_seconds
+
+    .. automethod:: start
+    .. automethod:: stop
+    .. automethod:: poll
+    """
+
+    soundsdir: SoundsDir
+    """The folder being watched"""
+    interval: float
+    """The number of seconds between polls"""
+    reloads: int
+    """The number of polls which found a change"""
+    failures: int
+    """The number of polls which failed"""
+    last_poll_seconds: float | None
+    """How long the last successful poll took"""
+    last_reload_seconds: float | None
+    """How long the last poll which found a change took"""
+
+    def __init__(
+        self,
+        soundsdir: SoundsDir,
+        on_reload: Callable[[SoundsDir], object],
+        *,
+        interval: float = 2.0,
+        jobs: int = 1,
+        check: Callable[[SoundCollection], object] | None = None,
+    ) -> None:
+        self.soundsdir = soundsdir
+        self.on_reload = on_reload
+        self.check = check
+        self.interval = interval
+        self.jobs = jobs
+        self.reloads = 0
+        self.failures = 0
+        self.last_poll_seconds = None
+        self.last_reload_seconds = None
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def poll(self) -> bool:
+        """Reload the folder once, returning whether it changed"""
+        began = time.perf_counter()
+        try:
+            changed = self.soundsdir.reload(jobs=self.jobs, check=self.check)
+        except Exception:
+            self.failures += 1
+            _log.exception("Failed to reload %s", self.soundsdir.sounds_root)
+            return False
+        self.last_poll_seconds = time.perf_counter() - began
+        if changed:
+            self.reloads += 1
+            self.last_reload_seconds = self.last_poll_seconds
+            self.on_reload(self.soundsdir)
+        return changed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self) -> None:
+        """Start polling in a daemon thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="wowbot-watch", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop polling, waiting for a reload in progress to finish"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
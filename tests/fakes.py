@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from itertools import count
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+from discord import AudioSource, Bot, Member, VoiceClient
+
+
+def _normalise(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Discord leaves out options' false and empty fields when returning commands
+    payload = dict(payload)
+    if "options" in payload:
+        payload["options"] = [
+            {
+                key: value
+                for key, value in _normalise(option).items()
+                if not (key in ("autocomplete", "choices") and not value)
+            }
+            for option in payload["options"]
+        ]
+    return payload
+
+
+class FakeHTTP:
+    """An offline stand-in for the application command routes of the HTTP API
+
+    Commands are kept in memory, and every call is recorded in :code:`calls` as
+    the method name and its arguments, so tests can check what would have been
+    sent to Discord.
+    """
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.commands: Dict[str, Dict[str, Any]] = {}
+        self._ids = count(1000)
+
+    def _store(self, application_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+        existing = next(
+            (cmd for cmd in self.commands.values() if cmd["name"] == payload["name"]),
+            None,
+        )
+        command_id = str(next(self._ids)) if existing is None else existing["id"]
+        command = {
+            "type": 1,
+            **_normalise(payload),
+            "id": command_id,
+            "application_id": str(application_id),
+            "version": str(next(self._ids)),
+        }
+        self.commands[command_id] = command
+        return command
+
+    async def get_global_commands(self, application_id: int) -> List[Dict[str, Any]]:
+        self.calls.append(("get_global_commands", (application_id,)))
+        return list(self.commands.values())
+
+    async def bulk_upsert_global_commands(
+        self, application_id: int, payload: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        self.calls.append(("bulk_upsert_global_commands", (application_id, payload)))
+        names = {cmd["name"] for cmd in payload}
+        for command_id, cmd in list(self.commands.items()):
+            if cmd["name"] not in names:
+                del self.commands[command_id]
+        return [self._store(application_id, cmd) for cmd in payload]
+
+    async def upsert_global_command(
+        self, application_id: int, payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        self.calls.append(("upsert_global_command", (application_id, payload)))
+        return self._store(application_id, payload)
+
+    async def edit_global_command(
+        self, application_id: int, command_id: str, payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        self.calls.append(
+            ("edit_global_command", (application_id, command_id, payload))
+        )
+        return self._store(application_id, payload)
+
+    async def delete_global_command(self, application_id: int, command_id: str) -> None:
+        self.calls.append(("delete_global_command", (application_id, command_id)))
+        del self.commands[command_id]
+
+
+def attach_fake_http(bot: Bot, application_id: int = 1) -> FakeHTTP:
+    """Replace a bot's HTTP client with a FakeHTTP, as if it had logged in"""
+    http = FakeHTTP()
+    bot.http = http  # type: ignore
+    bot._connection.user = SimpleNamespace(id=application_id)  # type: ignore
+    return http
+
+
+class FakeVoiceClient(VoiceClient):
+    """A voice client which records what it is asked to do, without a connection
+
+    Sources are never read; a source plays until :meth:`stop` or :meth:`finish`
+    is called.
+    """
+
+    def __init__(self, channel: FakeChannel) -> None:
+        self.channel = channel  # type: ignore
+        self.connected = True
+        self.playing: AudioSource | None = None
+        self.played: List[AudioSource] = []
+        self.moves = 0
+        self._after: Callable[[Exception | None], Any] | None = None
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def is_playing(self) -> bool:
+        return self.playing is not None
+
+    def is_paused(self) -> bool:
+        return False
+
+    async def move_to(self, channel: FakeChannel) -> None:  # type: ignore[override]
+        self.channel = channel  # type: ignore
+        self.moves += 1
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+        self.connected = False
+        guild = self.channel.guild
+        if guild.voice_client is self:
+            guild.voice_client = None
+
+    def play(  # type: ignore[override]
+        self,
+        source: AudioSource,
+        *,
+        after: Callable[[Exception | None], Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        self.playing = source
+        self.played.append(source)
+        self._after = after
+
+    def finish(self) -> None:
+        """End the current source, as if it had played to the end"""
+        source, after = self.playing, self._after
+        self.playing = None
+        self._after = None
+        if source is not None:
+            source.cleanup()
+            if after is not None:
+                after(None)
+
+    def stop(self) -> None:
+        self.finish()
+
+
+class RecordingVoiceClient(FakeVoiceClient):
+    """A fake voice client which reads its sources, like Discord's audio player
+
+    Each source is read in a thread, one packet every 20ms (or as fast as it
+    can be if paced is false), and its packets are counted rather than sent.
+    on_first_packet is called from that thread with each source and the
+    :func:`time.perf_counter` time of its first packet.
+    """
+
+    def __init__(
+        self,
+        channel: FakeChannel,
+        *,
+        paced: bool = True,
+        on_first_packet: Callable[[AudioSource, float], Any] | None = None,
+    ) -> None:
+        super().__init__(channel)
+        self.paced = paced
+        self.on_first_packet = on_first_packet
+        self.packets = 0
+        self.packet_bytes = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def play(  # type: ignore[override]
+        self,
+        source: AudioSource,
+        *,
+        after: Callable[[Exception | None], Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super().play(source, after=after)
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._read, args=(source, self._stopped, after), daemon=True
+        ).start()
+
+    def _read(
+        self,
+        source: AudioSource,
+        stopped: threading.Event,
+        after: Callable[[Exception | None], Any] | None,
+    ) -> None:
+        error: Exception | None = None
+        first = True
+        next_packet = time.perf_counter()
+        try:
+            while not stopped.is_set():
+                packet = source.read()
+                if not packet:
+                    break
+                if first and self.on_first_packet is not None:
+                    self.on_first_packet(source, time.perf_counter())
+                first = False
+                with self._lock:
+                    self.packets += 1
+                    self.packet_bytes += len(packet)
+                if self.paced:
+                    next_packet += 0.02
+                    stopped.wait(max(0.0, next_packet - time.perf_counter()))
+        except Exception as ex:
+            error = ex
+        finally:
+            source.cleanup()
+        if not stopped.is_set():
+            if self.playing is source:
+                self.playing = None
+                self._after = None
+            if after is not None:
+                after(error)
+
+    def finish(self) -> None:
+        """End the current source; the reading thread cleans it up"""
+        self._stopped.set()
+        self.playing = None
+        self._after = None
+
+
+class FakeGuild:
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.voice_client: FakeVoiceClient | None = None
+
+
+class FakeChannel:
+    """A voice channel which connects instantly, or after connect_delay seconds
+
+    Connecting makes a voice client with voice_client_factory, which is
+    :class:`FakeVoiceClient` by default.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        guild: FakeGuild,
+        connect_delay: float = 0.0,
+        voice_client_factory: Callable[[FakeChannel], FakeVoiceClient] = (
+            FakeVoiceClient
+        ),
+    ) -> None:
+        self.id = id
+        self.name = f"channel-{id}"
+        self.guild = guild
+        self.connect_delay = connect_delay
+        self.voice_client_factory = voice_client_factory
+        self.connects = 0
+
+    async def connect(self) -> FakeVoiceClient:
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+        self.connects += 1
+        self.guild.voice_client = self.voice_client_factory(self)
+        return self.guild.voice_client
+
+
+class FakeMember(Member):
+    """A guild member who is in a voice channel, or in none if channel is None"""
+
+    def __init__(self, id: int, guild: FakeGuild, channel: FakeChannel | None):
+        self._fake_id = id
+        self.guild = guild  # type: ignore
+        self.channel = channel
+
+    @property
+    def id(self) -> int:  # type: ignore[override]
+        return self._fake_id
+
+    @property
+    def voice(self) -> SimpleNamespace | None:  # type: ignore[override]
+        if self.channel is None:
+            return None
+        return SimpleNamespace(channel=self.channel)
+
+
+class FakeContext:
+    """An application command invocation, as the cog's callbacks see it
+
+    Responses are recorded in :code:`responses` instead of being sent.
+    """
+
+    def __init__(self, command_name: str, author: FakeMember) -> None:
+        self.command = SimpleNamespace(name=command_name)
+        self.author = author
+        self.guild = author.guild
+        self.responses: List[Tuple[Tuple[Any, ...], Dict[str, Any]]] = []
+
+    async def send_response(self, *args: Any, **kwargs: Any) -> None:
+        self.responses.append((args, kwargs))
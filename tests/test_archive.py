@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import io
+import json
+import shutil
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+import pytest
+
+from wowbot.discord.ffmpegpool import FFmpegWorkerPool, PooledOpusAudio
+from wowbot.discord.framecache import iter_opus_frames
+from wowbot.discord.sound import OggOpusAudio, SoundPlayer
+from wowbot.model.archive import Archive
+from wowbot.model.sound import (
+    BaseModelError,
+    ErrorCollection,
+    ResolvedSound,
+    SoundsJson,
+)
+from wowbot.model.soundsdir import SOUNDS_FILE, SoundsDir
+
+from .test_ffmpegpool import CAT, wait_for_idle
+from .test_oggopus import FRAMES, ogg_opus
+
+ROOT = Path("tests/sounds")
+
+
+def make_zip(folder: Path, out: Path, compression: int) -> Path:
+    with zipfile.ZipFile(out, "w", compression) as zf:
+        for path in sorted(folder.rglob("*")):
+            zf.write(path, path.relative_to(folder).as_posix())
+    return out
+
+
+def make_tar(folder: Path, out: Path, mode: str) -> Path:
+    with tarfile.open(out, mode) as tf:
+        tf.add(folder, ".")
+    return out
+
+
+ARCHIVES: Dict[str, Callable[[Path, Path], Path]] = {
+    "stored.zip": lambda f, o: make_zip(f, o, zipfile.ZIP_STORED),
+    "deflated.zip": lambda f, o: make_zip(f, o, zipfile.ZIP_DEFLATED),
+    "plain.tar": lambda f, o: make_tar(f, o, "w"),
+    "compressed.tar.gz": lambda f, o: make_tar(f, o, "w:gz"),
+}
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "sounds"
+    shutil.copytree(ROOT, folder)
+    for index, path in enumerate(sorted(folder.glob("*.opus"))):
+        path.write_bytes(ogg_opus([bytes([index]) * 20]))
+    return folder
+
+
+@pytest.fixture(params=list(ARCHIVES))
+def archive_path(request, folder: Path, tmp_path: Path) -> Path:
+    return ARCHIVES[request.param](folder, tmp_path / request.param)
+
+
+def errors_of(call: Callable[[], Any]) -> list:
+    with pytest.raises(BaseModelError) as exc_info:
+        call()
+    err = exc_info.value
+    errors = err.errors if isinstance(err, ErrorCollection) else (err,)
+    return [(type(e), getattr(e, "context")) for e in errors]
+
+
+class TestArchive:
+    def test_mount(self, folder: Path, archive_path: Path):
+        original = SoundsDir.from_folder(folder, use_snapshot=False)
+        mounted = SoundsDir.from_folder(archive_path)
+        assert mounted.archive is not None
+        with mounted.archive as archive:
+            assert mounted.sound_collection.keys() == original.sound_collection.keys()
+            for name, sound in original.sound_collection.items():
+                # Globs match in directory order, which differs between the two
+                files = sorted(mounted.sound_collection[name].files())
+                assert [p.relative_to(archive_path) for p in files] == [
+                    p.relative_to(folder) for p in sorted(sound.files())
+                ]
+                for source, path in zip(sorted(sound.files()), files):
+                    assert archive.read(path) == source.read_bytes()
+                    f = archive.open(path)
+                    assert f is not None
+                    with f:
+                        assert f.read() == source.read_bytes()
+
+            assert mounted.commands_json == original.commands_json
+            assert not mounted.reload()
+
+    def test_mapped_members(self, folder: Path, tmp_path: Path):
+        for name, mapped in [
+            ("stored.zip", True),
+            ("deflated.zip", False),
+            ("plain.tar", True),
+            ("compressed.tar.gz", False),
+        ]:
+            path = ARCHIVES[name](folder, tmp_path / name)
+            with Archive(path) as archive:
+                found = archive.member_range(path / "example3.opus")
+                assert (found is not None) == mapped
+                if found is not None:
+                    assert archive.mmap is not None
+                    start, stop = found
+                    expected = (folder / "example3.opus").read_bytes()
+                    assert archive.mmap[start:stop] == expected
+                assert archive.member_range(path / "missing.opus") is None
+                assert archive.read(path / "missing.opus") is None
+
+    def test_not_an_archive(self, tmp_path: Path):
+        path = tmp_path / "sounds.txt"
+        path.write_text("not an archive")
+        with pytest.raises(ValueError):
+            Archive(path)
+
+    def test_errors_match_folder(self, folder: Path, archive_path: Path):
+        data = {
+            "version": 1,
+            "sounds": [
+                {"name": "s.a", "files": ["example1.opus", "missing.opus"]},
+                {"name": "s.b", "files": [{"glob": "missing-*.opus"}]},
+                {"name": "s.c", "files": [{"filenames": ["x/missing.opus"]}]},
+            ],
+        }
+        (folder / SOUNDS_FILE).write_text(json.dumps(data))
+        archive_path = ARCHIVES[archive_path.name](folder, archive_path)
+        sj = SoundsJson.model_validate(data)
+
+        expected = errors_of(lambda: sj.resolve_files(folder))
+        assert len(expected) == 3
+        with Archive(archive_path) as archive:
+            index = archive.index()
+            assert errors_of(lambda: sj.resolve_files(archive_path, index)) == expected
+
+
+class TestArchivePlayer:
+    def get_source(self, player: SoundPlayer, path: Path):
+        sound = ResolvedSound(
+            name="s.example", filegroups=[[path / "example1.opus"]], groupweights=[1]
+        )
+        return asyncio.run(player.get_source(sound))
+
+    def test_plays_native_members_from_mapping(self, folder: Path, tmp_path: Path):
+        path = make_tar(folder, tmp_path / "sounds.tar", "w")
+        with Archive(path) as archive:
+            source = self.get_source(SoundPlayer(archive=archive), path)
+            assert isinstance(source, OggOpusAudio)
+            assert source.read() == bytes([0xFC]) + bytes([0]) * 20
+            source.cleanup()
+
+    def test_pipes_other_members(self, folder: Path, tmp_path: Path):
+        # 60ms frames need transcoding
+        data = ogg_opus(FRAMES, toc=0x18)
+        (folder / "example1.opus").write_bytes(data)
+        path = make_zip(folder, tmp_path / "sounds.zip", zipfile.ZIP_STORED)
+
+        pool = FFmpegWorkerPool(1, args=CAT)
+        try:
+            wait_for_idle(pool, 1)
+            with Archive(path) as archive:
+                source = self.get_source(
+                    SoundPlayer(archive=archive, ffmpeg_pool=pool), path
+                )
+                assert isinstance(source, PooledOpusAudio)
+                frames = []
+                while frame := source.read():
+                    frames.append(frame)
+                source.cleanup()
+                assert frames == list(iter_opus_frames(io.BytesIO(data)))
+        finally:
+            pool.close()
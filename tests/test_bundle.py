@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+from wowbot.discord.sound import OggOpusAudio
+from wowbot.model.bundle import Bundle, build_bundle, iter_sources
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE, SoundsDir
+
+from .test_oggopus import FRAMES, ogg_opus
+
+# Stands in for ffmpeg: the test files are already Ogg Opus, so copying the
+# input to stdout gives the same stream ffmpeg would
+FAKE_FFMPEG = f"""#!{sys.executable}
+import shutil, sys
+with open(sys.argv[sys.argv.index("-i") + 1], "rb") as f:
+    shutil.copyfileobj(f, sys.stdout.buffer)
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path: Path) -> str:
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG)
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "sounds"
+    shutil.copytree("tests/sounds", folder)
+    for index, path in enumerate(sorted(folder.glob("*.opus"))):
+        # example1 and example2 have the same contents
+        path.write_bytes(ogg_opus([bytes([max(index, 1)]) * 20]))
+    return folder
+
+
+def build(folder: Path, out: Path, ffmpeg: str):
+    sd = SoundsDir.from_folder(folder, use_snapshot=False)
+    return build_bundle(
+        out,
+        iter_sources(folder, sd.files()),
+        (folder / SOUNDS_FILE).read_text(),
+        (folder / COMMANDS_FILE).read_text(),
+        jobs=2,
+        executable=ffmpeg,
+    )
+
+
+class TestBundle:
+    def test_build_and_mount(self, folder: Path, tmp_path: Path, ffmpeg: str):
+        out = tmp_path / "sounds.wowbot"
+        assert build(folder, out, ffmpeg) == {
+            "files": 8,
+            "objects": 7,
+            "transcoded": 7,
+        }
+
+        original = SoundsDir.from_folder(folder, use_snapshot=False)
+        mounted = SoundsDir.from_folder(out)
+        try:
+            assert mounted.archive is not None
+            assert mounted.sound_collection.keys() == original.sound_collection.keys()
+            for name, sound in original.sound_collection.items():
+                bundled = mounted.sound_collection[name]
+                assert bundled.groupweights == sound.groupweights
+                assert [p.relative_to(out) for p in bundled.files()] == [
+                    p.relative_to(folder) for p in sound.files()
+                ]
+                for source, path in zip(sound.files(), bundled.files()):
+                    assert mounted.archive.read(path) == source.read_bytes()
+
+            assert mounted.commands_json == original.commands_json
+            assert not mounted.reload()
+        finally:
+            if mounted.archive is not None:
+                mounted.archive.close()
+
+    def test_incremental(self, folder: Path, tmp_path: Path, ffmpeg: str):
+        out = tmp_path / "sounds.wowbot"
+        build(folder, out, ffmpeg)
+        assert build(folder, out, ffmpeg)["transcoded"] == 0
+
+        changed = folder / "mysound-a.opus"
+        changed.write_bytes(ogg_opus(FRAMES[::-1]))
+        st = changed.stat()
+        os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert build(folder, out, ffmpeg)["transcoded"] == 1
+
+        with Bundle(out) as bundle:
+            assert bundle.read(out / "mysound-a.opus") == changed.read_bytes()
+
+    def test_play_from_bundle(self, folder: Path, tmp_path: Path, ffmpeg: str):
+        out = tmp_path / "sounds.wowbot"
+        build(folder, out, ffmpeg)
+
+        with Bundle(out) as bundle:
+            found = bundle.member_range(out / "mysound2-y.opus")
+            assert found is not None
+            source = OggOpusAudio.from_range(bundle.mmap, *found)
+            frames = []
+            while frame := source.read():
+                frames.append(frame[1:])
+            source.cleanup()
+            assert frames == [b"\x07" * 20]
+
+            assert bundle.member_range(out / "missing.opus") is None
+            assert bundle.member_range(folder / "mysound2-y.opus") is None
+
+    def test_sources_outside_root(self, folder: Path, tmp_path: Path):
+        with pytest.raises(ValueError):
+            iter_sources(folder, [tmp_path / "elsewhere.opus"])
@@ -1,6 +1,9 @@
+import json
 from pathlib import Path
 
-from wowbot.model.main import app
+import pytest
+
+from wowbot.model.main import app, percentile
 
 
 class TestCliSounds:
@@ -15,3 +18,31 @@ class TestCliSounds:
             exit_code = 0
 
         assert exit_code == 0
+
+    def test_bench_json(self, capsys):
+        try:
+            app(["bench", str(self.ROOT), "--json", "-r", "3", "-n", "100"])
+        except SystemExit as ex:
+            assert ex.code == 0
+
+        results = json.loads(capsys.readouterr().out)
+        assert results["repeat"] == 3
+        stages = results["stages"]
+        assert list(stages) == [
+            "read",
+            "validate_json",
+            "index",
+            "resolve",
+            "glob",
+            "check",
+            "sample",
+        ]
+        for stage in stages.values():
+            assert stage["min"] <= stage["p50"] <= stage["p99"] <= stage["max"]
+        assert results["samples_per_second"] > 0
+
+    def test_percentile(self):
+        assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+        assert percentile([1.0, 2.0], 50) == 1.5
+        assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 99) == pytest.approx(4.96)
+        assert percentile([7.0], 90) == 7.0
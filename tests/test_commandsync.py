@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from discord import Bot
+
+from wowbot.discord.commandsync import CommandSyncState, sync_commands
+from wowbot.discord.slash import make_cog
+from wowbot.model.command import CommandsJson, SoundCommand
+from wowbot.model.soundsdir import SoundsDir
+
+from .fakes import FakeHTTP, attach_fake_http
+
+ROOT = Path("tests/sounds")
+
+
+def start_bot(
+    state: Path,
+    http: FakeHTTP | None = None,
+    edit: Callable[[CommandsJson], None] | None = None,
+) -> Tuple[Bot, FakeHTTP]:
+    soundsdir = SoundsDir.from_folder(ROOT, use_snapshot=False)
+    if edit is not None:
+        edit(soundsdir.commands_json)
+
+    async def start() -> Tuple[Bot, FakeHTTP]:
+        bot = Bot(auto_sync_commands=False)
+        bot.add_cog(make_cog(soundsdir))
+        fake = attach_fake_http(bot)
+        if http is not None:
+            bot.http = http  # type: ignore
+            fake = http
+        await sync_commands(bot, state)
+        return bot, fake
+
+    return asyncio.run(start())
+
+
+def call_names(http: FakeHTTP) -> List[str]:
+    return [name for name, _ in http.calls]
+
+
+class TestSyncCommands:
+    def test_first_sync(self, tmp_path: Path):
+        state = tmp_path / "sync.json"
+        bot, http = start_bot(state)
+
+        assert call_names(http) == [
+            "get_global_commands",
+            "bulk_upsert_global_commands",
+        ]
+        assert len(http.commands) == 3
+        assert all(cmd.id is not None for cmd in bot.pending_application_commands)
+        assert CommandSyncState.load(state).commands.keys() == {
+            "mycommand",
+            "command2",
+            "mytoplevelcommand",
+        }
+
+    def test_unchanged_skips_sync(self, tmp_path: Path):
+        state = tmp_path / "sync.json"
+        first, http = start_bot(state)
+        http.calls.clear()
+
+        bot, _ = start_bot(state, http)
+        assert http.calls == []
+        assert {cmd.name: cmd.id for cmd in bot.pending_application_commands} == {
+            cmd.name: cmd.id for cmd in first.pending_application_commands
+        }
+        for cmd in bot.pending_application_commands:
+            assert bot._application_commands[cmd.id] is cmd
+
+    def test_only_changed_registered(self, tmp_path: Path):
+        state = tmp_path / "sync.json"
+        _, http = start_bot(state)
+        ids = {
+            name: cmd["id"]
+            for name, cmd in CommandSyncState.load(state).commands.items()
+        }
+        http.calls.clear()
+
+        def edit(commands_json: CommandsJson) -> None:
+            commands_json.commands[0] = SoundCommand(name="renamed", sound="s.example")
+            del commands_json.commands[1]
+
+        bot, _ = start_bot(state, http, edit)
+        assert http.calls == [
+            (
+                "upsert_global_command",
+                (1, bot.pending_application_commands[0].to_dict()),
+            ),
+            ("delete_global_command", (1, ids["mycommand"])),
+            ("delete_global_command", (1, ids["command2"])),
+        ]
+        assert sorted(cmd["name"] for cmd in http.commands.values()) == [
+            "mytoplevelcommand",
+            "renamed",
+        ]
+
+        http.calls.clear()
+        start_bot(state, http, edit)
+        assert http.calls == []
+
+    def test_other_application(self, tmp_path: Path):
+        state = tmp_path / "sync.json"
+        _, http = start_bot(state)
+        data = CommandSyncState.load(state)
+        data.application_id = 2
+        data.save(state)
+        http.calls.clear()
+
+        # py-cord compares every command against Discord, then syncs in bulk
+        start_bot(state, http)
+        assert call_names(http) == [
+            "get_global_commands",
+            "bulk_upsert_global_commands",
+        ]
+        assert CommandSyncState.load(state).application_id == 1
@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import io
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from wowbot.discord.ffmpegpool import FFmpegWorkerPool, pipe_transcode_args
+
+from .test_oggopus import CELT_20MS, FRAMES, OPUS_HEAD, OPUS_TAGS, ogg_opus, ogg_page
+
+# Stands in for ffmpeg: the test files are already Ogg Opus, so copying stdin to
+# stdout gives the same stream ffmpeg would
+CAT = [
+    sys.executable,
+    "-c",
+    "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)",
+]
+
+# Enough pages to fill the pipes, so writing and reading have to take turns
+LONG_FRAMES = [bytes([i % 256]) * 1000 for i in range(200)]
+
+
+def long_ogg_opus(frames: List[bytes]) -> bytes:
+    pages = [ogg_page([OPUS_HEAD]), ogg_page([OPUS_TAGS], sequence=1)]
+    for start in range(0, len(frames), 50):
+        packets = [bytes([CELT_20MS]) + frame for frame in frames[start : start + 50]]
+        pages.append(ogg_page(packets, sequence=2 + start // 50))
+    return b"".join(pages)
+
+
+@pytest.fixture
+def sound(tmp_path: Path) -> Path:
+    path = tmp_path / "sound.opus"
+    path.write_bytes(ogg_opus(FRAMES))
+    return path
+
+
+def wait_for_idle(pool: FFmpegWorkerPool, count: int) -> None:
+    deadline = time.monotonic() + 10
+    while pool.stats()["idle"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def read_all(source) -> list:
+    frames = []
+    while frame := source.read():
+        frames.append(frame)
+    source.cleanup()
+    return frames
+
+
+class TestFFmpegWorkerPool:
+    def test_args(self):
+        args = pipe_transcode_args()
+        assert "-nostdin" not in args
+        assert args[args.index("-i") + 1] == "pipe:0"
+        assert args[-1] == "pipe:1"
+
+    def test_source_and_refill(self, sound: Path):
+        pool = FFmpegWorkerPool(3, args=CAT)
+        try:
+            wait_for_idle(pool, 3)
+            expected = [bytes([CELT_20MS]) + frame for frame in FRAMES]
+
+            assert read_all(pool.source(sound)) == expected
+            assert read_all(pool.source(sound.read_bytes())) == expected
+            assert read_all(pool.source(io.BytesIO(sound.read_bytes()))) == expected
+
+            wait_for_idle(pool, 3)
+            stats = pool.stats()
+            assert stats["taken"] == 3
+            assert stats["spawned"] == 6
+        finally:
+            pool.close()
+        assert pool.stats()["idle"] == 0
+
+    def test_long_source(self, tmp_path: Path):
+        path = tmp_path / "long.opus"
+        path.write_bytes(long_ogg_opus(LONG_FRAMES))
+        pool = FFmpegWorkerPool(1, args=CAT)
+        try:
+            wait_for_idle(pool, 1)
+            frames = read_all(pool.source(path))
+            assert frames == [bytes([CELT_20MS]) + frame for frame in LONG_FRAMES]
+        finally:
+            pool.close()
+
+    def test_empty_pool_misses(self, sound: Path):
+        pool = FFmpegWorkerPool(0, args=CAT)
+        try:
+            assert pool.source(sound) is None
+            assert pool.stats()["misses"] == 1
+        finally:
+            pool.close()
+
+    def test_recycle(self, sound: Path):
+        pool = FFmpegWorkerPool(1, args=CAT, max_age=0.05)
+        try:
+            wait_for_idle(pool, 1)
+            time.sleep(0.1)
+            source = pool.source(sound)
+            if source is not None:
+                # a replacement was spawned while sleeping; it must be fresh
+                read_all(source)
+            assert pool.stats()["recycled"] >= 1
+        finally:
+            pool.close()
@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+from pathlib import Path
+from typing import List
+
+from wowbot.discord.framecache import CachedOpusAudio, OpusFrameCache
+
+
+class TestOpusFrameCache:
+    @staticmethod
+    def make_files(root: Path, count: int) -> List[Path]:
+        paths = [root / f"sound{i}.opus" for i in range(count)]
+        for path in paths:
+            path.write_bytes(b"")
+        return paths
+
+    def test_hit_and_miss(self, tmp_path: Path):
+        (path,) = self.make_files(tmp_path, 1)
+        cache = OpusFrameCache(1000, admit_after=100)
+
+        assert cache.get(path) is None
+        assert cache.put(path, [b"a" * 10, b"b" * 10])
+        assert cache.get(path) == (b"a" * 10, b"b" * 10)
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+        assert cache.hit_rate == 0.5
+        assert cache.resident_bytes == 20
+
+    def test_lru_eviction(self, tmp_path: Path):
+        a, b, c = self.make_files(tmp_path, 3)
+        cache = OpusFrameCache(250, admit_after=100, max_entry_bytes=100)
+
+        cache.put(a, [b"a" * 100])
+        cache.put(b, [b"b" * 100])
+        assert cache.get(a) is not None  # b is now the least recently used
+        cache.put(c, [b"c" * 100])
+
+        assert cache.get(b) is None
+        assert cache.get(a) is not None
+        assert cache.get(c) is not None
+        assert cache.evictions == 1
+        assert cache.resident_bytes == 200
+
+    def test_oversized_entry_rejected(self, tmp_path: Path):
+        (path,) = self.make_files(tmp_path, 1)
+        cache = OpusFrameCache(1000, admit_after=100, max_entry_bytes=10)
+
+        assert not cache.put(path, [b"a" * 11])
+        assert cache.get(path) is None
+
+    def test_pinned_not_evicted(self, tmp_path: Path):
+        a, b = self.make_files(tmp_path, 2)
+        cache = OpusFrameCache(150, admit_after=100, max_entry_bytes=100)
+
+        cache.put(a, [b"a" * 100], pinned=True)
+        cache.put(b, [b"b" * 100])
+        assert cache.get(a) is not None
+        assert cache.get(b) is None
+
+        cache.unpin(a)
+        cache.put(b, [b"b" * 100])
+        assert cache.get(a) is None
+        assert cache.get(b) is not None
+
+    def test_changed_file_is_a_miss(self, tmp_path: Path):
+        (path,) = self.make_files(tmp_path, 1)
+        cache = OpusFrameCache(1000, admit_after=100)
+
+        cache.put(path, [b"a"])
+        path.write_bytes(b"changed")
+        assert cache.get(path) is None
+        assert cache.resident_bytes == 0
+
+    def test_play_counts_are_bounded(self, tmp_path: Path):
+        hot, *cold = self.make_files(tmp_path, 8)
+        cache = OpusFrameCache(1000, admit_after=100, max_tracked=4)
+
+        for _ in range(10):
+            cache.get(hot)
+        for path in cold:
+            cache.get(path)
+            assert cache.stats()["tracked"] <= 4
+        # files played once are forgotten, but the hot file is still counted
+        assert hot in cache._plays
+
+    def test_stored_file_is_not_counted(self, tmp_path: Path):
+        (path,) = self.make_files(tmp_path, 1)
+        cache = OpusFrameCache(1000, admit_after=100)
+
+        cache.get(path)
+        assert cache.stats()["tracked"] == 1
+        cache.put(path, [b"a"])
+        assert cache.stats()["tracked"] == 0
+
+
+def test_cached_audio_reads_frames():
+    source = CachedOpusAudio((b"one", b"two"))
+    assert source.is_opus()
+    assert [source.read(), source.read(), source.read()] == [b"one", b"two", b""]
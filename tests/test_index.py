@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import os
+from pathlib import Path
+
+import pytest
+
+from wowbot.model.index import DirectoryIndex
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    for name in [
+        "a.opus",
+        "b.opus",
+        ".hidden.opus",
+        "notes.txt",
+        "sub/c.opus",
+        "sub/d.wav",
+        "sub/deeper/e.opus",
+        "sub/deeper/f.opus",
+        "other/g.opus",
+        "other/sub/h.opus",
+    ]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    (tmp_path / "empty").mkdir()
+    if hasattr(os, "symlink"):
+        try:
+            (tmp_path / "link").symlink_to(tmp_path / "sub", target_is_directory=True)
+            (tmp_path / "loop").symlink_to(tmp_path, target_is_directory=True)
+            (tmp_path / "dangling.opus").symlink_to(tmp_path / "missing.opus")
+        except OSError:
+            pass  # symlinks need extra permissions on Windows
+    return tmp_path
+
+
+class TestDirectoryIndex:
+    PATTERNS = [
+        "*.opus",
+        "*",
+        "?.opus",
+        "[ab].opus",
+        "sub/*.opus",
+        "sub/*",
+        "*/*.opus",
+        "*/*/*.opus",
+        "**/*.opus",
+        "sub/**/*.opus",
+        "**/sub/*.opus",
+        "**/deeper",
+        "link/*.opus",
+        "loop/*.opus",
+        "loop/sub/*.opus",
+        "missing/*.opus",
+        "empty/*",
+        "a.opus",
+        "sub/c.opus",
+        "nothing-*.opus",
+        "sub/../*.opus",
+        "**",
+        "sub/",
+    ]
+
+    def test_glob_matches_pathlib(self, tree: Path):
+        index = DirectoryIndex(tree)
+        for pattern in self.PATTERNS:
+            assert index.glob(pattern) == list(tree.glob(pattern)), pattern
+
+    def test_parallel_scan_matches_pathlib(self, tree: Path):
+        index = DirectoryIndex(tree, jobs=4)
+        for pattern in self.PATTERNS:
+            assert index.glob(pattern) == list(tree.glob(pattern)), pattern
+
+    def test_exists_matches_pathlib(self, tree: Path):
+        index = DirectoryIndex(tree)
+        for name in [
+            "",
+            "a.opus",
+            "sub",
+            "sub/c.opus",
+            "sub/deeper/e.opus",
+            "link/c.opus",
+            "loop/a.opus",
+            "loop/loop/a.opus",
+            "dangling.opus",
+            "missing.opus",
+            "sub/missing.opus",
+            "a.opus/inside",
+            "sub/../a.opus",
+            "./a.opus",
+        ]:
+            assert index.exists(name) == (tree / name).exists(), name
+
+    def test_missing_root(self, tmp_path: Path):
+        index = DirectoryIndex(tmp_path / "missing")
+        assert not index.exists("a.opus")
+        assert index.glob("*.opus") == []
+
+    def test_index_is_not_rescanned(self, tree: Path):
+        index = DirectoryIndex(tree)
+        (tree / "new.opus").write_bytes(b"")
+        assert tree / "new.opus" not in index.glob("*.opus")
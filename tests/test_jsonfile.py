@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from pydantic import ValidationError
+
+from wowbot.model.command import ChoiceCommand, CommandsJson, SoundCommand
+from wowbot.model.jsonfile import JsonFiles, locate
+from wowbot.model.main import app
+from wowbot.model.sound import SoundsJson
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE
+
+
+class TestJsonFiles:
+    ROOT = Path("tests/sounds")
+
+    def test_validates_like_parsed(self):
+        files = JsonFiles(lambda name: (self.ROOT / name).read_bytes(), [SOUNDS_FILE])
+        with open(self.ROOT / SOUNDS_FILE) as f:
+            expected = SoundsJson.model_validate(json.load(f))
+        assert files.validate(SoundsJson, SOUNDS_FILE) == expected
+        with open(self.ROOT / COMMANDS_FILE) as f:
+            expected_commands = CommandsJson.model_validate(json.load(f))
+        assert files.validate(CommandsJson, COMMANDS_FILE) == expected_commands
+
+    def test_reads_concurrently(self):
+        release = threading.Event()
+        threads: Dict[str, int] = {}
+
+        def read(name: str) -> bytes:
+            threads[name] = threading.get_ident()
+            if name == "b":
+                release.wait(5)
+            return name.encode()
+
+        files = JsonFiles(read, ["a", "b", "c"])
+        # c is read while b is still being read
+        assert files.read("c") == b"c"
+        assert files.read("a") == b"a"
+        release.set()
+        assert files.read("b") == b"b"
+        assert threads["a"] == threading.get_ident()
+        assert len(set(threads.values())) == 3
+
+        serial = JsonFiles(read, ["a", "b"], concurrent=False)
+        assert serial.read("a") == b"a"
+        assert serial.read("b") == b"b"
+        assert threads["b"] == threads["a"] == threading.get_ident()
+
+    def test_read_errors(self):
+        def read(name: str) -> bytes:
+            raise FileNotFoundError(name)
+
+        files = JsonFiles(read, ["a", "b"])
+        for name in ["a", "b"]:
+            with pytest.raises(FileNotFoundError):
+                files.read(name)
+
+
+class TestLocate:
+    SOURCE = """{
+  "version": 1,
+  "sounds": [
+    {"name": "s.a", "files": ["a.opus"]},
+    {
+      "name": "s.é",
+      "files": [{"glob": "é*.opus", "weight": 0}],
+      "name": "s.b"
+    }
+  ]
+}
+"""
+
+    def test_paths(self):
+        assert locate(self.SOURCE, ()) == (1, 1)
+        assert locate(self.SOURCE, ("version",)) == (2, 14)
+        assert locate(self.SOURCE, ("sounds", 0, "files", 0)) == (4, 31)
+        # a later duplicate key is the one which is parsed
+        assert locate(self.SOURCE, ("sounds", 1, "name")) == (8, 15)
+
+    def test_union_members_are_skipped(self):
+        loc = ("sounds", 1, "files", 0, "GlobFile", "weight")
+        # columns count characters, not bytes
+        assert locate(self.SOURCE.encode(), loc) == (7, 47)
+
+    def test_missing_gives_parent(self):
+        assert locate(self.SOURCE, ("sounds", 0, "missing")) == (4, 5)
+        assert locate(self.SOURCE, ("sounds", 5)) == (3, 13)
+
+    def test_locates_validation_errors(self):
+        with pytest.raises(ValidationError) as excinfo:
+            SoundsJson.model_validate_json(self.SOURCE)
+        (error,) = excinfo.value.errors()
+        assert error["type"] == "greater_than"
+        assert locate(self.SOURCE, error["loc"]) == (7, 47)
+
+    def test_invalid(self):
+        assert locate('{"a": [1, 2,', ("a", 1)) is None
+        assert locate("", ("a",)) is None
+
+
+class TestTaggedUnions:
+    def test_one_member_is_validated(self):
+        data = {"version": 1, "commands": [{"name": "cmd", "choices": []}]}
+        with pytest.raises(ValidationError) as excinfo:
+            CommandsJson.model_validate_json(json.dumps(data))
+        assert [error["loc"] for error in excinfo.value.errors()] == [
+            ("commands", 0, "ChoiceCommand", "choices")
+        ]
+
+    def test_instances(self):
+        commands = [
+            SoundCommand(name="a", sound="s.a"),  # type: ignore
+            ChoiceCommand(
+                name="b", choices=[{"name": "b", "sound": "s.b"}]  # type: ignore
+            ),
+        ]
+        cj = CommandsJson(version=1, commands=commands)
+        assert cj.commands == commands
+
+        with pytest.raises(ValidationError) as excinfo:
+            CommandsJson.model_validate({"version": 1, "commands": ["cmd"]})
+        assert excinfo.value.errors()[0]["type"] == "model_type"
+
+
+class TestCheckErrors:
+    def test_positions(self, tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+        folder = tmp_path / "sounds"
+        shutil.copytree("tests/sounds", folder)
+        (folder / SOUNDS_FILE).write_text(TestLocate.SOURCE)
+        (folder / COMMANDS_FILE).write_text('{"version": 1,\n "commands": [,]}')
+
+        with pytest.raises(SystemExit) as excinfo:
+            app(["check", str(folder)])
+        assert excinfo.value.code == 1
+
+        out = capsys.readouterr().out
+        assert "GlobFile -> weight (line 7 column 47)" in out
+        # broken JSON is reported by where it broke
+        assert "Error parsing commands.json" in out
+        assert "Line 2 column 15" in out
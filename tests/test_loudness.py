@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import math
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from wowbot.discord.sound import OggOpusAudio, SoundPlayer
+from wowbot.model.loudness import Loudness, LoudnessCache, measure_loudness
+from wowbot.model.sound import ResolvedSound
+from wowbot.model.transcode import TranscodeCache, opus_transcode_args
+
+from .test_oggopus import ogg_opus
+
+# Stands in for ffmpeg: the loudness of a file is -18 LUFS less its last byte,
+# and transcoding copies the input. Every run is logged, one line each.
+FAKE_FFMPEG = f"""#!{sys.executable}
+import json, shutil, sys
+from pathlib import Path
+args = sys.argv[1:]
+source = args[args.index("-i") + 1]
+with open(Path(sys.argv[0]).with_name("ffmpeg.log"), "a") as f:
+    f.write(" ".join(args) + "\\n")
+if "loudnorm=print_format=json" in args:
+    with open(source, "rb") as f:
+        last = f.read()[-1]
+    print("[Parsed_loudnorm_0] {{", file=sys.stderr)
+    measured = {{"input_i": str(-18 - last), "input_tp": "-20.00"}}
+    print(json.dumps(measured), file=sys.stderr)
+else:
+    shutil.copyfile(source, args[-1])
+"""
+
+# Stands in for an ffmpeg whose loudnorm output is missing the true peak
+FAKE_FFMPEG_NO_PEAK = f"""#!{sys.executable}
+import sys
+print('{{"input_i": "-23.00"}}', file=sys.stderr)
+"""
+
+
+class FakeFFmpeg:
+    def __init__(self, folder: Path) -> None:
+        self.log = folder / "ffmpeg.log"
+        self.executable = str(folder / "ffmpeg")
+        with open(self.executable, "w") as f:
+            f.write(FAKE_FFMPEG)
+        os.chmod(self.executable, 0o755)
+
+    def runs(self) -> List[str]:
+        if not self.log.exists():
+            return []
+        return self.log.read_text().splitlines()
+
+    def measured(self) -> int:
+        return sum("loudnorm" in run for run in self.runs())
+
+
+@pytest.fixture
+def ffmpeg(tmp_path: Path) -> FakeFFmpeg:
+    return FakeFFmpeg(tmp_path)
+
+
+def write(path: Path, last: int) -> Path:
+    path.write_bytes(ogg_opus([bytes([last]) * 20]))
+    return path
+
+
+class TestLoudness:
+    def test_gain(self):
+        assert Loudness(-24.0, -10.0).gain(-18.0) == 6.0
+        assert Loudness(-12.0, -2.0).gain(-18.0) == -6.0
+        # limited by the true peak
+        assert Loudness(-24.0, -3.0).gain(-18.0) == 2.0
+        assert Loudness(-math.inf, -math.inf).gain(-18.0) == 0.0
+
+    def test_measure(self, tmp_path: Path, ffmpeg: FakeFFmpeg):
+        path = write(tmp_path / "a.opus", 6)
+        assert measure_loudness(str(path), ffmpeg.executable) == (-24.0, -20.0)
+
+    def test_fill_is_incremental(self, tmp_path: Path, ffmpeg: FakeFFmpeg):
+        a = write(tmp_path / "a.opus", 6)
+        b = write(tmp_path / "b.opus", 3)
+        c = write(tmp_path / "c.opus", 6)  # the same as a
+        sidecar = tmp_path / "loudness.json"
+
+        cache = LoudnessCache(sidecar, executable=ffmpeg.executable, workers=2)
+        assert cache.gain(a) is None
+        assert cache.fill([a, b, c, a]) == {"files": 3, "new": 3, "measured": 2}
+        assert ffmpeg.measured() == 2
+        assert [cache.gain(path) for path in (a, b, c)] == [6.0, 3.0, 6.0]
+
+        assert cache.fill([a, b, c]) == {"files": 3, "new": 0, "measured": 0}
+
+        # a new cache reads the sidecar, and only measures what has changed
+        write(b, 1)
+        cache = LoudnessCache(sidecar, executable=ffmpeg.executable, workers=2)
+        assert cache.gain(a) == 6.0
+        assert cache.gain(b) is None
+        assert cache.fill([a, b, c]) == {"files": 3, "new": 1, "measured": 1}
+        assert cache.gain(b) == 1.0
+        assert ffmpeg.measured() == 3
+
+    def test_failed_measurement(self, tmp_path: Path):
+        path = write(tmp_path / "a.opus", 6)
+        cache = LoudnessCache(executable=str(tmp_path / "missing"))
+        assert cache.fill([path])["measured"] == 0
+        assert cache.measure(path) is None
+        assert cache.gain(path) is None
+
+    def test_missing_measurements(self, tmp_path: Path):
+        path = write(tmp_path / "a.opus", 6)
+        executable = tmp_path / "ffmpeg"
+        executable.write_text(FAKE_FFMPEG_NO_PEAK)
+        executable.chmod(0o755)
+
+        with pytest.raises(ValueError):
+            measure_loudness(str(path), str(executable))
+        cache = LoudnessCache(executable=str(executable))
+        assert cache.measure(path) is None
+        assert cache.fill([path])["measured"] == 0
+
+
+class TestLoudnessPlayback:
+    def test_transcode_args(self):
+        args = opus_transcode_args("in.wav", "out.opus", gain=-3.25)
+        assert args[args.index("-af") + 1] == "volume=-3.2dB"
+        assert args.index("-af") < args.index("-c:a")
+        assert "-af" not in opus_transcode_args("in.wav", "out.opus", gain=0.0)
+
+    def test_rendition_has_gain(self, tmp_path: Path, ffmpeg: FakeFFmpeg):
+        a = write(tmp_path / "a.opus", 6)
+        b = write(tmp_path / "b.opus", 0)
+        loudness = LoudnessCache(executable=ffmpeg.executable)
+        cache = TranscodeCache(
+            tmp_path / "cache", executable=ffmpeg.executable, loudness=loudness
+        )
+        cache.fill([a, b])
+        assert ffmpeg.measured() == 2
+
+        rendition = cache.get(a)
+        assert rendition is not None
+        assert rendition.name.endswith("-128k+6.0dB.opus")
+        assert rendition.read_bytes() == a.read_bytes()
+        rendition = cache.get(b)
+        assert rendition is not None
+        assert rendition.name.endswith("-128k.opus")
+
+        transcodes = [run for run in ffmpeg.runs() if "loudnorm" not in run]
+        assert sum("volume=6.0dB" in run for run in transcodes) == 1
+        assert sum("volume=" in run for run in transcodes) == 1
+
+    def test_player_passes_through_without_gain(
+        self, tmp_path: Path, ffmpeg: FakeFFmpeg
+    ):
+        path = write(tmp_path / "a.opus", 0)
+        loudness = LoudnessCache(executable=ffmpeg.executable)
+        loudness.fill([path])
+        assert loudness.gain(path) == 0.0
+
+        sound = ResolvedSound(name="s.a", filegroups=[[path]], groupweights=[1])
+        player = SoundPlayer(loudness=loudness)
+        source = asyncio.run(player.get_source(sound))
+        assert isinstance(source, OggOpusAudio)
+        source.cleanup()
@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+from __future__ import annotations
+
+import json
+import shutil
+import struct
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+from wowbot.model.main import app
+from wowbot.model.media import (
+    MEDIA_FILE,
+    MediaError,
+    MediaIndex,
+    MediaInfo,
+    UnsupportedFormat,
+    read_media_info,
+)
+from wowbot.model.soundsdir import SoundsDir
+
+from .test_oggopus import OPUS_HEAD, OPUS_TAGS, ogg_page
+
+NO_FFMPEG = "no-such-ffmpeg"
+
+# Stands in for an ffprobe which is cut off partway through its output
+BROKEN_FFPROBE = f"""#!{sys.executable}
+print('{{"streams": [{{"codec_name": ')
+"""
+
+
+def write_wav(path: Path, seconds: float, rate: int = 8000, channels: int = 1):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * channels * round(rate * seconds))
+    return path
+
+
+def ogg_with_granule(packets, granule: int) -> bytes:
+    page = bytearray(ogg_page(packets, sequence=2))
+    struct.pack_into("<q", page, 6, granule)
+    return bytes(page)
+
+
+def write_opus(path: Path, seconds: float) -> Path:
+    # the granule position counts the 312 samples of pre-skip
+    data = (
+        ogg_page([OPUS_HEAD])
+        + ogg_page([OPUS_TAGS], sequence=1)
+        + ogg_with_granule([b"\xfc" * 10], round(seconds * 48000) + 312)
+    )
+    path.write_bytes(data)
+    return path
+
+
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])  # MPEG-1 layer III, 128k, 44.1kHz
+MP3_FRAME = 417  # bytes per frame at that bitrate and rate
+
+
+def write_mp3(path: Path, frames: int, xing: int | None = None) -> Path:
+    frame = MP3_HEADER + bytes(MP3_FRAME - 4)
+    first = bytearray(frame)
+    if xing is not None:
+        struct.pack_into(">4sII", first, 4 + 32, b"Xing", 1, xing)
+    id3 = b"ID3\x03\x00\x00" + bytes([0, 0, 1, 0]) + bytes(128)
+    path.write_bytes(id3 + bytes(first) + frame * (frames - 1))
+    return path
+
+
+class TestReadMediaInfo:
+    def test_wav(self, tmp_path: Path):
+        info = read_media_info(write_wav(tmp_path / "a.wav", 1.5, channels=2))
+        assert info == MediaInfo("wav", "pcm_s16le", 1.5, 8000, 2)
+
+    def test_opus(self, tmp_path: Path):
+        info = read_media_info(write_opus(tmp_path / "a.opus", 2.0))
+        assert info == MediaInfo("ogg", "opus", 2.0, 48000, 2)
+
+    def test_vorbis(self, tmp_path: Path):
+        vorbis_id = b"\x01vorbis" + struct.pack("<IBI", 0, 1, 22050) + bytes(16)
+        path = tmp_path / "a.ogg"
+        path.write_bytes(ogg_page([vorbis_id]) + ogg_with_granule([b"x"], 44100))
+        info = read_media_info(path)
+        assert info == MediaInfo("ogg", "vorbis", 2.0, 22050, 1)
+
+    def test_mp3(self, tmp_path: Path):
+        # a constant bitrate, so the duration comes from the file size
+        info = read_media_info(write_mp3(tmp_path / "cbr.mp3", 10))
+        assert info.codec == "mp3"
+        assert info.duration == pytest.approx(10 * MP3_FRAME * 8 / 128000)
+        assert (info.sample_rate, info.channels) == (44100, 2)
+
+        # the Xing header gives the real number of frames
+        info = read_media_info(write_mp3(tmp_path / "vbr.mp3", 10, xing=100))
+        assert info.duration == pytest.approx(100 * 1152 / 44100)
+
+    @pytest.mark.parametrize(
+        "data, message",
+        [
+            (b"", "empty"),
+            (b"OggS\0\0", "truncated"),
+            (b"RIFF\0\0\0\0WAVEfmt ", "no fmt chunk"),
+            (b"\xff\xfb" + bytes(100), "no MPEG audio frames"),
+        ],
+    )
+    def test_corrupt(self, tmp_path: Path, data: bytes, message: str):
+        path = tmp_path / "bad.bin"
+        path.write_bytes(data)
+        with pytest.raises(MediaError, match=message):
+            read_media_info(path, NO_FFMPEG)
+
+    def test_truncated_wav(self, tmp_path: Path):
+        path = write_wav(tmp_path / "a.wav", 1.0)
+        path.write_bytes(path.read_bytes()[:-100])
+        with pytest.raises(MediaError, match="data chunk is truncated"):
+            read_media_info(path)
+
+    def test_unknown_format_needs_ffprobe(self, tmp_path: Path):
+        path = tmp_path / "a.flac"
+        path.write_bytes(b"fLaC" + bytes(100))
+        with pytest.raises(UnsupportedFormat):
+            read_media_info(path, NO_FFMPEG)
+
+    def test_invalid_ffprobe_output(self, tmp_path: Path):
+        executable = tmp_path / "ffprobe"
+        executable.write_text(BROKEN_FFPROBE)
+        executable.chmod(0o755)
+        path = tmp_path / "a.flac"
+        path.write_bytes(b"fLaC" + bytes(100))
+
+        with pytest.raises(MediaError, match="invalid JSON"):
+            read_media_info(path, str(executable))
+        index = MediaIndex(executable=str(executable))
+        assert index.fill([path]) == {path: "ffprobe printed invalid JSON"}
+
+
+class TestMediaIndex:
+    def test_fill_and_persist(self, tmp_path: Path):
+        good = write_wav(tmp_path / "good.wav", 0.5)
+        bad = tmp_path / "bad.wav"
+        bad.write_bytes(b"RIFF")
+        unknown = tmp_path / "a.flac"
+        unknown.write_bytes(b"fLaC")
+        sidecar = tmp_path / "media.json"
+
+        index = MediaIndex(sidecar, executable=NO_FFMPEG, workers=2)
+        assert index.fill([good, bad, unknown, good]) == {bad: "file is truncated"}
+        assert index.get(good) == MediaInfo("wav", "pcm_s16le", 0.5, 8000, 1)
+        assert index.error(bad) == "file is truncated"
+        assert index.get(unknown) is None and index.error(unknown) is None
+
+        index = MediaIndex(sidecar, executable=NO_FFMPEG)
+        assert index.get(good) is not None
+        assert index.error(bad) == "file is truncated"
+        with pytest.raises(MediaError):
+            index.read(bad)
+
+        # a changed file is read again
+        write_wav(bad, 1.0)
+        assert index.fill([good, bad]) == {}
+        assert index.read(bad).duration == 1.0
+
+    def test_folder_sidecar_survives_copy(self, tmp_path: Path, monkeypatch):
+        folder = tmp_path / "sounds"
+        (folder / "sub").mkdir(parents=True)
+        good = write_wav(folder / "sub" / "good.wav", 0.5)
+        changed = write_wav(folder / "changed.wav", 0.5)
+        bad = folder / "bad.wav"
+        bad.write_bytes(b"RIFF")
+
+        index = MediaIndex(executable=NO_FFMPEG)
+        index.fill([good, changed, bad])
+        index.save_folder(folder)
+        data = json.loads((folder / MEDIA_FILE).read_text())
+        assert [entry["path"] for entry in data["files"]] == [
+            "bad.wav",
+            "changed.wav",
+            "sub/good.wav",
+        ]
+
+        # copying gives every file a new inode and modification time
+        copy = tmp_path / "copy"
+        shutil.copytree(folder, copy, copy_function=shutil.copy)
+        data = bytearray((copy / "changed.wav").read_bytes())
+        data[-1] ^= 1  # the same size, but different contents
+        (copy / "changed.wav").write_bytes(bytes(data))
+
+        def fail(*args):
+            raise AssertionError("read a file which was in the sidecar")
+
+        index = MediaIndex(executable=NO_FFMPEG)
+        index.load_folder(copy)
+        assert index.get(copy / "sub" / "good.wav") == MediaInfo(
+            "wav", "pcm_s16le", 0.5, 8000, 1
+        )
+        assert index.error(copy / "bad.wav") == "file is truncated"
+        assert index.get(copy / "changed.wav") is None
+        monkeypatch.setattr("wowbot.model.media.read_media_info", fail)
+        assert index.fill([copy / "sub" / "good.wav", copy / "bad.wav"]) == {
+            copy / "bad.wav": "file is truncated"
+        }
+
+    def test_missing_file(self, tmp_path: Path):
+        path = tmp_path / "missing.wav"
+        assert list(MediaIndex().fill([path])) == [path]
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "sounds"
+    shutil.copytree("tests/sounds", folder)
+    for index, path in enumerate(sorted(folder.glob("*.opus"))):
+        write_opus(path, index + 1)
+    return folder
+
+
+class TestSoundsDirMedia:
+    def test_resolved_sounds_have_durations(self, folder: Path):
+        index = MediaIndex()
+        sd = SoundsDir.from_folder(folder, media_index=index, use_snapshot=False)
+        index.fill(sd.files())
+
+        sound = sd.sound_collection["s.example"]
+        assert sound.media is index
+        info = sound.info(folder / "example1.opus")
+        assert info is not None and info.duration == 1.0
+        assert sound.max_duration() == max(
+            index.read(path).duration for path in sound.files()
+        )
+
+        (folder / "example1.opus").write_bytes(b"")
+        assert sound.info(folder / "example1.opus") is None
+        assert sound.max_duration() is None
+
+    def test_check_flags_corrupt_files(self, folder: Path):
+        def run(*args: str) -> int:
+            try:
+                app(list(args))
+            except SystemExit as ex:
+                return ex.code  # type: ignore
+            return 0
+
+        assert run("check", str(folder), "--media", "-j", "2") == 0
+        assert run("media", str(folder)) == 0
+        assert (folder / MEDIA_FILE).exists()
+
+        (folder / "example2.opus").write_bytes(b"OggS")
+        assert run("check", str(folder)) == 0
+        assert run("check", str(folder), "--media") == 1
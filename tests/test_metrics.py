@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import shutil
+import subprocess
+from pathlib import Path
+
+import aiohttp
+
+from wowbot.discord.metrics import (
+    BotMetrics,
+    LoopLagMonitor,
+    MetricsServer,
+    count_children,
+    resident_bytes,
+)
+from wowbot.discord.slash import make_cog
+from wowbot.discord.sound import SoundPlayer
+from wowbot.discord.trace import PrometheusSink, Tracer
+from wowbot.discord.voice import VoiceManager
+from wowbot.model.probe import ProbeCache
+from wowbot.model.soundsdir import SoundsDir
+
+from .fakes import (
+    FakeChannel,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    RecordingVoiceClient,
+)
+from .test_oggopus import FRAMES, ogg_opus
+from .test_player import drain
+
+
+class TestMetrics:
+    def test_endpoint(self, tmp_path: Path):
+        folder = tmp_path / "sounds"
+        shutil.copytree("tests/sounds", folder)
+        for path in folder.glob("*.opus"):
+            path.write_bytes(ogg_opus(FRAMES))
+        soundsdir = SoundsDir.from_folder(folder, use_snapshot=False)
+
+        async def main():
+            player = SoundPlayer(
+                probe_cache=ProbeCache(),
+                voice=VoiceManager(idle_timeout=0),
+                tracer=Tracer([PrometheusSink()]),
+            )
+            metrics = BotMetrics(player, lag=LoopLagMonitor(0.001))
+            metrics.load_seconds = 0.25
+            server = MetricsServer(metrics, "127.0.0.1", 0)
+            await server.start()
+
+            cog = make_cog(soundsdir, player)
+            command = next(c for c in cog.get_commands() if c.name == "mycommand")
+            guild = FakeGuild(1)
+            channel = FakeChannel(10, guild, 0, RecordingVoiceClient)
+            for _ in range(2):
+                ctx = FakeContext(command.name, FakeMember(1, guild, channel))
+                await command.callback(cog, ctx)
+            await drain(player)
+            await asyncio.sleep(0.01)
+
+            url = f"http://127.0.0.1:{server.port}/metrics"
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    content_type = response.headers["Content-Type"]
+                    text = await response.text()
+            await guild.voice_client.disconnect()  # type: ignore
+            await server.stop()
+            return content_type, text
+
+        content_type, text = asyncio.run(main())
+        assert content_type.startswith("text/plain; version=0.0.4")
+        lines = text.splitlines()
+        assert 'wowbot_command_requests_total{command="mycommand"} 2' in lines
+        assert 'wowbot_queue_sounds_total{outcome="played"} 1' in lines
+        assert "wowbot_voice_connections 1" in lines
+        assert 'wowbot_cache_hit_ratio{cache="probe"} 0.0' in lines
+        assert "wowbot_sounds_load_seconds 0.25" in lines
+        assert any(line.startswith("process_resident_memory_bytes ") for line in lines)
+        count = next(
+            line
+            for line in lines
+            if line.startswith("wowbot_event_loop_lag_seconds_count")
+        )
+        assert int(count.split()[1]) > 0
+        # the tracer's histograms are included
+        assert "# TYPE wowbot_play_seconds histogram" in lines
+
+    def test_count_children(self):
+        before = count_children("sleep")
+        process = subprocess.Popen(["sleep", "10"])
+        try:
+            assert count_children("sleep") == before + 1  # type: ignore
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_resident_bytes(self):
+        rss = resident_bytes()
+        assert rss is not None and rss > 1 << 20
@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import io
+import struct
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from wowbot.discord import sound as sound_module
+from wowbot.discord.framecache import iter_opus_frames
+from wowbot.discord.sound import (
+    OggOpusAudio,
+    SoundPlayer,
+    is_native_opus,
+    iter_ogg_packets,
+    sniff_ogg_opus,
+)
+from wowbot.model.probe import FileIdentity
+
+OPUS_HEAD = b"OpusHead" + struct.pack("<BBHIhB", 1, 2, 312, 48000, 0, 0)
+OPUS_TAGS = b"OpusTags" + struct.pack("<I", 6) + b"wowbot" + struct.pack("<I", 0)
+CELT_20MS = 0xFC  # config 31 (CELT, 20ms), stereo, one frame
+
+
+def ogg_page(
+    packets: List[bytes], continued: bool = False, sequence: int = 0, serial: int = 1
+):
+    lacings = bytearray()
+    for index, packet in enumerate(packets):
+        lacings.extend([255] * (len(packet) // 255))
+        if index < len(packets) - 1 or not continued:
+            lacings.append(len(packet) % 255)
+    header = struct.pack(
+        "<4sBBqIIIB", b"OggS", 0, 0, 0, serial, sequence, 0, len(lacings)
+    )
+    return header + bytes(lacings) + b"".join(packets)
+
+
+def ogg_opus(frames: List[bytes], toc: int = CELT_20MS) -> bytes:
+    frames = [bytes([toc]) + frame for frame in frames]
+    return (
+        ogg_page([OPUS_HEAD])
+        + ogg_page([OPUS_TAGS], sequence=1)
+        + ogg_page(frames, sequence=2)
+    )
+
+
+FRAMES = [bytes([i]) * (10 + 100 * i) for i in range(5)]
+
+
+class TestOggOpus:
+    def test_packets_match_pycord(self):
+        data = ogg_opus(FRAMES)
+        packets = list(iter_ogg_packets(data))
+        assert packets[:2] == [OPUS_HEAD, OPUS_TAGS]
+        assert packets[2:] == list(iter_opus_frames(io.BytesIO(data)))
+        assert [p[1:] for p in packets[2:]] == FRAMES
+
+    def test_packet_across_pages(self):
+        big = bytes([CELT_20MS]) + b"x" * 600
+        data = (
+            ogg_page([OPUS_HEAD])
+            + ogg_page([OPUS_TAGS], sequence=1)
+            + ogg_page([big[:510]], continued=True, sequence=2)
+            + ogg_page([big[510:]], sequence=3)
+        )
+        assert list(iter_ogg_packets(data))[2:] == [big]
+
+    def test_sniff(self):
+        assert sniff_ogg_opus(ogg_opus(FRAMES))
+        assert not sniff_ogg_opus(b"")
+        assert not sniff_ogg_opus(b"RIFF" + bytes(100))
+        # 60ms SILK frames
+        assert not sniff_ogg_opus(ogg_opus(FRAMES, toc=0x18))
+        # two frames per packet
+        assert not sniff_ogg_opus(ogg_opus(FRAMES, toc=CELT_20MS | 1))
+        # truncated
+        assert not sniff_ogg_opus(ogg_opus(FRAMES)[:40])
+
+    def test_sniff_every_packet(self):
+        data = ogg_opus(FRAMES)
+        # a 40ms frame after the first audio packet
+        assert not sniff_ogg_opus(data + ogg_page([bytes([0xF4, 1])], sequence=3))
+        # two frames in a later packet
+        later = ogg_page([bytes([CELT_20MS | 1, 1])], sequence=3)
+        assert not sniff_ogg_opus(data + later)
+        # no audio at all
+        assert not sniff_ogg_opus(
+            ogg_page([OPUS_HEAD]) + ogg_page([OPUS_TAGS], sequence=1)
+        )
+
+    def test_other_stream(self):
+        data = ogg_opus(FRAMES)
+        other = ogg_page([bytes([CELT_20MS, 2])], sequence=3, serial=2)
+        with pytest.raises(ValueError):
+            list(iter_ogg_packets(data + other))
+        # multiplexed and chained streams
+        assert not sniff_ogg_opus(data + other)
+        chained = ogg_page([OPUS_HEAD], serial=2) + ogg_page([OPUS_TAGS], serial=2)
+        assert not sniff_ogg_opus(data + chained)
+
+    @pytest.mark.parametrize("toc", [0x08, 0x68, 0x78, 0x98, 0xF8])
+    def test_sniff_20ms(self, toc: int):
+        assert sniff_ogg_opus(ogg_opus(FRAMES, toc=toc))
+
+    def test_audio_source(self, tmp_path: Path):
+        path = tmp_path / "sound.opus"
+        path.write_bytes(ogg_opus(FRAMES))
+        assert is_native_opus(path)
+
+        source = OggOpusAudio(path)
+        assert source.is_opus()
+        read = []
+        while frame := source.read():
+            read.append(frame[1:])
+        source.cleanup()
+        assert read == FRAMES
+
+    def test_not_native(self, tmp_path: Path):
+        assert not is_native_opus(Path("tests/sounds/example1.opus"))
+        assert not is_native_opus(tmp_path / "missing.opus")
+
+    def test_native_cache_is_bounded(self, tmp_path: Path, monkeypatch):
+        monkeypatch.setattr(sound_module, "_NATIVE_CACHE_SIZE", 2)
+        player = SoundPlayer()
+        paths = []
+        for i in range(3):
+            paths.append(tmp_path / f"sound{i}.opus")
+            paths[-1].write_bytes(ogg_opus(FRAMES[: i + 1]))
+
+        async def check(*indices: int):
+            for i in indices:
+                assert await player._is_native(paths[i])
+
+        asyncio.run(check(0, 1, 0, 2))
+        # the second was used least recently, so was dropped
+        assert list(player._native) == [FileIdentity.of(paths[i]) for i in (0, 2)]
@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+from __future__ import annotations
+
+import asyncio
+import shutil
+from pathlib import Path
+from typing import List, Tuple
+
+from discord import AudioSource
+
+from wowbot.discord.slash import make_cog
+from wowbot.discord.sound import SoundPlayer
+from wowbot.discord.trace import PlayTrace
+from wowbot.discord.voice import VoiceManager
+from wowbot.model.sound import ResolvedSound
+from wowbot.model.soundsdir import SoundsDir
+
+from .fakes import (
+    FakeChannel,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    FakeVoiceClient,
+    RecordingVoiceClient,
+)
+from .test_oggopus import FRAMES, ogg_opus
+
+
+class FakeProcessSource(AudioSource):
+    def __init__(self, player: "SlowPlayer", name: str) -> None:
+        self.player = player
+        self.name = name
+        player.running += 1
+        player.max_running = max(player.max_running, player.running)
+
+    def cleanup(self) -> None:
+        self.player.running -= 1
+
+
+class SlowPlayer(SoundPlayer):
+    """A player whose sources take a while to make, and count as processes"""
+
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.started: List[str] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def get_source(
+        self, sound: ResolvedSound, trace: PlayTrace | None = None
+    ) -> AudioSource:
+        self.started.append(sound.name)
+        await asyncio.sleep(self.delay)
+        return FakeProcessSource(self, sound.name)
+
+
+def make_sound(name: str) -> ResolvedSound:
+    return ResolvedSound(name=name, filegroups=[[Path(name)]], groupweights=[1])
+
+
+async def connect() -> Tuple[FakeGuild, FakeVoiceClient]:
+    guild = FakeGuild(1)
+    voice_client = await FakeChannel(10, guild).connect()
+    return guild, voice_client
+
+
+async def drain(player: SoundPlayer) -> None:
+    while any(queue.task is not None for queue in player._queues.values()):
+        await asyncio.sleep(0.001)
+
+
+class TestSoundPlayerQueue:
+    def test_burst_is_coalesced(self):
+        async def main():
+            guild, voice_client = await connect()
+            player = SlowPlayer(0.01)
+            for i in range(5):
+                player.enqueue(guild, make_sound(f"s{i}"))  # type: ignore
+            await drain(player)
+            return player, voice_client
+
+        player, voice_client = asyncio.run(main())
+        assert player.started == ["s4"]
+        assert [source.name for source in voice_client.played] == ["s4"]
+        stats = player.stats()[1]
+        assert stats["requests"] == 5
+        assert stats["coalesced"] == 4
+        assert stats["dropped"] == 4
+        assert stats["played"] == 1
+        assert stats["depth"] == 0
+
+    def test_superseded_build_is_cancelled(self):
+        async def main():
+            guild, voice_client = await connect()
+            player = SlowPlayer(0.05)
+            player.enqueue(guild, make_sound("first"))  # type: ignore
+            await asyncio.sleep(0.01)
+            player.enqueue(guild, make_sound("second"))  # type: ignore
+            await drain(player)
+            return player, voice_client
+
+        player, voice_client = asyncio.run(main())
+        assert player.started == ["first", "second"]
+        assert [source.name for source in voice_client.played] == ["second"]
+        stats = player.stats()[1]
+        assert stats["cancelled"] == 1
+        assert stats["played"] == 1
+        assert stats["max_depth"] == 2
+
+    def test_one_process_per_guild(self):
+        async def main():
+            guild, voice_client = await connect()
+            player = SlowPlayer(0.002)
+            for i in range(20):
+                player.enqueue(guild, make_sound(f"s{i}"))  # type: ignore
+                await asyncio.sleep(0.003 * (i % 3))
+            await drain(player)
+            return player, voice_client
+
+        player, voice_client = asyncio.run(main())
+        assert player.max_running == 1
+        assert voice_client.played[-1].name == "s19"  # type: ignore
+        stats = player.stats()[1]
+        assert stats["played"] + stats["dropped"] == stats["requests"]
+
+
+class TestCogInvocations:
+    def test_invocations_play_packets(self, tmp_path: Path):
+        folder = tmp_path / "sounds"
+        shutil.copytree("tests/sounds", folder)
+        for path in folder.glob("*.opus"):
+            path.write_bytes(ogg_opus(FRAMES))
+        soundsdir = SoundsDir.from_folder(folder, use_snapshot=False)
+
+        async def main():
+            player = SoundPlayer(voice=VoiceManager(idle_timeout=0))
+            cog = make_cog(soundsdir, player)
+            first_packets: List[AudioSource] = []
+
+            def make_client(channel: FakeChannel) -> RecordingVoiceClient:
+                return RecordingVoiceClient(
+                    channel,
+                    paced=False,
+                    on_first_packet=lambda source, at: first_packets.append(source),
+                )
+
+            guilds = [FakeGuild(i) for i in range(3)]
+            members = [
+                FakeMember(i, guild, FakeChannel(10 + i, guild, 0, make_client))
+                for i, guild in enumerate(guilds)
+            ]
+            command = cog.get_commands()[0]
+            contexts = [FakeContext(command.name, member) for member in members]
+            for ctx in contexts:
+                await command.callback(cog, ctx)
+            await drain(player)
+
+            outsider = FakeContext(command.name, FakeMember(99, guilds[0], None))
+            await command.callback(cog, outsider)
+
+            for _ in range(1000):
+                if all(not g.voice_client.is_playing() for g in guilds):  # type: ignore
+                    break
+                await asyncio.sleep(0.001)
+            return guilds, contexts, outsider, first_packets, player
+
+        guilds, contexts, outsider, first_packets, player = asyncio.run(main())
+        assert [ctx.responses[0][0] for ctx in contexts] == [
+            (contexts[0].command.name,)
+        ] * 3
+        assert outsider.responses[0][0] == ("You aren't in a voice chat!",)
+        assert len(first_packets) == 3
+        for guild in guilds:
+            assert isinstance(guild.voice_client, RecordingVoiceClient)
+            assert guild.voice_client.packets == len(FRAMES)
+            assert not guild.voice_client.is_playing()
+        assert all(stats["played"] == 1 for stats in player.stats().values())
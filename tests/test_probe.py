@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import json
+import os
+import sys
+from pathlib import Path
+
+from wowbot.model.probe import ProbeCache, ProbeResult
+from wowbot.model.soundsdir import SoundsDir
+
+# Stands in for ffprobe: every file is a vorbis stream
+FAKE_FFPROBE = f"""#!{sys.executable}
+import json
+print(json.dumps({{"streams": [{{"codec_name": "vorbis", "bit_rate": "128000"}}]}}))
+"""
+
+VORBIS = ProbeResult("vorbis", 512)
+
+
+class TestProbeCache:
+    def make_cache(self, tmp_path: Path, **kwargs) -> ProbeCache:
+        executable = tmp_path / "fake-ffprobe"
+        if not executable.exists():
+            executable.write_text(FAKE_FFPROBE)
+            executable.chmod(0o755)
+        return ProbeCache(
+            tmp_path / "probes.json", executable=str(executable), **kwargs
+        )
+
+    def make_failing_cache(self, tmp_path: Path) -> ProbeCache:
+        # a missing executable makes every probe fail, falling back to no info
+        return ProbeCache(
+            tmp_path / "probes.json", executable=str(tmp_path / "no-such-ffmpeg")
+        )
+
+    def test_hits_and_misses(self, tmp_path: Path):
+        source = tmp_path / "source.opus"
+        source.write_bytes(b"not really audio")
+
+        cache = self.make_cache(tmp_path)
+        assert cache.get(source) is None
+        assert cache.probe(source) == VORBIS
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert cache.probe(source) == VORBIS
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_persists_across_instances(self, tmp_path: Path):
+        source = tmp_path / "source.opus"
+        source.write_bytes(b"not really audio")
+
+        self.make_cache(tmp_path).fill([source])
+
+        cache = self.make_cache(tmp_path)
+        assert cache.get(source) == VORBIS
+        assert (cache.hits, cache.misses) == (1, 0)
+
+    def test_changed_file_is_a_miss(self, tmp_path: Path):
+        source = tmp_path / "source.opus"
+        source.write_bytes(b"not really audio")
+
+        cache = self.make_cache(tmp_path)
+        cache.fill([source])
+        assert cache.get(source) is not None
+
+        source.write_bytes(b"different audio")
+        os.utime(source, ns=(0, 0))
+        assert cache.get(source) is None
+
+    def test_failures_are_not_cached(self, tmp_path: Path):
+        source = tmp_path / "source.opus"
+        source.write_bytes(b"not really audio")
+
+        cache = self.make_failing_cache(tmp_path)
+        assert cache.probe(source) == ProbeResult(None, None)
+        assert cache.get(source) is None
+        cache.fill([source])
+        assert cache.get(source) is None
+        assert not (tmp_path / "probes.json").exists()
+
+    def test_probe_saves_are_deferred(self, tmp_path: Path):
+        sources = [tmp_path / f"{i}.opus" for i in range(3)]
+        for source in sources:
+            source.write_bytes(b"not really audio")
+
+        cache = self.make_cache(tmp_path, save_delay=3600)
+        for source in sources:
+            cache.probe(source)
+        assert not (tmp_path / "probes.json").exists()
+
+        cache.save()
+        with open(tmp_path / "probes.json") as f:
+            assert len(json.load(f)["entries"]) == 3
+
+    def test_bad_sidecar_is_ignored(self, tmp_path: Path):
+        (tmp_path / "probes.json").write_text("{not json")
+        cache = self.make_cache(tmp_path)
+        assert cache.get(tmp_path / "probes.json") is None
+
+
+class TestSoundsDirProbes:
+    def test_fills_only_with_sidecar(self, tmp_path: Path, monkeypatch):
+        filled = []
+        monkeypatch.setattr(
+            ProbeCache, "fill_in_background", lambda self, paths: filled.append(self)
+        )
+        memory = ProbeCache()
+        SoundsDir.from_folder(Path("tests/sounds"), probe_cache=memory)
+        assert filled == []
+
+        persisted = ProbeCache(tmp_path / "probes.json")
+        SoundsDir.from_folder(Path("tests/sounds"), probe_cache=persisted)
+        assert filled == [persisted]
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import pstats
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from wowbot.discord.slash import make_cog
+from wowbot.discord.sound import SoundPlayer
+from wowbot.model.main import app
+from wowbot.model.profile import Profiler, profiled, set_profiler
+from wowbot.model.soundsdir import SoundsDir
+
+from .fakes import FakeContext, FakeGuild, FakeMember
+
+
+@profiled("busy")
+def busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+@profiled("outer")
+def outer() -> int:
+    return busy(1000)
+
+
+@profiled("allocate")
+def allocate() -> List[bytes]:
+    return [bytes(1000) for _ in range(1000)]
+
+
+@profiled("coroutine")
+async def coroutine() -> int:
+    await asyncio.sleep(0)
+    return busy(1000)
+
+
+@pytest.fixture
+def profiles(tmp_path: Path) -> Iterator[Path]:
+    yield tmp_path / "profiles"
+    set_profiler(None)
+
+
+def names(folder: Path) -> List[str]:
+    return sorted(path.name for path in folder.iterdir())
+
+
+class TestProfiler:
+    def test_disabled(self, profiles: Path):
+        assert busy(10) == 285
+        assert not profiles.exists()
+
+    def test_cpu(self, profiles: Path):
+        set_profiler(Profiler("cpu", profiles))
+        assert busy(10000) == sum(i * i for i in range(10000))
+
+        files = names(profiles / "busy")
+        assert [name.rsplit(".", 1)[1] for name in files] == ["collapsed", "pstats"]
+        stats = pstats.Stats(str(profiles / "busy" / files[1]))
+        assert any(func[2] == "busy" for func in stats.stats)  # type: ignore
+        collapsed = (profiles / "busy" / files[0]).read_text()
+        assert "busy (test_profile.py" in collapsed
+
+    def test_nested_calls_are_part_of_the_outer_profile(self, profiles: Path):
+        set_profiler(Profiler("cpu", profiles))
+        outer()
+        assert names(profiles) == ["outer"]
+        assert (
+            ";busy (test_profile.py"
+            in next(profiles.glob("outer/*.collapsed")).read_text()
+        )
+
+    def test_coroutine(self, profiles: Path):
+        set_profiler(Profiler("cpu", profiles))
+        asyncio.run(coroutine())
+        assert len(names(profiles / "coroutine")) == 2
+
+    def test_rotation(self, profiles: Path):
+        profiler = Profiler("cpu", profiles, keep=2)
+        set_profiler(profiler)
+        for _ in range(4):
+            busy(10)
+        assert len(profiler.written) == 8
+        assert names(profiles / "busy") == sorted(
+            path.name for path in list(profiler.written)[4:]
+        )
+
+    def test_mem(self, profiles: Path):
+        set_profiler(Profiler("mem", profiles))
+        kept = allocate()
+
+        files = names(profiles / "allocate")
+        assert [name.split(".", 1)[1] for name in files] == ["collapsed", "top.txt"]
+        lines = (profiles / "allocate" / files[0]).read_text().splitlines()
+        stack, size = lines[0].rsplit(" ", 1)
+        assert stack.split(";")[-1].startswith("test_profile.py:")
+        assert int(size) >= len(kept) * 1000
+
+    def test_bad_mode(self, profiles: Path):
+        with pytest.raises(ValueError):
+            Profiler("wall", profiles)
+
+
+class TestProfiledCommands:
+    def test_slash_callbacks(self, profiles: Path):
+        set_profiler(Profiler("cpu", profiles))
+        soundsdir = SoundsDir.from_folder(Path("tests/sounds"), use_snapshot=False)
+        assert names(profiles) == ["SoundsDir.from_folder"]
+
+        async def main():
+            player = SoundPlayer()
+            cog = make_cog(soundsdir, player)
+            for command in cog.walk_commands():
+                if command.qualified_name == "mytoplevelcommand mysubcommand":
+                    break
+            guild = FakeGuild(1)
+            member = FakeMember(1, guild, None)
+            await command.callback(cog, FakeContext(command.name, member))
+
+        asyncio.run(main())
+        assert names(profiles) == [
+            "SoundsDir.from_folder",
+            "make_cog_type",
+            "mytoplevelcommand-mysubcommand",
+        ]
+
+    def test_check(self, profiles: Path):
+        def run(*args: str) -> int:
+            try:
+                app(list(args))
+            except SystemExit as ex:
+                return ex.code  # type: ignore
+            return 0
+
+        folder = "tests/sounds"
+        assert (
+            run("check", folder, "--profile", "cpu", "--profile-dir", str(profiles))
+            == 0
+        )
+        assert len(names(profiles / "check")) == 2
+        assert run("check", folder, "--profile", "wall") == 2
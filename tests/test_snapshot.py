@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from wowbot.model.main import app
+from wowbot.model.snapshot import SNAPSHOT_FILE, Snapshot
+from wowbot.model.sound import SoundsJson
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE, SoundsDir
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "sounds"
+    shutil.copytree("tests/sounds", folder)
+    return folder
+
+
+def compile_folder(folder: Path) -> None:
+    try:
+        app(["compile", str(folder)])
+    except SystemExit as ex:
+        assert ex.code == 0
+
+
+def read_snapshot(folder: Path):
+    return Snapshot.read(
+        folder / SNAPSHOT_FILE, folder / SOUNDS_FILE, folder, folder / COMMANDS_FILE
+    )
+
+
+class TestSnapshot:
+    def test_round_trip(self, folder: Path):
+        compile_folder(folder)
+
+        snapshot = read_snapshot(folder)
+        assert snapshot is not None
+        sd = SoundsDir.from_folder(folder, use_snapshot=False)
+        assert snapshot.sound_collection == sd.sound_collection
+        assert snapshot.sounds_json == sd.sounds_json
+        assert snapshot.commands_json == sd.commands_json
+
+    def test_from_folder_skips_validation(self, folder: Path, monkeypatch):
+        compile_folder(folder)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("validated despite a fresh snapshot")
+
+        monkeypatch.setattr(SoundsJson, "model_validate", fail)
+        sd = SoundsDir.from_folder(folder, use_snapshot=True)
+        assert sd.sound_collection
+
+    def test_from_folder_ignores_snapshot_by_default(self, folder: Path, monkeypatch):
+        compile_folder(folder)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("loaded an untrusted snapshot")
+
+        monkeypatch.setattr(Snapshot, "read", fail)
+        sd = SoundsDir.from_folder(folder)
+        assert sd.sound_collection
+
+    def test_changed_json_is_stale(self, folder: Path):
+        compile_folder(folder)
+
+        with open(folder / COMMANDS_FILE, "a") as f:
+            f.write("\n")
+        assert read_snapshot(folder) is None
+
+    def test_new_file_is_stale(self, folder: Path):
+        compile_folder(folder)
+
+        (folder / "mysound-c.opus").write_bytes(b"")
+        # make sure the change is visible on filesystems with coarse mtimes
+        os.utime(folder, ns=(0, 0))
+        assert read_snapshot(folder) is None
+
+    def test_changed_sound_file_is_stale(self, folder: Path):
+        compile_folder(folder)
+
+        (folder / "example1.opus").write_bytes(b"changed")
+        assert read_snapshot(folder) is None
+
+    def test_corrupt_snapshot_is_ignored(self, folder: Path):
+        (folder / SNAPSHOT_FILE).write_bytes(b"WOWBOTSNAP garbage")
+        assert read_snapshot(folder) is None
+        assert SoundsDir.from_folder(folder, use_snapshot=True).sound_collection
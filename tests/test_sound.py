@@ -2,6 +2,8 @@
 #
 # SPDX-License-Identifier: MIT
 import json
+import random
+from collections import Counter
 from pathlib import Path
 from typing import Any, Optional
 from uuid import uuid4
@@ -9,9 +11,12 @@ from uuid import uuid4
 import pytest
 from pydantic import ValidationError
 
+from wowbot.model.errors import BaseModelError, ErrorCollection
 from wowbot.model.sound import (
     EmptyGlobError,
+    ResolvedSound,
     SoundFileNotFoundError,
+    SoundName,
     SoundNameReuseError,
     SoundsJson,
 )
@@ -60,7 +65,8 @@ class TestSoundsJson:
         for key in ["s.example", "s.mysound"]:
             assert key in resolved
             item = resolved[key].random()
-            assert item.exists()
+            assert item.path.exists()
+            assert item.storage is None
 
     @classmethod
     def get_data_from_files(cls, *files: Any) -> Any:
@@ -116,6 +122,32 @@ class TestSoundsJson:
                 sj.resolve_files(self.ROOT)
             assert exc_info.value.name == name
 
+    def test_parallel_matches_serial(self):
+        with open(self.ROOT / "sounds.json") as f:
+            data = json.load(f)
+        sj = SoundsJson.model_validate(data)
+
+        assert sj.resolve_files(self.ROOT, jobs=4) == sj.resolve_files(self.ROOT)
+
+    def test_parallel_errors_match_serial(self):
+        sounds = []
+        for i in range(20):
+            files = ["example1.opus", f"missing{i}.opus", {"glob": f"missing{i}-*"}]
+            sounds.append(self.get_sound_from_files(*files, name=f"s.{i % 15}"))
+        sj = SoundsJson.model_validate(self.get_data_from_sounds(*sounds))
+
+        def get_errors(jobs: int) -> list:
+            with pytest.raises(ErrorCollection) as exc_info:
+                sj.resolve_files(self.ROOT, jobs=jobs)
+            errors: list[BaseModelError] = exc_info.value.errors
+            return [(type(err), getattr(err, "context"), str(err)) for err in errors]
+
+        serial = get_errors(1)
+        assert len(serial) == 45
+        assert serial[0][1] == ("sounds", 0, "files", 1, "root")
+        assert serial[-1][1] == ("sounds", 19, "files", 2, "glob")
+        assert get_errors(4) == serial
+
     def test_no_files_fails(self):
         data = self.get_data_from_files()
 
@@ -166,3 +198,64 @@ class TestSoundsJson:
             with pytest.raises(ValidationError) as excinfo:
                 SoundsJson.model_validate(data)
             assert any_validation_error(excinfo.value, loc=loc, type="extra_forbidden")
+
+
+class TestResolvedSound:
+    @staticmethod
+    def make_sound() -> ResolvedSound:
+        groups = [
+            [Path("a")],
+            [Path("b"), Path("c")],
+            [Path("d"), Path("e"), Path("f")],
+        ]
+        return ResolvedSound(SoundName("s.test"), groups, [1, 3, 6])
+
+    # a weight of 1 split over 1 file, 3 over 2 files, and 6 over 3 files
+    EXPECTED = {"a": 0.1, "b": 0.15, "c": 0.15, "d": 0.2, "e": 0.2, "f": 0.2}
+
+    @staticmethod
+    def seed(monkeypatch, seed: int) -> None:
+        # Seed a generator of the sound module's own, so the global one is untouched
+        monkeypatch.setattr("wowbot.model.sound.random", random.Random(seed))
+
+    def test_random_matches_choices(self, monkeypatch):
+        sound = self.make_sound()
+
+        rng = random.Random(1234)
+        expected = [
+            rng.choice(rng.choices(sound.filegroups, sound.groupweights)[0])
+            for _ in range(1000)
+        ]
+        self.seed(monkeypatch, 1234)
+        actual = [sound.random().path for _ in range(1000)]
+
+        assert actual == expected
+
+    def test_sample_distribution(self, monkeypatch):
+        sound = self.make_sound()
+        count = 100_000
+
+        self.seed(monkeypatch, 5678)
+        counts = Counter(handle.path.name for handle in sound.sample(count))
+
+        chi_squared = sum(
+            (counts[name] - count * p) ** 2 / (count * p)
+            for name, p in self.EXPECTED.items()
+        )
+        # critical value of the chi-squared distribution with 5 degrees of
+        # freedom at a significance level of 0.001
+        assert chi_squared < 20.52
+
+    def test_changed_weights(self):
+        sound = self.make_sound()
+        with pytest.raises(AttributeError):
+            sound.groupweights.append(1)  # type: ignore[attr-defined]
+
+        sound.groupweights = [1, 0, 0]
+        assert sound.groupweights == (1, 0, 0)
+        assert {handle.path.name for handle in sound.sample(100)} == {"a"}
+
+    def test_sample_length(self):
+        sound = self.make_sound()
+        assert sound.sample(0) == []
+        assert len(sound.sample(17)) == 17
@@ -1,9 +1,18 @@
 # SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
 #
 # SPDX-License-Identifier: MIT
+import json
+import os
+import shutil
 from pathlib import Path
+from typing import Any, Callable, List
 
-from wowbot.model.soundsdir import SoundsDir
+import pydantic
+import pytest
+
+from wowbot.model.errors import BaseModelError
+from wowbot.model.soundsdir import COMMANDS_FILE, SOUNDS_FILE, SoundsDir
+from wowbot.model.watch import SoundsDirWatcher
 
 
 class TestCommandsJson:
@@ -16,3 +25,145 @@ class TestCommandsJson:
         assert sd.sound_collection
         assert sd.commands_json.commands
         sd.commands_json.check_sounds(sd.sound_collection)
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "sounds"
+    shutil.copytree("tests/sounds", folder)
+    return folder
+
+
+def touch(path: Path) -> None:
+    # Move the mtime well forward, in case the filesystem's clock is coarse
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def edit_sounds(folder: Path, edit: Callable[[Any], None]) -> None:
+    path = folder / SOUNDS_FILE
+    data = json.loads(path.read_text())
+    edit(data)
+    path.write_text(json.dumps(data))
+    touch(path)
+
+
+class TestReload:
+    def test_unchanged(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        collection = sd.sound_collection
+
+        assert not sd.reload()
+        assert sd.sound_collection is collection
+
+    def test_changed_entry(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        old = sd.sound_collection
+
+        def edit(data: Any) -> None:
+            data["sounds"][0]["files"] = ["example1.opus"]
+
+        edit_sounds(folder, edit)
+        assert sd.reload()
+
+        assert list(sd.sound_collection["s.example"].files()) == [
+            folder / "example1.opus"
+        ]
+        assert sd.sound_collection["s.mysound"] is old["s.mysound"]
+        assert (
+            sd.sound_collection
+            == SoundsDir(
+                folder / SOUNDS_FILE, folder, folder / COMMANDS_FILE
+            ).sound_collection
+        )
+
+    def test_new_glob_file(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        old = sd.sound_collection
+
+        shutil.copy(folder / "mysound-a.opus", folder / "mysound-c.opus")
+        touch(folder)
+        assert sd.reload()
+
+        assert folder / "mysound-c.opus" in sd.sound_collection["s.mysound"].files()
+        assert sd.sound_collection["s.example"] == old["s.example"]
+
+    def test_invalid_keeps_state(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        old = sd.sound_collection
+
+        def edit(data: Any) -> None:
+            data["sounds"][1]["files"] = ["missing.opus"]
+
+        edit_sounds(folder, edit)
+        with pytest.raises(BaseModelError):
+            sd.reload()
+        assert sd.sound_collection is old
+
+    def test_invalid_entry_errors(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+
+        def edit(data: Any) -> None:
+            data["sounds"][1]["files"] = []
+
+        edit_sounds(folder, edit)
+        with pytest.raises(pydantic.ValidationError) as exc_info:
+            sd.reload()
+        assert exc_info.value.errors()[0]["loc"][:3] == ("sounds", 1, "files")
+
+    def test_watcher(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        reloaded: List[SoundsDir] = []
+        watcher = SoundsDirWatcher(sd, reloaded.append)
+
+        assert not watcher.poll()
+        assert watcher.last_poll_seconds is not None
+        edit_sounds(folder, lambda data: data["sounds"].pop(0))
+        # The commands still need s.example, so the reload fails and is logged
+        assert not watcher.poll()
+        assert not reloaded
+        assert "s.example" in sd.sound_collection
+        assert (watcher.reloads, watcher.failures) == (0, 1)
+        assert watcher.last_reload_seconds is None
+
+    def test_rejected_reload_is_retried(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        old = sd.sound_collection
+        checked: List[Any] = []
+
+        def check(sounds: Any) -> None:
+            checked.append(sounds)
+            if len(checked) == 1:
+                raise ValueError("rejected")
+
+        edit_sounds(
+            folder, lambda data: data["sounds"][0].update(files=["example1.opus"])
+        )
+        with pytest.raises(ValueError):
+            sd.reload(check=check)
+        assert sd.sound_collection is old
+
+        # Nothing has changed on disk since, but the rejected reload is retried
+        assert sd.reload(check=check)
+        assert sd.sound_collection is checked[1]
+
+    def test_watcher_check(self, folder: Path):
+        sd = SoundsDir.from_folder(folder)
+        commands = sd.commands_json
+        reloaded: List[SoundsDir] = []
+        watcher = SoundsDirWatcher(sd, reloaded.append, check=commands.check_sounds)
+
+        # The folder's commands no longer need s.example, but the registered ones do
+        commands_path = folder / COMMANDS_FILE
+        data = json.loads(commands_path.read_text())
+        data["commands"][1]["choices"].pop(1)
+        commands_path.write_text(json.dumps(data))
+        touch(commands_path)
+        edit_sounds(folder, lambda data: data["sounds"].pop(0))
+
+        assert not watcher.poll()
+        assert not watcher.poll()
+        assert not reloaded
+        assert "s.example" in sd.sound_collection
+        assert sd.commands_json is commands
+        assert watcher.failures == 2
@@ -0,0 +1,226 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import os
+import shutil
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from wowbot.discord.sound import OggOpusAudio, SoundPlayer
+from wowbot.model.soundsdir import SoundsDir
+from wowbot.model.storage import HTTPStorage, LocalStorage, write_listing
+
+from .test_oggopus import ogg_opus
+
+ROOT = Path("tests/sounds")
+
+
+class Server:
+    """A web server for a folder, which counts requests and can be slowed down"""
+
+    def __init__(self, folder: Path, delay: float = 0.0) -> None:
+        self.requests: List[str] = []
+        self.running = 0
+        self.max_running = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def do_GET(self) -> None:
+                with server._lock:
+                    server.requests.append(self.path)
+                    server.running += 1
+                    server.max_running = max(server.max_running, server.running)
+                try:
+                    time.sleep(server.delay)
+                    super().do_GET()
+                finally:
+                    with server._lock:
+                        server.running -= 1
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(Handler, directory=str(folder))
+        )
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/sounds"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "www" / "sounds"
+    shutil.copytree(ROOT, folder)
+    for index, path in enumerate(sorted(folder.glob("*.opus"))):
+        path.write_bytes(ogg_opus([bytes([index]) * 100]))
+    sd = SoundsDir.from_folder(folder, use_snapshot=False)
+    write_listing(folder, sd.files())
+    return folder
+
+
+@pytest.fixture
+def server(folder: Path) -> Iterator[Server]:
+    server = Server(folder.parent)
+    yield server
+    server.close()
+
+
+def wait_for(check, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestHTTPStorage:
+    def test_resolves_like_folder(self, folder: Path, server: Server, tmp_path: Path):
+        original = SoundsDir.from_folder(folder, use_snapshot=False)
+        storage = HTTPStorage(server.url, tmp_path / "cache", max_bytes=0)
+        try:
+            remote = SoundsDir.from_storage(storage)
+            assert remote.commands_json == original.commands_json
+            for name, sound in original.sound_collection.items():
+                resolved = remote.sound_collection[name]
+                assert resolved.storage is storage
+                assert sorted(
+                    p.relative_to(storage.root) for p in resolved.files()
+                ) == sorted(p.relative_to(folder) for p in sound.files())
+            assert not remote.reload()
+        finally:
+            storage.close()
+
+    def test_fetch_is_cached(self, folder: Path, server: Server, tmp_path: Path):
+        storage = HTTPStorage(server.url, tmp_path / "cache")
+        try:
+            path = storage.root / "example1.opus"
+            assert storage.local_path(path) is None
+            handle = (
+                SoundsDir.from_storage(storage).sound_collection["s.example"].random()
+            )
+            assert handle.storage is storage
+
+            assert storage.fetch(path) == path
+            assert path.read_bytes() == (folder / "example1.opus").read_bytes()
+            assert storage.fetch(path) == path
+            assert server.requests.count("/sounds/example1.opus") == 1
+            assert storage.local_path(path) == path
+
+            assert storage.fetch(storage.root / "missing.opus") is None
+        finally:
+            storage.close()
+
+    def test_cache_is_bounded(self, folder: Path, server: Server, tmp_path: Path):
+        size = (folder / "example1.opus").stat().st_size
+        storage = HTTPStorage(server.url, tmp_path / "cache", max_bytes=size * 3)
+        try:
+            for name in sorted(storage.listing):
+                storage.fetch(storage.root / name)
+                assert storage.cached_bytes() <= size * 3
+            assert storage.evictions == len(storage.listing) - 3
+            cached = sorted(p.name for p in storage.root.glob("*.opus"))
+            assert cached == sorted(storage.listing)[-3:]
+        finally:
+            storage.close()
+
+    def test_retries_failed_prefetch(
+        self, folder: Path, server: Server, tmp_path: Path
+    ):
+        storage = HTTPStorage(server.url, tmp_path / "cache")
+        try:
+            path = storage.root / "example1.opus"
+            moved = (folder / "example1.opus").rename(tmp_path / "example1.opus")
+            storage.prefetch([path])
+            wait_for(lambda: server.requests and not storage._pending)
+            assert storage.local_path(path) is None
+
+            moved.rename(folder / "example1.opus")
+            assert storage.fetch(path) == path
+            assert server.requests.count("/sounds/example1.opus") == 2
+        finally:
+            storage.close()
+
+    def test_prefetch_is_concurrent(self, folder: Path, tmp_path: Path):
+        server = Server(folder.parent, delay=0.1)
+        storage = HTTPStorage(server.url, tmp_path / "cache", jobs=4)
+        try:
+            SoundsDir.from_storage(storage)
+            wait_for(lambda: storage.downloads == len(storage.listing))
+            assert server.max_running > 1
+        finally:
+            storage.close()
+            server.close()
+
+    def test_close_cancels_queued(self, folder: Path, tmp_path: Path):
+        server = Server(folder.parent, delay=0.2)
+        storage = HTTPStorage(server.url, tmp_path / "cache", jobs=1)
+        try:
+            storage.prefetch(storage.root / name for name in storage.listing)
+            wait_for(lambda: server.running == 1)
+        finally:
+            storage.close()
+            server.close()
+        # only the download which had started was finished
+        assert storage.downloads == 1
+        assert len(server.requests) == 2  # and files.json
+
+    def test_cache_survives_restart(self, folder: Path, server: Server, tmp_path: Path):
+        storage = HTTPStorage(server.url, tmp_path / "cache")
+        storage.prefetch(storage.root / name for name in storage.listing)
+        wait_for(lambda: storage.downloads == len(storage.listing))
+        storage.close()
+
+        changed = folder / "example2.opus"
+        changed.write_bytes(ogg_opus([b"changed"]))
+        st = changed.stat()
+        os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        write_listing(folder, (folder / name for name in storage.listing))
+
+        server.requests.clear()
+        storage = HTTPStorage(server.url, tmp_path / "cache")
+        try:
+            for name in storage.listing:
+                path = storage.fetch(storage.root / name)
+                assert path is not None
+                assert path.read_bytes() == (folder / name).read_bytes()
+            assert server.requests == ["/sounds/files.json", "/sounds/example2.opus"]
+        finally:
+            storage.close()
+
+    def test_player_fetches(self, folder: Path, server: Server, tmp_path: Path):
+        storage = HTTPStorage(server.url, tmp_path / "cache")
+        try:
+            sound = SoundsDir.from_storage(storage).sound_collection["s.mysound"]
+            source = asyncio.run(SoundPlayer().get_source(sound))
+            assert isinstance(source, OggOpusAudio)
+            assert len(source.read()) == 101
+            source.cleanup()
+        finally:
+            storage.close()
+
+
+class TestLocalStorage:
+    def test_resolves_like_folder(self, folder: Path):
+        original = SoundsDir.from_folder(folder, use_snapshot=False)
+        local = SoundsDir.from_storage(LocalStorage(folder))
+        assert local.sound_collection == original.sound_collection
+        handle = local.sound_collection["s.example"].random()
+        assert handle.local_path() == handle.path
+        f = handle.open()
+        assert f is not None
+        with f:
+            assert f.read() == handle.path.read_bytes()
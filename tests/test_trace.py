@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+from __future__ import annotations
+
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from wowbot.discord.slash import make_cog
+from wowbot.discord.sound import OggOpusAudio, SoundPlayer
+from wowbot.discord.trace import (
+    LogSink,
+    PlayTrace,
+    PrometheusSink,
+    RingBufferSink,
+    TracedSource,
+    Tracer,
+    make_tracer,
+)
+from wowbot.discord.voice import VoiceManager
+from wowbot.model.soundsdir import SoundsDir
+
+from .fakes import (
+    FakeChannel,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    RecordingVoiceClient,
+)
+from .test_oggopus import FRAMES, ogg_opus
+from .test_player import drain, make_sound
+
+
+@pytest.fixture
+def soundsdir(tmp_path: Path) -> SoundsDir:
+    folder = tmp_path / "sounds"
+    shutil.copytree("tests/sounds", folder)
+    for path in folder.glob("*.opus"):
+        path.write_bytes(ogg_opus(FRAMES))
+    return SoundsDir.from_folder(folder, use_snapshot=False)
+
+
+def play(soundsdir: SoundsDir, tracer: Tracer | None, members_in_voice: List[bool]):
+    """Invoke mycommand once for each member, waiting for each to play"""
+
+    async def main():
+        player = SoundPlayer(voice=VoiceManager(idle_timeout=0), tracer=tracer)
+        cog = make_cog(soundsdir, player)
+        command = next(c for c in cog.get_commands() if c.name == "mycommand")
+        guild = FakeGuild(1)
+        channel = FakeChannel(
+            10, guild, 0, lambda c: RecordingVoiceClient(c, paced=False)
+        )
+        for index, in_voice in enumerate(members_in_voice):
+            member = FakeMember(index, guild, channel if in_voice else None)
+            await command.callback(cog, FakeContext(command.name, member))
+            await drain(player)
+            while guild.voice_client is not None and guild.voice_client.is_playing():
+                await asyncio.sleep(0.001)
+        return guild
+
+    return asyncio.run(main())
+
+
+class TestTracing:
+    def test_phases(self, soundsdir: SoundsDir):
+        ring = RingBufferSink()
+        prometheus = PrometheusSink()
+        play(soundsdir, Tracer([ring, prometheus]), [True, True, False])
+
+        first, second, rejected = ring.traces
+        assert (first.command, first.guild_id, first.sound) == (
+            "mycommand",
+            1,
+            "s.mysound",
+        )
+        assert first.outcome == second.outcome == "played"
+        assert set(first.phases) == {
+            "join",
+            "handshake",
+            "respond",
+            "queue",
+            "source",
+            "start",
+            "total",
+        }
+        # the second invocation reuses the connection
+        assert "handshake" not in second.phases
+        assert first.phases["total"] >= first.phases["join"]
+        assert rejected.outcome == "rejected" and rejected.phases == {}
+
+        text = prometheus.render()
+        assert 'wowbot_plays_total{command="mycommand",outcome="played"} 2' in text
+        assert 'wowbot_plays_total{command="mycommand",outcome="rejected"} 1' in text
+        assert (
+            'wowbot_play_seconds_count{phase="handshake",command="mycommand"} 1' in text
+        )
+        assert (
+            'wowbot_guild_play_seconds_bucket{phase="total",guild="1",le="+Inf"} 2'
+            in text
+        )
+
+    def test_coalesced_and_stopped(self):
+        ring = RingBufferSink()
+        tracer = Tracer([ring])
+        traces = [tracer.start("c", 1, f"s.{i}") for i in range(3)]
+
+        player = SoundPlayer(tracer=tracer)
+        guild = FakeGuild(1)
+
+        async def main():
+            # without a voice client the latest request is stopped
+            for trace in traces:
+                player.enqueue(guild, make_sound(trace.sound), trace)  # type: ignore
+            await drain(player)
+
+        asyncio.run(main())
+        assert [trace.outcome for trace in traces] == [
+            "coalesced",
+            "coalesced",
+            "stopped",
+        ]
+        # none have been emitted before their response
+        assert list(ring.traces) == []
+        for trace in traces:
+            tracer.responded(trace, trace.started)
+        assert list(ring.traces) == traces
+        assert all("respond" in trace.phases for trace in traces)
+
+    def test_traced_source(self, tmp_path: Path):
+        path = tmp_path / "a.opus"
+        path.write_bytes(ogg_opus(FRAMES))
+        ring = RingBufferSink()
+        tracer = Tracer([ring])
+
+        trace = tracer.start("c", 1, "s.a")
+        tracer.responded(trace, None)
+        source = TracedSource(OggOpusAudio(path), tracer, trace)
+        assert source.is_opus()
+        assert source.read() == bytes([0xFC]) + FRAMES[0]
+        assert trace.outcome == "played" and "start" in trace.phases
+        source.read()
+        source.cleanup()
+        assert list(ring.traces) == [trace]
+
+        trace = tracer.start("c", 1, "s.a")
+        tracer.responded(trace, None)
+        TracedSource(OggOpusAudio(path), tracer, trace).cleanup()
+        assert trace.outcome == "stopped"
+
+    def test_disabled(self, soundsdir: SoundsDir):
+        guild = play(soundsdir, None, [True])
+        assert isinstance(guild.voice_client.played[0], OggOpusAudio)
+
+
+class TestSinks:
+    def test_make_tracer(self):
+        assert make_tracer("") is None
+        tracer = make_tracer("log, ring:5,prometheus")
+        assert tracer is not None
+        log, ring, prometheus = tracer.sinks
+        assert isinstance(log, LogSink)
+        assert isinstance(ring, RingBufferSink) and ring.traces.maxlen == 5
+        assert isinstance(prometheus, PrometheusSink)
+        with pytest.raises(ValueError):
+            make_tracer("statsd")
+
+    def test_log(self, caplog: pytest.LogCaptureFixture):
+        trace = PlayTrace("cmd", 3, "s.a", phases={"join": 0.25, "total": 1.5})
+        trace.outcome = "played"
+        with caplog.at_level(logging.INFO):
+            LogSink().emit(trace)
+        assert caplog.messages == [
+            "/cmd s.a in guild 3 played: join=250.0ms total=1500.0ms"
+        ]
+
+    def test_failing_sink(self):
+        class Broken:
+            def emit(self, trace: PlayTrace) -> None:
+                raise RuntimeError
+
+        ring = RingBufferSink()
+        tracer = Tracer([Broken(), ring])
+        trace = tracer.start("c", 1, "s.a")
+        tracer.finish(trace, "failed")
+        tracer.responded(trace, None)
+        assert list(ring.traces) == [trace]
@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import os
+from pathlib import Path
+
+from wowbot.model.transcode import TranscodeCache, file_digest
+
+
+class TestTranscodeCache:
+    def test_get_before_fill(self, tmp_path: Path):
+        source = tmp_path / "source.wav"
+        source.write_bytes(b"not really audio")
+
+        cache = TranscodeCache(tmp_path / "cache")
+        assert cache.get(source) is None
+
+    def test_failed_transcode_is_a_miss(self, tmp_path: Path):
+        source = tmp_path / "source.wav"
+        source.write_bytes(b"not really audio")
+
+        cache = TranscodeCache(
+            tmp_path / "cache", executable=str(tmp_path / "no-such-ffmpeg")
+        )
+        cache.fill([source])
+        assert cache.get(source) is None
+
+    def test_existing_rendition_is_reused(self, tmp_path: Path):
+        source = tmp_path / "source.wav"
+        source.write_bytes(b"not really audio")
+        duplicate = tmp_path / "duplicate.wav"
+        duplicate.write_bytes(source.read_bytes())
+
+        # a missing executable proves that nothing is transcoded
+        cache = TranscodeCache(
+            tmp_path / "cache", executable=str(tmp_path / "no-such-ffmpeg")
+        )
+        rendition = cache._rendition_path(file_digest(source))
+        rendition.parent.mkdir(parents=True)
+        rendition.write_bytes(b"OggS")
+
+        cache.fill([source, duplicate])
+        assert cache.get(source) == rendition
+        assert cache.get(duplicate) == rendition
+
+        # a modified file is a miss until it is filled again
+        source.write_bytes(b"different audio")
+        os.utime(source, ns=(0, 0))
+        assert cache.get(source) is None
+        assert cache.get(duplicate) == rendition
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2022-present hrmorley34 <henry@morley.org.uk>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import time
+
+from discord import AudioSource
+
+from wowbot.discord.voice import VoiceManager
+
+from .fakes import FakeChannel, FakeGuild
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestVoiceManager:
+    def test_connect_reuse_move(self):
+        guild = FakeGuild(1)
+        a, b = FakeChannel(10, guild), FakeChannel(11, guild)
+        voice = VoiceManager()
+
+        first = run(voice.connect(a))  # type: ignore
+        assert run(voice.connect(a)) is first  # type: ignore
+        assert run(voice.connect(b)) is first  # type: ignore
+
+        assert first.channel is b
+        assert (a.connects, b.connects) == (1, 0)
+        stats = voice.stats()[1]
+        assert (stats["connects"], stats["reuses"], stats["moves"]) == (1, 1, 1)
+        assert stats["age"] >= 0
+
+    def test_reconnect_after_drop(self):
+        guild = FakeGuild(1)
+        channel = FakeChannel(10, guild)
+        voice = VoiceManager()
+
+        first = run(voice.connect(channel))  # type: ignore
+        first.connected = False
+        second = run(voice.connect(channel))  # type: ignore
+
+        assert second is not first
+        assert voice.stats()[1]["connects"] == 2
+
+    def test_sweep(self):
+        guilds = [FakeGuild(i) for i in range(3)]
+        voice = VoiceManager(idle_timeout=60)
+        clients = [
+            run(voice.connect(FakeChannel(10 + i, g)))  # type: ignore
+            for i, g in enumerate(guilds)
+        ]
+        clients[1].play(AudioSource())
+        clients[2].connected = False
+
+        assert run(voice.sweep(time.monotonic() + 30)) == 0
+        assert set(voice.stats()) == {0, 1}
+
+        assert run(voice.sweep(time.monotonic() + 61)) == 1
+        assert guilds[0].voice_client is None
+        assert guilds[1].voice_client is clients[1]
+        assert set(voice.stats()) == {1}
+        assert voice.reclaimed == 1
+
+    def test_no_idle_timeout(self):
+        guild = FakeGuild(1)
+        voice = VoiceManager(idle_timeout=0)
+        run(voice.connect(FakeChannel(10, guild)))  # type: ignore
+
+        assert run(voice.sweep(time.monotonic() + 10**6)) == 0
+        assert guild.voice_client is not None